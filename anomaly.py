@@ -0,0 +1,176 @@
+import argparse
+import json
+import logging
+import math
+import time
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import log_config
+from etl.counters import decode_counter_history
+from etl.history import HistoryFile, atomic_write
+from models import to_json
+
+logger = logging.getLogger(__name__)
+
+# Values tracked for each channel type. Codeword counters only ever grow (until a reboot resets them), so their
+# deltas between samples are tracked instead.
+channel_metrics = {'downstream': ['power_dbmv', 'snr', 'corrected_delta', 'uncorrected_delta'],
+                   'upstream': ['power_dbmv']}
+counter_metrics = {'corrected_delta': 'corrected', 'uncorrected_delta': 'uncorrected'}
+
+# Smallest standard deviation a metric is judged against, so a channel that has been perfectly flat isn't
+# flagged for a change within the device's reporting precision
+min_stds = {'power_dbmv': 0.5, 'snr': 0.5, 'corrected_delta': 100.0, 'uncorrected_delta': 10.0}
+
+
+class Anomaly(NamedTuple):
+    channel_type: str
+    channel_id: int
+    metric: str
+    value: float
+    mean: float
+    std: float
+    z_score: float
+
+    def to_desc(self) -> str:
+        # The numbers are left out so that each channel and metric makes one event catalog template
+        return 'Anomaly: {} channel {} {} {}'.format(self.channel_type, self.channel_id, self.metric,
+                                                    'rose' if self.z_score > 0 else 'fell')
+
+
+def build_state_path(device_id: str) -> Path:
+    return Path('devices', device_id, 'anomaly.json')
+
+
+class AnomalyDetector:
+    # Streaming detector over channel samples. Each metric of each channel keeps an exponentially weighted moving
+    # mean and variance ([count, mean, var]), so a sample is judged and folded in with O(1) work and state. A
+    # sample further than threshold standard deviations from the mean is an anomaly (once warmup samples are in).
+    def __init__(self, alpha: float = 0.1, threshold: float = 4.0, warmup: int = 10):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        # '<channel_type>/<channel_id>' -> {metric: [count, mean, var], counter: last value}
+        self.channels = dict()
+
+    def __repr__(self):
+        return '{}(alpha={}, threshold={}, channels={})'.format(self.__class__.__name__, self.alpha, self.threshold,
+                                                                len(self.channels))
+
+    def load(self, state_file: Path):
+        if state_file.exists():
+            with state_file.open() as json_file:
+                self.channels = json.load(json_file).get('channels', dict())
+        return self
+
+    def save(self, state_file: Path):
+        with atomic_write(state_file) as json_file:
+            json.dump({'alpha': self.alpha, 'channels': self.channels}, fp=json_file, sort_keys=True)
+
+    def update_metric(self, state: list, value: float, min_std: float) -> Optional[Tuple[float, float, float]]:
+        # (mean, std, z-score) the value was judged against if it's an anomaly
+        count, mean, var = state
+        anomaly = None
+        if count >= self.warmup:
+            std = max(math.sqrt(var), min_std)
+            z_score = (value - mean) / std
+            if abs(z_score) > self.threshold:
+                anomaly = (mean, std, z_score)
+
+        if count:
+            diff = value - mean
+            increment = self.alpha * diff
+            state[1] = mean + increment
+            state[2] = (1 - self.alpha) * (var + diff * increment)
+        else:
+            state[1] = value
+        state[0] = count + 1
+        return anomaly
+
+    def update_channel(self, channel_type: str, channel: dict) -> List[Anomaly]:
+        lock_status = channel.get('lock_status', None)
+        if lock_status is not None and lock_status != 'Locked':
+            return list()
+
+        channel_id = channel.get('channel_id', None)
+        state = self.channels.setdefault('{}/{}'.format(channel_type, channel_id), dict())
+        anomalies = list()
+        for metric in channel_metrics[channel_type]:
+            counter = counter_metrics.get(metric, None)
+            if counter:
+                value = channel.get(counter, None)
+                last_value = state.get(counter, None)
+                state[counter] = value
+                # A counter going backwards means the device was reset; there's no delta for this sample
+                if value is None or last_value is None or value < last_value:
+                    continue
+                value = value - last_value
+            else:
+                value = channel.get(metric, None)
+                if value is None:
+                    continue
+
+            judged = self.update_metric(state.setdefault(metric, [0, 0.0, 0.0]), value, min_stds[metric])
+            if judged:
+                anomalies.append(Anomaly(channel_type, channel_id, metric, value, *judged))
+        return anomalies
+
+    def update(self, details) -> List[Anomaly]:
+        # details is a ConnectionDetails or its JSON form
+        details = details if isinstance(details, dict) else json.loads(json.dumps(details, default=to_json))
+        anomalies = list()
+        for channel_type in channel_metrics.keys():
+            for channel in details.get('{}_channels'.format(channel_type), None) or list():
+                anomalies.extend(self.update_channel(channel_type, channel))
+        return anomalies
+
+
+def count_anomalous_channels(anomalies: List[Anomaly]) -> int:
+    return len({(a.channel_type, a.channel_id) for a in anomalies})
+
+
+def iter_channel_histories(device_id: str) -> Iterator[Tuple[str, Path]]:
+    for channel_type in channel_metrics.keys():
+        for channel_file in sorted(Path('devices', device_id, 'details', channel_type).glob('ch*.json')):
+            yield channel_type, channel_file
+
+
+def backtest(device_id: str, detector: AnomalyDetector) -> Iterator[Tuple[str, Anomaly]]:
+    # (timestamp, anomaly) for each anomaly the detector finds over the channel histories
+    for (channel_type, channel_file) in iter_channel_histories(device_id):
+        with HistoryFile(channel_file) as history:
+            records = decode_counter_history(list(history.iter_range()))
+        for record in records:
+            for anomaly in detector.update_channel(channel_type, record):
+                yield record.get('timestamp', None), anomaly
+
+
+def main():
+    log_config.configure('anomaly.log')
+
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(description='Run the anomaly detector over the channel histories of a device',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--alpha', type=float, default=0.1, help='Weight of each new sample in the moving average')
+    parser.add_argument('--threshold', type=float, default=4.0, help='Standard deviations that make an anomaly')
+    parser.add_argument('--warmup', type=int, default=10, help='Samples of a channel before it is judged')
+    parser.add_argument('device_id', choices=supported_devices.keys())
+    args = parser.parse_args()
+
+    detector = AnomalyDetector(args.alpha, args.threshold, args.warmup)
+    started_at = time.monotonic()
+    found = 0
+    for (timestamp, anomaly) in backtest(args.device_id, detector):
+        print(json.dumps(dict(anomaly._asdict(), timestamp=timestamp), sort_keys=True))
+        found += 1
+    samples = sum(s[m][0] for s in detector.channels.values() for m in s if isinstance(s[m], list))
+    elapsed = time.monotonic() - started_at
+    logger.info('Found {} anomalies in {} samples of {} channels ({:.0f} samples/sec)'.format(
+        found, samples, len(detector.channels), samples / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ import logging
 
 import log_config
 from devices import create_device
+from models import to_json
 
 log_config.configure('api_tester.log')
 logger = logging.getLogger('api_tester')
@@ -20,7 +21,7 @@ def main():
 
     device_attrs = supported_devices.get(args.device_id)
 
-    device = create_device(args.device_id)
+    device = create_device(args.device_id, device_attrs.get('device_type', None))
     device.login(device_attrs['scheme'], device_attrs['host'], device_attrs['username'], device_attrs['password'])
 
     if args.action == 'reboot':
@@ -31,15 +32,15 @@ def main():
         for command in device.get_commands():
             if command.read_only:
                 logger.info('Testing {}...'.format(command))
-                print(json.dumps(device.do_command(command), default=lambda o: o.__dict__))
+                print(json.dumps(device.do_command(command), default=to_json))
     elif args.action == 'device':
-        print(json.dumps(device.get_device_info(), default=lambda o: o.__dict__))
+        print(json.dumps(device.get_device_info(), default=to_json))
     elif args.action == 'summary':
-        print(json.dumps(device.get_connection_summary(), default=lambda o: o.__dict__))
+        print(json.dumps(device.get_connection_summary(), default=to_json))
     elif args.action == 'details':
-        print(json.dumps(device.get_connection_details(), default=lambda o: o.__dict__))
+        print(json.dumps(device.get_connection_details(), default=to_json))
     elif args.action == 'events':
-        print(json.dumps(device.get_events(), default=lambda o: o.__dict__))
+        print(json.dumps(device.get_events(), default=to_json))
 
     device.logout()
 
@@ -0,0 +1,72 @@
+import json
+import logging
+import zlib
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+from segment_log import SegmentLog
+
+logger = logging.getLogger(__name__)
+
+# zlib only looks back 32KB, so a longer preset dictionary would be wasted
+max_zdict_bytes = 32 * 1024
+
+
+class CapturedResponse(NamedTuple):
+    offset: int
+    epoch: float
+    key: str
+    status_code: int
+    text: str
+
+
+def build_capture_path(device_id: str) -> Path:
+    return Path('devices', device_id, 'captures')
+
+
+class ResponseCapture:
+    # Raw HNAP responses of a device, appended to a segment log. Responses to the same request barely differ, so
+    # the first response seen for each request key is kept as a zlib preset dictionary and every later response
+    # is compressed against it (typically to a few percent of its size). Records stay independently readable.
+    def __init__(self, path: Path):
+        self.path = path
+        self.log = SegmentLog(path / 'segments')
+        self.dicts_path = path / 'dicts'
+        self.zdicts = dict()
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.path)
+
+    def build_zdict_path(self, key: str) -> Path:
+        return self.dicts_path / '{}.zdict'.format(key)
+
+    def get_zdict(self, key: str, sample: bytes = None) -> bytes:
+        if key not in self.zdicts:
+            zdict_file = self.build_zdict_path(key)
+            if zdict_file.exists():
+                self.zdicts[key] = zdict_file.read_bytes()
+            elif sample is not None:
+                self.dicts_path.mkdir(parents=True, exist_ok=True)
+                zdict_file.write_bytes(sample[-max_zdict_bytes:])
+                self.zdicts[key] = sample[-max_zdict_bytes:]
+            else:
+                raise ValueError('No dictionary for {} in {}'.format(key, self))
+        return self.zdicts[key]
+
+    def capture(self, key: str, status_code: int, text: str, epoch: float = None) -> int:
+        data = text.encode()
+        compressor = zlib.compressobj(level=9, zdict=self.get_zdict(key, sample=data))
+        body = compressor.compress(data) + compressor.flush()
+        meta = json.dumps({'key': key, 'status_code': status_code}).encode()
+        return self.log.append(meta + b'\n' + body, epoch)
+
+    def read(self, offset: int = 0) -> Iterator[CapturedResponse]:
+        for (record_offset, epoch, payload) in self.log.read(offset):
+            meta, _, body = payload.partition(b'\n')
+            meta = json.loads(meta)
+            decompressor = zlib.decompressobj(zdict=self.get_zdict(meta['key']))
+            text = (decompressor.decompress(body) + decompressor.flush()).decode()
+            yield CapturedResponse(record_offset, epoch, meta['key'], meta['status_code'], text)
+
+    def close(self):
+        self.log.close()
@@ -5,7 +5,7 @@ script_source="$(dirname ${0})"
 cd "${script_source}"
 source "${script_source}"/venv/bin/activate
 
-etl_types="summary events details"
+etl_types="summary events details rollups nodes archive retention"
 
 device_id="${1}"
 
@@ -4,7 +4,10 @@ from datetime import datetime
 from pathlib import Path
 from typing import List
 
+from etl import build_stats_log
+from etl.history import HistoryFile, append_history, atomic_write
 from hnap import HNAPDevice
+from models import to_json
 
 
 def get_local_ip():
@@ -17,9 +20,20 @@ def get_local_ip():
         s.close()
 
 
-def build_unique_stats_path(device: HNAPDevice, stat_type: str) -> Path:
-    unique = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-    return Path('devices', device.device_id, stat_type, '{}.json'.format(unique))
+# Open stats logs by (device_id, stat_type); a monitor process is their only writer
+stats_logs = dict()
+
+
+def append_stats(device: HNAPDevice, stat_type: str, timestamped_json_result: dict) -> int:
+    # Append a result to the stat type's log for the ETL to consume; returns its offset
+    key = (device.device_id, stat_type)
+    if key not in stats_logs:
+        stats_logs[key] = build_stats_log(Path('devices', device.device_id, stat_type))
+    return stats_logs[key].append(json.dumps(timestamped_json_result, default=to_json).encode())
+
+
+def build_metrics_path(device: HNAPDevice) -> Path:
+    return Path('devices', device.device_id, 'metrics.json')
 
 
 def calc_stats_ts(file: Path) -> str:
@@ -36,25 +50,27 @@ def build_stats_history_path(device: HNAPDevice, stat_type: str) -> Path:
     return Path('devices', device.device_id, stat_type, '{}.json'.format(stat_type))
 
 
-def get_stats_history(device: HNAPDevice, stat_type: str, logger) -> List[dict]:
+def get_stats_history(device: HNAPDevice, stat_type: str, logger, since: str = None) -> List[dict]:
     stats_file = build_stats_history_path(device, stat_type)
     if not stats_file.exists():
         logger.debug('history: {} not found'.format(stats_file))
         return list()
 
-    with stats_file.open() as json_file:
-        history = json.load(json_file)
+    # Entries are sorted by timestamp, so only the ones since the given timestamp need to be decoded
+    with HistoryFile(stats_file) as stats_history:
+        history = list(stats_history.iter_range(since))
     logger.debug('history: Found {} entries in {}'.format(len(history), stats_file))
     return history
 
 
 def set_stats_history(device: HNAPDevice, stat_type: str, history: List[dict], logger):
     stats_file = build_stats_history_path(device, stat_type)
-    with stats_file.open(mode='w') as json_file:
+    with atomic_write(stats_file) as json_file:
         logger.debug('history: Setting {} with {} entries'.format(stats_file, len(history)))
-        json.dump(history, fp=json_file, default=lambda o: o.__dict__, sort_keys=True, indent=2)
+        json.dump(history, fp=json_file, default=to_json, sort_keys=True, indent=2)
 
 
 def append_stats_history(device: HNAPDevice, stat_type: str, entries_to_append: List[dict], logger):
-    history = get_stats_history(device, stat_type, logger)
-    set_stats_history(device, stat_type, history + entries_to_append, logger)
+    stats_file = build_stats_history_path(device, stat_type)
+    logger.debug('history: Appending {} entries to {}'.format(len(entries_to_append), stats_file))
+    append_history(stats_file, entries_to_append)
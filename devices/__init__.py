@@ -1,14 +1,12 @@
 from hnap import HNAPDevice
 
 
-def create_device(device_id: str) -> HNAPDevice:
-    if device_id == 'arris':
-        from devices.arris import ArrisDevice
-
-        return ArrisDevice(device_id)
-    elif device_id == 'motorola':
-        from devices.motorola import MotorolaDevice
-
-        return MotorolaDevice(device_id)
-    else:
-        raise ValueError('No device for id={}'.format(device_id))
+def create_device(device_id: str, device_type: str = None) -> HNAPDevice:
+    # Devices are named after their type unless the device entry says otherwise
+    from devices.profile import ProfileDevice, compiled_profiles
+
+    device_type = device_type or device_id
+    profile = compiled_profiles.get(device_type, None)
+    if not profile:
+        raise ValueError('No device for id={}, type={}'.format(device_id, device_type))
+    return ProfileDevice(device_id, profile)
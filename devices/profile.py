@@ -0,0 +1,262 @@
+import json
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from etl.counters import parse_uptime
+from hnap import HNAPDevice, HNAPCommand, GetMultipleCommands
+from models import ConnectionSummary, ConnectionDetails, EventLogEntry, DownstreamChannelStats, UpstreamChannelStats, \
+    DeviceInfo
+from timestamps import TimestampParser, to_epoch, from_epoch
+
+logger = logging.getLogger(__name__)
+
+# Each device type is described by a profile (see profiles.json): the operations to call, which response keys
+# map to which model attributes, and how delimited tables (channels, events) are laid out. Profiles are compiled
+# into extractor functions once, when this module is imported.
+profiles_file = Path(__file__).parent / 'profiles.json'
+
+models = {'device_info': DeviceInfo,
+          'summary': ConnectionSummary,
+          'details': ConnectionDetails}
+
+table_models = {'downstream_channels': DownstreamChannelStats,
+                'upstream_channels': UpstreamChannelStats}
+
+converters = {'str': lambda v: v.strip(),
+              'int': lambda v: int(v.strip()),
+              'float': lambda v: float(v.strip())}
+
+
+def compile_setter(path: str) -> Callable[[object, object], None]:
+    # e.g. 'uptime' or 'startup_steps.boot.status' (dict keys and attributes are both followed)
+    parts = path.split('.')
+    name = parts[len(parts) - 1]
+    parents = parts[:len(parts) - 1]
+
+    def setter(obj, value):
+        for part in parents:
+            obj = obj[part] if isinstance(obj, dict) else getattr(obj, part)
+        setattr(obj, name, value)
+
+    return setter
+
+
+def compile_field(path: str, field_spec) -> Callable[[object, dict], None]:
+    # A field is either the response key or {"key": ..., "type": "int"|"float"|"str", "default": ...}
+    setter = compile_setter(path)
+    if isinstance(field_spec, str):
+        return lambda obj, section: setter(obj, section.get(field_spec))
+
+    key = field_spec['key']
+    default = field_spec.get('default', None)
+    convert = {'int': int, 'float': float, 'str': str}[field_spec.get('type', 'str')]
+    return lambda obj, section: setter(obj, convert(section.get(key, default)))
+
+
+def compile_table(table_spec: dict) -> Callable[[dict], List[dict]]:
+    # Tables are a single value holding delimited records of delimited values, e.g. 1^Locked^QAM256^32|+|2^...
+    key = table_spec['key']
+    record_delimiter = table_spec['record_delimiter']
+    field_delimiter = table_spec['field_delimiter']
+    columns = [(name, index, converters[col_type]) for (name, (index, col_type)) in table_spec['columns'].items()]
+
+    def parse(section: dict) -> List[dict]:
+        rows = []
+        for record in section.get(key).split(record_delimiter):
+            values = record.split(field_delimiter)
+            rows.append({name: convert(values[index]) for (name, index, convert) in columns})
+        return rows
+
+    return parse
+
+
+def compile_model(model_name: str, model_spec: dict) -> Callable[[HNAPDevice], object]:
+    model_class = models[model_name]
+    fields = [(operation, compile_field(path, field_spec))
+              for (operation, section_spec) in model_spec.get('fields', dict()).items()
+              for (path, field_spec) in section_spec.items()]
+    tables = [(name, table_spec['operation'], compile_table(table_spec), table_models[name])
+              for (name, table_spec) in model_spec.get('tables', dict()).items()]
+
+    operations = list(model_spec.get('fields', dict()).keys())
+    operations.extend(operation for (_, operation, _, _) in tables if operation not in operations)
+
+    def extract(device: HNAPDevice):
+        sections = device.get_sections(operations)
+        model = model_class()
+        for (operation, set_field) in fields:
+            set_field(model, sections[operation])
+        for (name, operation, parse, row_class) in tables:
+            rows = [row_class(**row) for row in parse(sections[operation])]
+            setattr(model, name, rows)
+            logger.debug('Found {} {} for {}'.format(len(rows), name.replace('_', ' '), device))
+        return model
+
+    extract.operations = operations
+    return extract
+
+
+class CompiledProfile:
+    def __init__(self, name: str, profile: dict):
+        self.name = name
+        self.commands = profile['commands']
+        self.reboot = profile['reboot']
+        self.timestamp_parser = TimestampParser(profile['date_format'], profile['time_format'])
+        self.event_priorities = {getattr(logging, level): priority
+                                 for (level, priority) in profile['event_priorities'].items()}
+        self.extractors = {model_name: compile_model(model_name, profile[model_name])
+                           for model_name in models.keys() if model_name in profile}
+        self.events_operation = profile['events']['operation']
+        self.parse_events = compile_table(profile['events'])
+        # Seconds a section response is reused for; operations not listed are fetched on every call. The event
+        # log is polled adaptively between min and max instead.
+        self.poll_intervals = profile.get('poll_intervals', dict())
+        self.min_events_poll_interval = profile['events'].get('min_poll_interval', 0)
+        self.max_events_poll_interval = profile['events'].get('max_poll_interval', 0)
+        # The section and key holding the device's uptime, which going down means the device restarted
+        self.uptime = profile.get('uptime', None)
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.name)
+
+
+def load_profiles(path: Path = profiles_file) -> Dict[str, CompiledProfile]:
+    with path.open() as json_file:
+        profiles = json.load(json_file)
+    return {name: CompiledProfile(name, profile) for (name, profile) in profiles.items()}
+
+
+compiled_profiles = load_profiles()
+
+
+class ProfileDevice(HNAPDevice):
+    def __init__(self, device_id: str, profile: CompiledProfile):
+        super().__init__(device_id)
+        self.profile = profile
+        self.clock = time.monotonic
+        # Section responses by operation, with the clock time each expires
+        self.section_cache = dict()
+        self.last_uptime = None
+        self.events_poll_interval = profile.min_events_poll_interval
+
+    def build_reboot_command(self) -> HNAPCommand:
+        return HNAPCommand(self.profile.reboot['operation'], payload_default=self.profile.reboot['payload'],
+                           read_only=False)
+
+    def fetch_sections(self, operations: List[str]) -> Dict[str, dict]:
+        # Response sections by operation; several operations are fetched with one request
+        if len(operations) == 1:
+            return {operations[0]: self.do_command(HNAPCommand(operations[0]))}
+        response = self.do_command(GetMultipleCommands([HNAPCommand(o) for o in operations]))
+        return {o: response['{}Response'.format(o)] for o in operations}
+
+    def get_sections(self, operations: List[str]) -> Dict[str, dict]:
+        # Like fetch_sections, but slow-changing sections (see poll_intervals) are reused until they expire
+        now = self.clock()
+        stale = [o for o in operations if o not in self.section_cache or self.section_cache[o][0] <= now]
+        fetched = list(stale)
+        uptime_operation = self.profile.uptime['operation'] if self.profile.uptime else None
+        if uptime_operation and uptime_operation not in stale and \
+                any(o in self.profile.poll_intervals for o in operations):
+            # Cached sections are only reused while the uptime shows the device hasn't restarted since they were
+            # fetched, so it is fetched along (in the same request) by polls that don't need it, e.g. the summary
+            fetched.append(uptime_operation)
+        sections = self.fetch_sections(fetched) if fetched else dict()
+        if self.is_restarted(sections):
+            # Whatever was cached before the restart (e.g. the startup sequence) no longer holds
+            logger.info('{} restarted; fetching its cached sections again'.format(self))
+            self.invalidate_sections()
+            cached = [o for o in operations if o not in stale]
+            if cached:
+                sections.update(self.fetch_sections(cached))
+                stale.extend(cached)
+        for operation in stale:
+            poll_interval = self.profile.poll_intervals.get(operation, 0)
+            if poll_interval:
+                self.section_cache[operation] = (now + poll_interval, sections[operation])
+        for operation in operations:
+            if operation not in sections:
+                sections[operation] = self.section_cache[operation][1]
+        logger.debug('Fetched {} of {} sections for {}'.format(len(stale), len(operations), self))
+        return sections
+
+    def is_restarted(self, sections: Dict[str, dict]) -> bool:
+        # Whether the uptime in the fetched sections is lower than the last one seen (e.g. a reboot we didn't do)
+        if not self.profile.uptime or self.profile.uptime['operation'] not in sections:
+            return False
+        uptime = parse_uptime(sections[self.profile.uptime['operation']].get(self.profile.uptime['key'], None))
+        if uptime is None:
+            return False
+        last_uptime = self.last_uptime
+        self.last_uptime = uptime
+        return last_uptime is not None and uptime < last_uptime
+
+    def invalidate_sections(self):
+        self.section_cache.clear()
+
+    def get_commands(self) -> list:
+        return [HNAPCommand(operation) for operation in self.profile.commands] + [self.build_reboot_command()]
+
+    def get_model(self, model_name: str):
+        extract = self.profile.extractors.get(model_name, None)
+        if not extract:
+            raise NotImplementedError('{} has no {} in its profile'.format(self.profile, model_name))
+        return extract(self)
+
+    def get_device_info(self) -> DeviceInfo:
+        info = self.get_model('device_info')
+        for attr in ['model', 'serial_number', 'mac_address']:
+            if getattr(info, attr) is not None:
+                setattr(self, attr, getattr(info, attr))
+        return info
+
+    def get_connection_summary(self) -> ConnectionSummary:
+        return self.get_model('summary')
+
+    def get_connection_details(self) -> ConnectionDetails:
+        return self.get_model('details')
+
+    def get_events(self) -> list:
+        # The event log is re-read sooner while it is changing and backs off (up to max_poll_interval) while it
+        # isn't; in between, the cached log is parsed again so callers see the same list
+        operation = self.profile.events_operation
+        cached = self.section_cache.get(operation, None)
+        response = self.get_sections([operation])[operation]
+        if self.profile.max_events_poll_interval and (not cached or cached[1] is not response):
+            if cached and cached[1] == response:
+                self.events_poll_interval = min(self.events_poll_interval * 2, self.profile.max_events_poll_interval)
+            else:
+                self.events_poll_interval = self.profile.min_events_poll_interval
+            self.section_cache[operation] = (self.clock() + self.events_poll_interval, response)
+
+        events = []
+        prev_epoch = to_epoch(datetime.min)
+        for raw_event in self.profile.parse_events(response):
+            try:
+                epoch = self.parse_timestamp(raw_event['date'], raw_event['time'])
+            except ValueError:
+                epoch = prev_epoch + 1
+            prev_epoch = epoch
+
+            events.append(EventLogEntry(timestamp=epoch, priority=raw_event['priority'], desc=raw_event['desc']))
+
+        logger.debug('Found {} events for {}'.format(len(events), self))
+        return events
+
+    def reboot(self):
+        logger.warning('Rebooting {}'.format(self))
+        self.do_command(self.build_reboot_command())
+        self.invalidate_session()
+        self.invalidate_sections()
+
+    def parse_timestamp(self, date: str, time: str) -> float:
+        return self.profile.timestamp_parser.parse(date, time)
+
+    def to_timestamp(self, date: str, time: str) -> datetime:
+        return from_epoch(self.parse_timestamp(date, time))
+
+    def to_event_priority(self, level: int):
+        return self.profile.event_priorities.get(level, 'UNKNOWN {}'.format(level))
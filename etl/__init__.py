@@ -1,6 +1,24 @@
 import json
+from collections import OrderedDict
 from pathlib import Path
-from typing import List
+from typing import Callable, List
+
+from etl.checkpoint import Checkpoint, etl_lock
+from etl.history import update_history_index, atomic_write
+from etl.partitions import find_src_files, move_to_processed
+from models import to_json
+from segment_log import SegmentLog, record_header
+
+# Parsed histories are kept between source files (and between files in watch mode) so that a history is
+# only parsed again when something else changed it. Entries are validated against the file's mtime/size.
+history_cache_size = 256
+history_cache = OrderedDict()
+
+# Unchanged polls counted against the last entry of each channel history (see etl.counters.count_unchanged_sample),
+# by channel file, e.g. {'downstream/ch01.json': {'timestamp': ..., 'samples': 3, 'last_timestamp': ...}}. They
+# are kept apart so an unchanged poll doesn't rewrite the history; the count moves into the entry once the
+# history is written with a new entry after it.
+pending_samples_file_name = 'samples.json'
 
 
 class TimestampedResult:
@@ -14,10 +32,57 @@ class TimestampedResult:
 
 
 def sort_unique_ts_history(ts_history: List[dict]) -> List[dict]:
-    unique_ts_history = {json.dumps(d, sort_keys=True) for d in ts_history}
-    unique_ts_history = [json.loads(d) for d in unique_ts_history]
-    unique_ts_history = sorted(unique_ts_history, key=lambda e: e.get('timestamp', None))
-    return unique_ts_history
+    unique_ts_history = {json.dumps(d, default=to_json, sort_keys=True) for d in ts_history}
+    # Entries with the same timestamp are ordered by their content, so the result doesn't depend on set order
+    unique_ts_history = sorted(((json.loads(d), d) for d in unique_ts_history),
+                               key=lambda e: (e[0].get('timestamp', None) or '', e[1]))
+    return [e for (e, _) in unique_ts_history]
+
+
+def read_ts_history(history_file: Path, logger) -> List[dict]:
+    if not history_file.exists():
+        history_cache.pop(history_file, None)
+        return list()
+
+    stat = history_file.stat()
+    cached = history_cache.get(history_file, None)
+    if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        history_cache.move_to_end(history_file)
+        return cached[1]
+
+    with history_file.open() as json_file:
+        logger.debug('Reading {}'.format(history_file))
+        ts_history = json.load(json_file)
+    cache_ts_history(history_file, ts_history)
+    return ts_history
+
+
+def write_ts_history(history_file: Path, ts_history: List[dict], logger):
+    with atomic_write(history_file) as json_file:
+        logger.debug('Updating {} with {} entries'.format(history_file, len(ts_history)))
+        json.dump(ts_history, fp=json_file, default=to_json, sort_keys=True, indent=2)
+    cache_ts_history(history_file, ts_history)
+
+
+def cache_ts_history(history_file: Path, ts_history: List[dict]):
+    stat = history_file.stat()
+    history_cache[history_file] = ((stat.st_mtime_ns, stat.st_size), ts_history)
+    history_cache.move_to_end(history_file)
+    while len(history_cache) > history_cache_size:
+        history_cache.popitem(last=False)
+
+
+def read_pending_samples(root_path: Path) -> dict:
+    pending_samples_file = root_path / pending_samples_file_name
+    if not pending_samples_file.exists():
+        return dict()
+    with pending_samples_file.open() as json_file:
+        return json.load(json_file)
+
+
+def write_pending_samples(root_path: Path, pending_samples: dict):
+    with atomic_write(root_path / pending_samples_file_name) as json_file:
+        json.dump(pending_samples, fp=json_file, sort_keys=True, indent=2)
 
 
 def compare_ts_history_with_current(ts_history: List[dict], cur_result: dict, cur_ts: str, logger) -> bool:
@@ -36,30 +101,108 @@ def compare_ts_history_with_current(ts_history: List[dict], cur_result: dict, cu
     return True
 
 
-def finalize_target_file(target_file: Path, logger) -> bool:
+def finalize_target_file(target_file: Path, logger, is_sorted: bool = False) -> bool:
     if not target_file.exists():
         return False
 
-    with target_file.open(mode='r') as json_file:
-        logger.debug('Reading {}'.format(target_file))
-        ts_history = json.load(json_file)
+    # A target known to be sorted and unique (see Checkpoint.is_sorted) doesn't need to be parsed
+    changed = False if is_sorted else sort_unique_target_file(target_file, logger)
+
+    # The history is sorted now; keep its sidecar timestamp index in step
+    if update_history_index(target_file):
+        logger.debug('Updated index for {}'.format(target_file))
+    return changed
+
+
+def sort_unique_target_file(target_file: Path, logger) -> bool:
+    ts_history = read_ts_history(target_file, logger)
 
     # Remove duplicates and sort
     unique_ts_history = sort_unique_ts_history(ts_history)
     if ts_history == unique_ts_history:
         return False
 
-    with target_file.open(mode='w') as json_file:
-        logger.debug('Updating {} from {} to {} entries'.format(target_file, len(ts_history), len(unique_ts_history)))
-        json.dump(unique_ts_history, fp=json_file, default=lambda o: o.__dict__, sort_keys=True, indent=2)
+    logger.debug('Updating {} from {} to {} entries'.format(target_file, len(ts_history), len(unique_ts_history)))
+    write_ts_history(target_file, unique_ts_history, logger)
     return True
 
 
-def finalize_target_files(root_path: Path, target_file_patterns: list, logger):
+def build_stats_log(root_path: Path) -> SegmentLog:
+    # The monitor appends each result for the stat type to this log (see common.append_stats)
+    return SegmentLog(root_path / 'log', max_segment_bytes=4 * 1024 * 1024)
+
+
+def count_pending_log_bytes(root_path: Path, checkpoint: Checkpoint) -> int:
+    return build_stats_log(root_path).get_end_offset() - checkpoint.log_offset
+
+
+def process_stats_log(root_path: Path, checkpoint: Checkpoint, apply_stats: Callable[[dict], None], logger) -> int:
+    # Apply the records appended since the checkpoint, in order, recording the offset after each one
+    applied = 0
+    for (offset, _, payload) in build_stats_log(root_path).read(checkpoint.log_offset):
+        apply_stats(json.loads(payload))
+        checkpoint.set_log_offset(offset + record_header.size + len(payload))
+        applied += 1
+    if applied:
+        logger.info('Applied {} records from {}/log; now at offset {}'.format(applied, root_path,
+                                                                             checkpoint.log_offset))
+    return applied
+
+
+def finalize_target_files(root_path: Path, target_file_patterns: list, logger, checkpoint: Checkpoint = None):
+    # Targets finalized by a previous run (and untouched since) don't need to be finalized again
+    changed_targets = set(checkpoint.get_changed_targets()) if checkpoint else None
+
     # Sort and remove duplicates from target file(s)
     for target_file_pattern in target_file_patterns:
         target_files = sorted(root_path.glob(target_file_pattern))
+        if changed_targets is not None:
+            target_files = [t for t in target_files if t in changed_targets]
         logger.info('Finalizing {} target files from {}/{}'.format(len(target_files), root_path, target_file_pattern))
         for target_file in target_files:
-            changed = finalize_target_file(target_file, logger)
+            is_sorted = checkpoint is not None and checkpoint.is_sorted(target_file)
+            changed = finalize_target_file(target_file, logger, is_sorted)
             logger.debug('Finalized {}; changed?={}'.format(target_file, changed))
+
+    if checkpoint:
+        checkpoint.set_finalized()
+
+
+def process_stats_file(src_file: Path, root_path: Path, apply_src_file: Callable[[Path], None], logger,
+                       checkpoint: Checkpoint = None):
+    if checkpoint and checkpoint.is_applied(src_file):
+        # A previous run wrote this file's changes to the targets but stopped before moving it
+        logger.info('Already applied {}'.format(src_file))
+    else:
+        apply_src_file(src_file)
+        if checkpoint:
+            checkpoint.set_applied(src_file)
+
+    # Getting here means the source file has been completely processed
+    # Move source file to processed area
+    move_to_processed(src_file, root_path)
+
+
+def run_stats_etl(root_path: Path, target_file_patterns: list, process_src_file: Callable[[Path, Checkpoint], None],
+                  process_log: Callable[[Checkpoint], int], logger):
+    # The ETL of a stat type: the source files, then the log records since the checkpoint, then the targets
+    processed_path = root_path / Path('processed')
+    processed_path.mkdir(exist_ok=True)
+
+    with etl_lock(root_path):
+        # Pick up where the last run stopped
+        checkpoint = Checkpoint(root_path, target_file_patterns).load()
+
+        src_files = find_src_files(root_path, checkpoint.last_partition)
+        if not src_files and not count_pending_log_bytes(root_path, checkpoint) and not checkpoint.needs_finalize():
+            logger.info('No source files in {} (from partition {}) or records in its log'.format(
+                root_path, checkpoint.last_partition))
+            return
+
+        # Files are left from before the monitor wrote to the log (or written by replay.py)
+        logger.info('Checking {} files in {}'.format(len(src_files), root_path))
+        for src_file in src_files:
+            process_src_file(src_file, checkpoint)
+        process_log(checkpoint)
+
+        finalize_target_files(root_path, target_file_patterns, logger, checkpoint)
@@ -0,0 +1,215 @@
+import argparse
+import heapq
+import json
+import logging
+import tarfile
+from contextlib import ExitStack
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import log_config
+from etl.checkpoint import etl_lock
+from etl.history import atomic_write
+from etl.partitions import build_partition_path, iter_partitions, rewind_partition, scan_src_files, to_partition
+
+log_config.configure('archive.log')
+logger = logging.getLogger('transformer')
+
+stat_types = ['summary', 'events', 'details']
+
+# Processed source files (e.g. processed/2022/09/07/20220907_112233_123456.json) are packed into one bundle per
+# day under processed/archive, e.g. processed/archive/20220907.tar.gz, listed in processed/archive/index.json
+archive_dir_name = 'archive'
+bundle_suffix = '.tar.gz'
+index_file_name = 'index.json'
+
+
+def to_day(name: str) -> str:
+    return name[:8]
+
+
+def build_archive_path(root_path: Path) -> Path:
+    return root_path / Path('processed') / archive_dir_name
+
+
+def build_bundle_path(archive_path: Path, day: str) -> Path:
+    return archive_path / '{}{}'.format(day, bundle_suffix)
+
+
+def read_index(archive_path: Path) -> Dict[str, dict]:
+    index_file = archive_path / index_file_name
+    if not index_file.exists():
+        return dict()
+    with index_file.open() as json_file:
+        return json.load(json_file)
+
+
+def write_index(archive_path: Path, index: Dict[str, dict]):
+    with atomic_write(archive_path / index_file_name) as json_file:
+        json.dump(index, fp=json_file, indent=2, sort_keys=True)
+
+
+def find_archivable_files(processed_path: Path, before_day: str) -> Dict[str, List[Path]]:
+    # Files in the day partitions (or left unpartitioned) from before before_day, by day
+    days = dict()
+    src_files = scan_src_files(processed_path)
+    for (partition, partition_path) in iter_partitions(processed_path):
+        if partition.replace('/', '') >= before_day:
+            break
+        src_files.extend(scan_src_files(partition_path))
+    for src_file in src_files:
+        if to_day(src_file.name) < before_day:
+            days.setdefault(to_day(src_file.name), list()).append(src_file)
+    return days
+
+
+def remove_empty_partition(processed_path: Path, day: str):
+    # The day, month and year directories, as they empty
+    partition_path = processed_path / to_partition(day)
+    while partition_path != processed_path and partition_path.is_dir():
+        try:
+            partition_path.rmdir()
+        except OSError:
+            return
+        partition_path = partition_path.parent
+
+
+def archive_day(archive_path: Path, day: str, src_files: List[Path]) -> dict:
+    # Write the day's bundle with its members in name order. Files that arrive after a day was archived are
+    # merged into the existing bundle, which is copied over one member at a time rather than loaded.
+    bundle_file = build_bundle_path(archive_path, day)
+    new_files = {f.name: f for f in src_files}
+    with ExitStack() as stack:
+        old_bundle = stack.enter_context(tarfile.open(bundle_file, mode='r:gz')) if bundle_file.exists() else None
+        old_members = {m.name: m for m in old_bundle.getmembers()} if old_bundle else dict()
+        file = stack.enter_context(atomic_write(bundle_file, mode='wb'))
+        bundle = stack.enter_context(tarfile.open(fileobj=file, mode='w:gz'))
+
+        names = sorted(set(old_members.keys()) | set(new_files.keys()))
+        for name in names:
+            if name in new_files:
+                bundle.add(new_files[name], arcname=name)
+            else:
+                bundle.addfile(old_members[name], old_bundle.extractfile(old_members[name]))
+        raw_bytes = sum(m.size for m in bundle.getmembers())
+
+    return {'bundle': bundle_file.name, 'files': len(names), 'first': names[0], 'last': names[-1],
+            'raw_bytes': raw_bytes, 'bundle_bytes': bundle_file.stat().st_size}
+
+
+def archive_processed_files(root_path: Path, before_day: str) -> int:
+    processed_path = root_path / Path('processed')
+    if not processed_path.is_dir():
+        return 0
+    archive_path = build_archive_path(root_path)
+    archive_path.mkdir(exist_ok=True)
+
+    index = read_index(archive_path)
+    archived = 0
+    for day, src_files in sorted(find_archivable_files(processed_path, before_day).items()):
+        index[day] = archive_day(archive_path, day, src_files)
+        # Record the bundle before removing its sources; a crash in between just archives them again next time
+        write_index(archive_path, index)
+        for src_file in src_files:
+            src_file.unlink()
+        remove_empty_partition(processed_path, day)
+        archived += len(src_files)
+        logger.info('Archived {} files in {} ({} bundled as {} bytes)'.format(
+            len(src_files), build_bundle_path(archive_path, day), index[day]['raw_bytes'],
+            index[day]['bundle_bytes']))
+    return archived
+
+
+def iter_bundle(bundle_file: Path) -> Iterator[Tuple[str, bytes]]:
+    # Stream the bundle; only one (small) member is in memory at a time
+    with tarfile.open(bundle_file, mode='r|gz') as bundle:
+        for member in bundle:
+            if member.isfile():
+                yield member.name, bundle.extractfile(member).read()
+
+
+def iter_loose_files(src_files: List[Path]) -> Iterator[Tuple[str, bytes]]:
+    for src_file in sorted(src_files):
+        yield src_file.name, src_file.read_bytes()
+
+
+def iter_processed_files(root_path: Path, start_day: str = None,
+                         end_day: str = None) -> Iterator[Tuple[str, bytes]]:
+    # Every processed source file (name and contents) with start_day <= day <= end_day, in name order,
+    # whether it is still in processed/ or has been archived
+    processed_path = root_path / Path('processed')
+    archive_path = build_archive_path(root_path)
+    loose_files = find_archivable_files(processed_path, '99999999') if processed_path.is_dir() else dict()
+    days = set(loose_files.keys()) | set(read_index(archive_path).keys())
+    for day in sorted(d for d in days if (not start_day or d >= start_day) and (not end_day or d <= end_day)):
+        bundle_file = build_bundle_path(archive_path, day)
+        sources = [iter_loose_files(loose_files.get(day, list()))]
+        if bundle_file.exists():
+            sources.append(iter_bundle(bundle_file))
+        yield from heapq.merge(*sources, key=lambda f: f[0])
+
+
+def read_processed_file(root_path: Path, name: str) -> Optional[bytes]:
+    for src_file in [build_partition_path(root_path / Path('processed'), name), root_path / Path('processed') / name]:
+        if src_file.exists():
+            return src_file.read_bytes()
+    bundle_file = build_bundle_path(build_archive_path(root_path), to_day(name))
+    if not bundle_file.exists():
+        return None
+    with tarfile.open(bundle_file, mode='r:gz') as bundle:
+        try:
+            return bundle.extractfile(name).read()
+        except KeyError:
+            return None
+
+
+def restore_processed_files(root_path: Path, start_day: str, end_day: str = None) -> int:
+    # Put processed files back in the source area so the ETL scripts process them again
+    restored = 0
+    for name, data in iter_processed_files(root_path, start_day, end_day or start_day):
+        src_file = build_partition_path(root_path, name)
+        src_file.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(src_file, mode='wb') as file:
+            file.write(data)
+        restored += 1
+    if restored:
+        rewind_partition(root_path, to_partition(start_day))
+    logger.info('Restored {} files from {} to {} in {}'.format(restored, start_day, end_day or start_day, root_path))
+    return restored
+
+
+def run(device_id: str, stat_types_to_archive: List[str] = None, keep_days: int = 1):
+    # Processed files from the last keep_days days (including today) are left as they are
+    before_day = (date.today() - timedelta(days=keep_days - 1)).strftime('%Y%m%d')
+    for stat_type in stat_types_to_archive or stat_types:
+        root_path = Path('devices', device_id, stat_type)
+        if not root_path.is_dir():
+            continue
+        with etl_lock(root_path):
+            archived = archive_processed_files(root_path, before_day)
+        logger.info('Archived {} processed files from before {} in {}'.format(archived, before_day, root_path))
+
+
+def main():
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--keep_days', type=int, default=1, help='Leave the last N days of processed files as is')
+    parser.add_argument('--restore', nargs='+', metavar='YYYYMMDD',
+                        help='Restore the processed files of a day (or a range of days) for reprocessing')
+    parser.add_argument('--stat_types', nargs='+', choices=stat_types, default=stat_types)
+    parser.add_argument('device_id', choices=supported_devices.keys())
+    args = parser.parse_args()
+
+    if args.restore:
+        for stat_type in args.stat_types:
+            restore_processed_files(Path('devices', args.device_id, stat_type), *args.restore[:2])
+        return
+
+    run(args.device_id, args.stat_types, args.keep_days)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import log_config
+from etl.history import HistoryFile, atomic_write, splice_history, update_history_index
+from models import render_template, to_template
+
+logger = logging.getLogger('transformer')
+
+catalog_file_name = 'catalog.json'
+
+
+def get_version(file: Path) -> Optional[list]:
+    if not file.exists():
+        return None
+    stat = file.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class EventCatalog:
+    # Per-device dictionary of event description templates (see models.to_template). The events history refers to
+    # descriptions by template id, e.g. {'timestamp': ..., 'priority': ..., 'template': 3, 'args': [<MACs>]},
+    # rather than repeating the same text thousands of times. Each template also keeps how often and when it
+    # was seen, so counting events of a type doesn't have to read the history. The counts are those of the
+    # history version (size/mtime) in counted_version; a history changed since (e.g. by a run that stopped
+    # before counting what it wrote) is counted again.
+    def __init__(self, root_path: Path):
+        self.catalog_file = root_path / catalog_file_name
+        self.entries = list()
+        self.template_ids = dict()
+        self.counted_version = None
+        self.changed = False
+
+    def __repr__(self):
+        return '{}({}, templates={})'.format(self.__class__.__name__, self.catalog_file, len(self.entries))
+
+    def load(self):
+        if self.catalog_file.exists():
+            with self.catalog_file.open() as json_file:
+                catalog = json.load(json_file)
+            self.entries = catalog.get('templates', list())
+            self.counted_version = catalog.get('counted_version', None)
+        self.template_ids = {e['template']: i for (i, e) in enumerate(self.entries)}
+        self.changed = False
+        logger.debug('Loaded {}'.format(self))
+        return self
+
+    def save(self):
+        if not self.changed:
+            return
+        with atomic_write(self.catalog_file) as json_file:
+            json.dump({'templates': self.entries, 'counted_version': self.counted_version}, fp=json_file,
+                      sort_keys=True, indent=2)
+        self.changed = False
+
+    def intern(self, template: str) -> int:
+        # Ids are positions in the catalog, so they never change once assigned
+        template_id = self.template_ids.get(template, None)
+        if template_id is None:
+            template_id = len(self.entries)
+            self.entries.append({'template': template, 'count': 0, 'first_timestamp': None, 'last_timestamp': None})
+            self.template_ids[template] = template_id
+            self.changed = True
+        return template_id
+
+    def encode(self, event: dict) -> dict:
+        # Events already encoded are returned as they are
+        if 'desc' not in event:
+            return event
+        encoded = {k: v for (k, v) in event.items() if k != 'desc'}
+        template, args = to_template(event['desc'] or '')
+        encoded['template'] = self.intern(template)
+        if args:
+            encoded['args'] = args
+        return encoded
+
+    def decode(self, event: dict) -> dict:
+        if 'template' not in event:
+            return event
+        decoded = {k: v for (k, v) in event.items() if k not in ['template', 'args']}
+        decoded['desc'] = render_template(self.entries[event['template']]['template'], event.get('args', list()))
+        return decoded
+
+    def add_events(self, events: List[dict]):
+        # Count newly stored (encoded) events; an event compacted by retention stands for repeat_count of them
+        for event in events:
+            entry = self.entries[event['template']]
+            entry['count'] += event.get('repeat_count', 1)
+            timestamp = event.get('timestamp', None)
+            if timestamp and (not entry['first_timestamp'] or timestamp < entry['first_timestamp']):
+                entry['first_timestamp'] = timestamp
+            last_timestamp = event.get('last_timestamp', timestamp)
+            if last_timestamp and (not entry['last_timestamp'] or last_timestamp > entry['last_timestamp']):
+                entry['last_timestamp'] = last_timestamp
+            self.changed = True
+
+    def is_counted(self, events_file: Path) -> bool:
+        return get_version(events_file) == self.counted_version
+
+    def set_counted(self, events_file: Path):
+        self.counted_version = get_version(events_file)
+        self.changed = True
+
+    def recount(self, events_file: Path) -> List[dict]:
+        # Count every template from the history again; returns the (encoded) events
+        for entry in self.entries:
+            entry.update({'count': 0, 'first_timestamp': None, 'last_timestamp': None})
+        events = list()
+        if events_file.exists():
+            with HistoryFile(events_file) as history:
+                events = [self.encode(e) for (_, e) in history.iter_from(history.first_offset())]
+        self.add_events(events)
+        self.set_counted(events_file)
+        logger.info('Counted {} events in {}'.format(len(events), events_file))
+        return events
+
+    def find(self, text: str) -> List[int]:
+        # Ids of the templates containing text, e.g. 'T3 time-out'
+        return [i for (i, e) in enumerate(self.entries) if text in e['template']]
+
+    def count(self, template_ids: List[int]) -> int:
+        return sum(self.entries[i]['count'] for i in template_ids)
+
+    def get_counts(self) -> Dict[int, int]:
+        return {i: e['count'] for (i, e) in enumerate(self.entries)}
+
+
+def decode_events(root_path: Path, events: List[dict]) -> List[dict]:
+    catalog = EventCatalog(root_path).load()
+    return [catalog.decode(e) for e in events]
+
+
+def rebuild(root_path: Path, events_file_name: str = 'events.json') -> Optional[EventCatalog]:
+    # Encode any events still holding descriptions (histories written before the catalog) and recount every
+    # template from the history
+    events_file = root_path / events_file_name
+    if not events_file.exists():
+        return None
+    catalog = EventCatalog(root_path).load()
+    with HistoryFile(events_file) as history:
+        first_offset = history.first_offset()
+        events = [e for (_, e) in history.iter_from(first_offset)]
+    encoded = catalog.recount(events_file)
+    # The history must not refer to templates that aren't saved yet
+    catalog.save()
+
+    if encoded != events:
+        splice_history(events_file, first_offset, encoded)
+        update_history_index(events_file)
+        catalog.set_counted(events_file)
+        catalog.save()
+    logger.info('Rebuilt {} from {} events in {}'.format(catalog, len(events), events_file))
+    return catalog
+
+
+def main():
+    log_config.configure('catalog.log')
+
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(description='Show (or rebuild) the event templates of a device')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Encode events stored as descriptions and recount the templates')
+    parser.add_argument('device_id', choices=supported_devices.keys())
+    args = parser.parse_args()
+
+    root_path = Path('devices', args.device_id, 'events')
+    catalog = rebuild(root_path) if args.rebuild else EventCatalog(root_path).load()
+    for (template_id, entry) in enumerate(catalog.entries if catalog else list()):
+        print(json.dumps(dict(entry, id=template_id), sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
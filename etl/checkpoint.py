@@ -0,0 +1,137 @@
+import fcntl
+import json
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from etl.history import atomic_write
+
+logger = logging.getLogger(__name__)
+
+checkpoint_file_name = 'checkpoint.json'
+lock_file_name = '.etl.lock'
+
+# Lock files this process holds, with how many nested runs took each
+held_locks: Dict[Path, int] = dict()
+
+
+@contextmanager
+def etl_lock(root_path: Path):
+    # Held while the ETL of a stat type reads or writes its checkpoint and target files, so runs of the ETL
+    # scripts (fleet.py, combine.sh, watch.py) and rewinds never interleave. A flock isn't re-entrant (a second
+    # open of the file would wait for the first), so runs nested in a locked one (e.g. by fleet.py) reuse its lock.
+    lock_path = (root_path / lock_file_name).resolve()
+    if lock_path in held_locks:
+        held_locks[lock_path] += 1
+        try:
+            yield
+        finally:
+            held_locks[lock_path] -= 1
+        return
+
+    with lock_path.open(mode='w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        held_locks[lock_path] = 1
+        try:
+            yield
+        finally:
+            del held_locks[lock_path]
+
+
+class Checkpoint:
+    # Progress of the ETL for one stat type: the last source file whose changes were fully written to the
+    # target files (and the latest day partition one came from), the offset in the stats log up to which records
+    # were, and the versions (size/mtime) of the targets as of the last finalize. Targets a transform rewrote in a
+    # way that keeps them sorted and unique are recorded with their version too, so finalize can skip them.
+    def __init__(self, root_path: Path, target_file_patterns: List[str]):
+        self.checkpoint_file = root_path / checkpoint_file_name
+        self.root_path = root_path
+        self.target_file_patterns = target_file_patterns
+        self.last_src_file = None
+        self.last_partition = None
+        self.log_offset = 0
+        self.finalized = True
+        self.targets = dict()
+        self.sorted_targets = dict()
+
+    def __repr__(self):
+        return '{}({}, last_src_file={}, log_offset={}, finalized={})'.format(
+            self.__class__.__name__, self.checkpoint_file, self.last_src_file, self.log_offset, self.finalized)
+
+    def load(self):
+        if self.checkpoint_file.exists():
+            with self.checkpoint_file.open() as json_file:
+                checkpoint = json.load(json_file)
+            self.last_src_file = checkpoint.get('last_src_file', None)
+            self.last_partition = checkpoint.get('last_partition', None)
+            self.log_offset = checkpoint.get('log_offset', 0)
+            self.finalized = checkpoint.get('finalized', False)
+            self.targets = checkpoint.get('targets', dict())
+            self.sorted_targets = checkpoint.get('sorted_targets', dict())
+        logger.debug('Loaded {}'.format(self))
+        return self
+
+    def save(self):
+        with atomic_write(self.checkpoint_file) as json_file:
+            json.dump({'last_src_file': self.last_src_file, 'last_partition': self.last_partition,
+                       'log_offset': self.log_offset, 'finalized': self.finalized, 'targets': self.targets,
+                       'sorted_targets': self.sorted_targets}, fp=json_file, sort_keys=True, indent=2)
+
+    def get_target_versions(self) -> dict:
+        versions = dict()
+        for target_file_pattern in self.target_file_patterns:
+            for target_file in self.root_path.glob(target_file_pattern):
+                stat = target_file.stat()
+                versions[str(target_file.relative_to(self.root_path))] = [stat.st_size, stat.st_mtime_ns]
+        return versions
+
+    def get_target_version(self, target_file: Path) -> Optional[list]:
+        if not target_file.exists():
+            return None
+        stat = target_file.stat()
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def is_sorted(self, target_file: Path) -> bool:
+        # Whether the target is sorted and unique as it is now: finalized (or missing) and untouched since, or last
+        # written by a transform that kept it so (see set_sorted)
+        version = self.get_target_version(target_file)
+        target = str(target_file.relative_to(self.root_path))
+        return version is None or version in [self.targets.get(target, None), self.sorted_targets.get(target, None)]
+
+    def set_sorted(self, target_file: Path):
+        # Saved along with the next set_applied/set_log_offset; until then finalize simply sorts the target again
+        self.sorted_targets[str(target_file.relative_to(self.root_path))] = self.get_target_version(target_file)
+
+    def is_applied(self, src_file: Path) -> bool:
+        # Only the last applied source file can still be waiting to be moved to the processed area
+        return src_file.name == self.last_src_file
+
+    def set_applied(self, src_file: Path):
+        self.last_src_file = src_file.name
+        # e.g. 2022/09/07 for devices/<id>/<stat>/2022/09/07/20220907_112233_123456.json ('.' if not partitioned)
+        partition = src_file.parent.relative_to(self.root_path).as_posix()
+        if partition != '.' and partition > (self.last_partition or ''):
+            self.last_partition = partition
+        self.finalized = False
+        self.save()
+
+    def set_log_offset(self, log_offset: int):
+        # Records before log_offset have been applied
+        self.log_offset = log_offset
+        self.finalized = False
+        self.save()
+
+    def get_changed_targets(self) -> List[Path]:
+        # Targets written since they were last finalized
+        versions = self.get_target_versions()
+        return [self.root_path / t for (t, v) in versions.items() if self.targets.get(t, None) != v]
+
+    def needs_finalize(self) -> bool:
+        return not self.finalized or bool(self.get_changed_targets())
+
+    def set_finalized(self):
+        self.targets = self.get_target_versions()
+        self.sorted_targets = dict()
+        self.finalized = True
+        self.save()
@@ -0,0 +1,148 @@
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+# Cumulative codeword counters reported for each downstream channel
+counter_keys = ('corrected', 'uncorrected')
+
+# Store the absolute counter values every N channel entries so a history can be decoded
+# without walking all the way back to the first entry
+keyframe_interval = 60
+
+# e.g. '1 days 07h:20m:41s'
+uptime_pattern = re.compile(r'(?:(\d+)\s*days?\s*)?(\d+)h:(\d+)m:(\d+)s')
+
+
+def parse_uptime(uptime: str) -> Optional[timedelta]:
+    if not uptime:
+        return None
+    match = uptime_pattern.search(uptime)
+    if not match:
+        return None
+    days, hours, minutes, seconds = (int(g or 0) for g in match.groups())
+    return timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
+
+
+def is_keyframe(entry: dict) -> bool:
+    # Older channel histories stored the raw counters in every entry; treat those as keyframes too
+    return all(k in entry for k in counter_keys)
+
+
+def get_last_counters(history: List[dict]) -> Tuple[Optional[dict], int]:
+    # Walk back to the most recent keyframe, summing the deltas along the way.
+    # Returns the absolute counters as of the last entry and the number of entries since the keyframe.
+    deltas = {k: 0 for k in counter_keys}
+    for since_keyframe, entry in enumerate(reversed(history)):
+        if is_keyframe(entry):
+            return {k: entry[k] + deltas[k] for k in counter_keys}, since_keyframe
+        for k in counter_keys:
+            deltas[k] += entry.get('{}_delta'.format(k), 0)
+    return None, len(history)
+
+
+def decode_counter_history(history: List[dict], counters: dict = None) -> List[dict]:
+    # Expand a delta-encoded channel history so that every entry carries absolute counters.
+    # When decoding part of a history, counters are the absolute values as of the entry before it.
+    decoded = list()
+    for entry in history:
+        entry = entry.copy()
+        if is_keyframe(entry):
+            counters = {k: entry[k] for k in counter_keys}
+        elif counters is not None:
+            counters = {k: counters[k] + entry.get('{}_delta'.format(k), 0) for k in counter_keys}
+            entry.update(counters)
+        decoded.append(entry)
+    return decoded
+
+
+def is_counter_reset(prev_ts: str, prev_counters: dict, cur_ts: str, cur_stats: dict, uptime: str) -> bool:
+    # Counters start over when the device reboots. A drop in any counter gives it away, but so does
+    # an uptime that began after the previous entry was recorded.
+    if any(cur_stats[k] < prev_counters[k] for k in counter_keys):
+        return True
+    cur_uptime = parse_uptime(uptime)
+    if cur_uptime is None:
+        return False
+    booted_at = datetime.fromisoformat(cur_ts) - cur_uptime
+    return booted_at > datetime.fromisoformat(prev_ts)
+
+
+def encode_channel_counters(history: List[dict], cur_stats: dict, cur_ts: str, uptime: str = None) -> dict:
+    # Replace the cumulative counters with the per-interval deltas and error rates (per second).
+    # Every keyframe_interval entries (and whenever the counters reset) the absolute values are kept as well.
+    encoded = {k: v for (k, v) in cur_stats.items() if k not in counter_keys}
+    prev_counters, since_keyframe = get_last_counters(history)
+
+    if prev_counters is None:
+        encoded.update({k: cur_stats[k] for k in counter_keys})
+        encoded['keyframe'] = True
+        return encoded
+
+    prev_ts = history[len(history) - 1]['timestamp']
+    interval = (datetime.fromisoformat(cur_ts) - datetime.fromisoformat(prev_ts)).total_seconds()
+    reset = is_counter_reset(prev_ts, prev_counters, cur_ts, cur_stats, uptime)
+    if reset:
+        # Everything counted since the reboot happened within this interval
+        deltas = {k: cur_stats[k] for k in counter_keys}
+        cur_uptime = parse_uptime(uptime)
+        if cur_uptime is not None:
+            interval = min(interval, cur_uptime.total_seconds())
+    else:
+        deltas = {k: cur_stats[k] - prev_counters[k] for k in counter_keys}
+
+    for k in counter_keys:
+        encoded['{}_delta'.format(k)] = deltas[k]
+        encoded['{}_rate'.format(k)] = round(deltas[k] / interval, 6) if interval > 0 else 0.0
+    encoded['interval_secs'] = interval
+
+    if reset or since_keyframe + 1 >= keyframe_interval:
+        encoded.update({k: cur_stats[k] for k in counter_keys})
+        encoded['keyframe'] = True
+        if reset:
+            encoded['reset'] = True
+    return encoded
+
+
+def get_samples(entry: dict) -> int:
+    # Polls an entry stands for: itself plus the unchanged ones after it (see count_unchanged_sample)
+    return entry.get('samples', 1)
+
+
+def get_last_timestamp(entry: dict) -> str:
+    # When the last of the polls an entry stands for was taken
+    return entry.get('last_timestamp', entry['timestamp'])
+
+
+def apply_pending_samples(entry: dict, pending: Optional[dict]) -> dict:
+    # The entry with the unchanged polls counted since it was stored (pending is meant for the entry with its
+    # timestamp; one for an earlier entry was folded into that entry already)
+    if not pending or pending['timestamp'] != entry['timestamp']:
+        return entry
+    return dict(entry, samples=pending['samples'], last_timestamp=pending['last_timestamp'])
+
+
+def count_unchanged_sample(entry: dict, pending: Optional[dict], cur_ts: str) -> Optional[dict]:
+    # An unchanged poll isn't stored, but counted against the last entry, so the history still records every poll
+    # without being rewritten. Returns the new pending count, or None if a poll at cur_ts was counted already
+    # (e.g. a log record applied again).
+    counted = apply_pending_samples(entry, pending)
+    if cur_ts <= get_last_timestamp(counted):
+        return None
+    return {'timestamp': entry['timestamp'], 'samples': get_samples(counted) + 1, 'last_timestamp': cur_ts}
+
+
+def is_encoded_entry_changed(history: List[dict], encoded: dict) -> bool:
+    # Only keep an entry when the signal changed, errors were counted or a keyframe is due
+    if not history or encoded.get('keyframe'):
+        return True
+    if any(encoded.get('{}_delta'.format(k)) for k in counter_keys):
+        return True
+
+    ignored = {'timestamp', 'keyframe', 'reset', 'interval_secs', 'samples', 'last_timestamp'}
+    ignored.update(counter_keys)
+    ignored.update('{}_delta'.format(k) for k in counter_keys)
+    ignored.update('{}_rate'.format(k) for k in counter_keys)
+    prev_entry = history[len(history) - 1]
+    prev_signal = {k: v for (k, v) in prev_entry.items() if k not in ignored}
+    cur_signal = {k: v for (k, v) in encoded.items() if k not in ignored}
+    return prev_signal != cur_signal
@@ -6,12 +6,18 @@ from typing import List
 
 import log_config
 from common import calc_stats_ts
-from etl import finalize_target_files, compare_ts_history_with_current, TimestampedResult
+from etl import finalize_target_files, compare_ts_history_with_current, TimestampedResult, read_ts_history, \
+    write_ts_history, process_stats_file, process_stats_log, read_pending_samples, write_pending_samples, \
+    run_stats_etl
+from etl.checkpoint import Checkpoint
+from etl.counters import apply_pending_samples, counter_keys, count_unchanged_sample, encode_channel_counters, \
+    is_encoded_entry_changed
 from models import ConnectionDetails, ChannelStats
 
 log_config.configure('details.log')
 logger = logging.getLogger('transformer')
 combined_file = 'details.json'
+target_file_patterns = [combined_file, 'downstream/*.json', 'upstream/*.json']
 
 
 def extract_connection_stats(src_file: Path) -> TimestampedResult:
@@ -21,7 +27,11 @@ def extract_connection_stats(src_file: Path) -> TimestampedResult:
 
     # json_stats will be a dict that SHOULD contain 'timestamp', 'result' keys
     # If not, calculate the timestamp from the filename
-    timestamp = json_stats.get('timestamp', calc_stats_ts(src_file))
+    return parse_connection_stats(json_stats, json_stats.get('timestamp', None) or calc_stats_ts(src_file))
+
+
+def parse_connection_stats(json_stats: dict, timestamp: str = None) -> TimestampedResult:
+    timestamp = timestamp or json_stats['timestamp']
     result = json_stats.get('result', json_stats)
     if 'error' in result:
         return TimestampedResult(timestamp=timestamp, error=result['error'])
@@ -33,7 +43,26 @@ def is_channel_stats_changed(json_history: List[dict], cur_stats: dict, cur_ts:
     return compare_ts_history_with_current(json_history, cur_stats, cur_ts, logger)
 
 
-def transform_channel_stats(channel_type: str, timestamp: str, cur_stats_list: List[ChannelStats], root_path: Path):
+def is_channel_counters_changed(json_history: List[dict], cur_stats: dict, cur_ts: str, uptime: str = None) -> bool:
+    # Channels with cumulative counters are stored delta-encoded (see etl.counters)
+    # Deltas are relative to the last entry, so an older sample can't be inserted before it
+    prev_ts = json_history[len(json_history) - 1]['timestamp'] if json_history else None
+    if prev_ts and prev_ts > cur_ts:
+        logger.warning('Ignoring {} stats older than the last entry at {}'.format(cur_ts, prev_ts))
+        return False
+
+    encoded = encode_channel_counters(json_history, cur_stats, cur_ts, uptime)
+    if not is_encoded_entry_changed(json_history, encoded):
+        logger.debug('No changes; ignoring {}'.format(cur_stats))
+        return False
+
+    encoded['timestamp'] = cur_ts
+    json_history.append(encoded)
+    return True
+
+
+def transform_channel_stats(channel_type: str, timestamp: str, cur_stats_list: List[ChannelStats], root_path: Path,
+                            uptime: str = None, pending_samples: dict = None):
     channel_stats_path = root_path / channel_type
     channel_stats_path.mkdir(exist_ok=True)
 
@@ -41,16 +70,33 @@ def transform_channel_stats(channel_type: str, timestamp: str, cur_stats_list: L
         logger.debug('Processing {} channel {}'.format(channel_type, cur_stats.channel_id))
         channel_stats_file = channel_stats_path / f'ch{cur_stats.channel_id:02}.json'
 
-        channel_stats_history = list()
-        if channel_stats_file.exists():
-            with channel_stats_file.open() as json_file:
-                logger.debug('Reading {}'.format(channel_stats_file))
-                channel_stats_history = json.load(json_file)
+        channel_stats_history = read_ts_history(channel_stats_file, logger)
 
-        if is_channel_stats_changed(channel_stats_history, vars(cur_stats), timestamp):
-            with channel_stats_file.open(mode='w') as json_file:
-                logger.debug('Updating {} with {} entries'.format(channel_stats_file, len(channel_stats_history)))
-                json.dump(channel_stats_history, fp=json_file, default=lambda o: o.__dict__, sort_keys=True, indent=2)
+        if all(hasattr(cur_stats, k) for k in counter_keys):
+            changed = is_channel_counters_changed(channel_stats_history, vars(cur_stats), timestamp, uptime)
+            if pending_samples is not None:
+                count_channel_sample(channel_stats_history, '{}/{}'.format(channel_type, channel_stats_file.name),
+                                     changed, timestamp, pending_samples)
+        else:
+            changed = is_channel_stats_changed(channel_stats_history, vars(cur_stats), timestamp)
+
+        if changed:
+            write_ts_history(channel_stats_file, channel_stats_history, logger)
+
+
+def count_channel_sample(channel_stats_history: List[dict], key: str, changed: bool, timestamp: str,
+                         pending_samples: dict):
+    pending = pending_samples.get(key, None)
+    if changed:
+        # The entry the new one follows won't count any more polls; it takes its count along
+        if pending and len(channel_stats_history) > 1:
+            prev_index = len(channel_stats_history) - 2
+            channel_stats_history[prev_index] = apply_pending_samples(channel_stats_history[prev_index], pending)
+        pending_samples.pop(key, None)
+    elif channel_stats_history:
+        counted = count_unchanged_sample(channel_stats_history[len(channel_stats_history) - 1], pending, timestamp)
+        if counted:
+            pending_samples[key] = counted
 
 
 def transform_details_stats(cur_stats: TimestampedResult, details_history: List[dict]) -> bool:
@@ -78,11 +124,7 @@ def transform_details_stats(cur_stats: TimestampedResult, details_history: List[
 def transform_details(cur_stats: TimestampedResult, combined_details_file: Path) -> bool:
     cur_details = dict()
 
-    details_history = list()
-    if combined_details_file.exists():
-        with combined_details_file.open() as json_file:
-            logger.debug('Reading {}'.format(combined_details_file))
-            details_history = json.load(json_file)
+    details_history = read_ts_history(combined_details_file, logger)
 
     # If the result is an error (instead of actual stats), simply append to the history
     if cur_stats.error:
@@ -94,13 +136,46 @@ def transform_details(cur_stats: TimestampedResult, combined_details_file: Path)
         changed = transform_details_stats(cur_stats, details_history)
 
     if changed:
-        with combined_details_file.open(mode='w') as json_file:
-            logger.debug('Updating {} with {} entries'.format(combined_details_file, len(details_history)))
-            json.dump(details_history, fp=json_file, default=lambda o: o.__dict__, sort_keys=True, indent=2)
+        write_ts_history(combined_details_file, details_history, logger)
 
     return changed
 
 
+def transform_all(stats: TimestampedResult, root_path: Path):
+    transform_details(stats, root_path / Path(combined_file))
+    if not stats.error:
+        pending_samples = read_pending_samples(root_path)
+        counted_samples = dict(pending_samples)
+        transform_channel_stats('downstream', stats.timestamp, stats.result.downstream_channels, root_path,
+                                stats.result.uptime, pending_samples)
+        transform_channel_stats('upstream', stats.timestamp, stats.result.upstream_channels, root_path)
+        # Written after the histories, so a count is only ever dropped once its entry has taken it along
+        if pending_samples != counted_samples:
+            write_pending_samples(root_path, pending_samples)
+
+
+def process_src_file(src_file: Path, root_path: Path, checkpoint: Checkpoint = None):
+    process_stats_file(src_file, root_path, lambda file: transform_all(extract_connection_stats(file), root_path),
+                       logger, checkpoint)
+
+
+def process_log(root_path: Path, checkpoint: Checkpoint) -> int:
+    return process_stats_log(root_path, checkpoint,
+                             lambda json_stats: transform_all(parse_connection_stats(json_stats), root_path), logger)
+
+
+def finalize(root_path: Path, checkpoint: Checkpoint = None):
+    # Finalize all target files: combined_file, upstream/*.json and downstream/*.json
+    finalize_target_files(root_path, target_file_patterns, logger, checkpoint)
+
+
+def run(device_id: str):
+    root_path = Path('devices', device_id, 'details')
+    run_stats_etl(root_path, target_file_patterns,
+                  lambda src_file, checkpoint: process_src_file(src_file, root_path, checkpoint),
+                  lambda checkpoint: process_log(root_path, checkpoint), logger)
+
+
 def main():
     with open('devices/devices.json') as devices_file:
         supported_devices = json.load(devices_file)
@@ -109,32 +184,7 @@ def main():
     parser.add_argument('device_id', choices=supported_devices.keys())
     args = parser.parse_args()
 
-    root_path = Path('devices', args.device_id, 'details')
-    processed_path = root_path / Path('processed')
-    processed_path.mkdir(exist_ok=True)
-    combined_details_file = root_path / Path(combined_file)
-
-    src_file_pattern = '20*.json'
-    src_files = sorted(root_path.glob(src_file_pattern))
-    if not src_files:
-        logger.info('No source files from {}/{}'.format(root_path, src_file_pattern))
-        return
-
-    logger.info('Checking {} files in {}'.format(len(src_files), root_path))
-    for src_file in src_files:
-        stats = extract_connection_stats(src_file)
-
-        transform_details(stats, combined_details_file)
-        if not stats.error:
-            transform_channel_stats('downstream', stats.timestamp, stats.result.downstream_channels, root_path)
-            transform_channel_stats('upstream', stats.timestamp, stats.result.upstream_channels, root_path)
-
-        # Getting here means the source file has been completely processed
-        # Move source file to processed area
-        src_file.rename(processed_path / src_file.name)
-
-    # Finalize all target files: combined_file, upstream/*.json and downstream/*.json
-    finalize_target_files(root_path, [combined_file, 'downstream/*.json', 'upstream/*.json'], logger)
+    run(args.device_id)
 
 
 if __name__ == '__main__':
@@ -1,100 +1,128 @@
 import argparse
 import json
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from pathlib import Path
-from typing import Tuple, Union, Any, List
+from typing import Dict, List, Optional, Tuple
 
 import log_config
 from devices import create_device
-from etl import finalize_target_files, sort_unique_ts_history
+from etl import finalize_target_files, sort_unique_ts_history, process_stats_file, process_stats_log, run_stats_etl
+from etl.catalog import EventCatalog
+from etl.checkpoint import Checkpoint
+from etl.history import HistoryFile, splice_history
 from hnap import HNAPDevice
-from models import EventLogEntry
+from timestamps import parse_iso, to_epoch, from_epoch, to_iso
 
 log_config.configure('events.log')
 logger = logging.getLogger('transformer')
 combined_file = 'events.json'
+target_file_patterns = [combined_file]
 
+# Devices that haven't synced their clock yet log events in 1970 (or year 1)
+unknown_ts_limit = to_epoch(datetime(1971, 1, 1))
 
-def get_event_ts(event: dict, synthetic_ts: datetime, device: HNAPDevice) -> Tuple[Union[datetime, Any], datetime]:
+# (timestamp epoch, priority, desc)
+EventKey = Tuple[float, Optional[str], Optional[str]]
+
+
+def get_event_ts(event: dict, synthetic_ts: float, device: HNAPDevice) -> Tuple[float, float]:
+    # Event timestamps (and synthetic_ts) are epochs; see timestamps
     if event.get('timestamp', None):
-        ts = datetime.fromisoformat(event.get('timestamp'))
+        ts = parse_iso(event.get('timestamp'))
     else:
         try:
-            ts = device.to_timestamp(event.get('date'), event.get('time'))
+            ts = device.parse_timestamp(event.get('date'), event.get('time'))
         except ValueError:
-            synthetic_ts += timedelta(seconds=1)
+            synthetic_ts += 1
             ts = synthetic_ts
 
     # Force ts year to be no earlier than epoch since we're doing math
-    if ts.year < 1970:
-        ts = ts.replace(year=1970)
+    if ts < 0:
+        ts = to_epoch(from_epoch(ts).replace(year=1970))
     return ts, synthetic_ts
 
 
-def process_unknown_ts_events(unknown_ts_events: List[EventLogEntry], cur_ts: datetime,
-                              combined_events: List[EventLogEntry]):
+def process_unknown_ts_events(unknown_ts_events: List[EventKey], cur_ts: float, combined_events: Dict[EventKey, None]):
     # Coerce any unknown timestamps based on this current event timestamp
     # Go back one second to differentiate these unknown events from real ones
-    cur_ts = cur_ts - timedelta(seconds=1)
-    for unknown_ts_event in reversed(unknown_ts_events):
-        unknown_ts = datetime.fromisoformat(unknown_ts_event.timestamp)
-
+    cur_ts = cur_ts - 1
+    for (unknown_ts, priority, desc) in reversed(unknown_ts_events):
         # Since we need to keep going back in time, if the unknown ts has the SAME minute/second
         # as the previous one, manually increment it
-        offset = timedelta(minutes=unknown_ts.minute, seconds=unknown_ts.second)
-        new_ts = cur_ts - offset
-        unknown_ts_event.timestamp = new_ts.isoformat()
-        combined_events.append(unknown_ts_event)
+        offset = int(unknown_ts % 3600)
+        combined_events[(cur_ts - offset, priority, desc)] = None
     unknown_ts_events.clear()
 
 
 def combine_events(events: List[dict], device: HNAPDevice) -> List[dict]:
+    # A single pass that coerces timestamps and dedupes; events are only built as dicts once they're sorted
     unknown_ts_events = []
-    combined_events = []
+    combined_events = dict()
     ts = None
-    synthetic_ts = datetime.fromisoformat('1970-01-01T00:00:00')
+    synthetic_ts = 0
 
     for event in events:
         ts, synthetic_ts = get_event_ts(event, synthetic_ts, device)
-        event_entry = EventLogEntry(timestamp=ts, priority=event.get('priority'), desc=event.get('desc'))
+        event_key = (ts, event.get('priority'), event.get('desc'))
 
         # Collect unknown ts events.  Once we have a real ts, coerce the unknown events using the current ts.
-        if ts.year <= 1970:
-            unknown_ts_events.append(event_entry)
+        if ts < unknown_ts_limit:
+            unknown_ts_events.append(event_key)
         else:
-            combined_events.append(event_entry)
+            combined_events[event_key] = None
             process_unknown_ts_events(unknown_ts_events, ts, combined_events)
 
     # If the last event(s) in the file are unknown, process those now
     if unknown_ts_events:
         process_unknown_ts_events(unknown_ts_events, ts, combined_events)
 
-    combined_events = json.loads(json.dumps(combined_events, default=lambda o: o.__dict__))
-    return sort_unique_ts_history(combined_events)
+    # Events logged at the same time are ordered by description so the output doesn't depend on the input order
+    sorted_keys = sorted(combined_events.keys(), key=lambda k: (k[0], k[2] or '', k[1] or ''))
+    return [{'timestamp': to_iso(ts), 'priority': priority, 'desc': desc} for (ts, priority, desc) in sorted_keys]
 
 
-def transform_events(cur_events: List[dict], combined_events_file: Path, device: HNAPDevice) -> bool:
+def transform_events(cur_events: List[dict], combined_events_file: Path, device: HNAPDevice,
+                     checkpoint: Checkpoint = None) -> bool:
     if not cur_events:
         return False
 
     orig_size = len(cur_events)
-    cur_events = combine_events(cur_events, device)
+    catalog = EventCatalog(combined_events_file.parent).load()
+    if not catalog.is_counted(combined_events_file):
+        # The history changed since it was counted (e.g. a run stopped between writing and counting events)
+        catalog.recount(combined_events_file)
+        catalog.save()
+    cur_events = [catalog.encode(e) for e in combine_events(cur_events, device)]
     logger.debug('Found {} unique events from {} total'.format(len(cur_events), orig_size))
 
-    events_history = list()
-    if combined_events_file.exists():
-        with combined_events_file.open() as json_file:
-            logger.debug('Reading {}'.format(combined_events_file))
-            events_history = json.load(json_file)
+    # Only the tail of the history can overlap with the current events, so leave the rest of it alone
+    with HistoryFile(combined_events_file) as events_history:
+        offset = events_history.bisect(cur_events[0]['timestamp'])
+        overlapping_events = [e for _, e in events_history.iter_from(offset)]
+    logger.debug('Found {} overlapping events in {}'.format(len(overlapping_events), combined_events_file))
 
-    updated_events_history = sort_unique_ts_history(events_history + cur_events)
-    if events_history == updated_events_history:
+    # A history written before the catalog holds descriptions; its tail is encoded as it is rewritten
+    encoded_events = [catalog.encode(e) for e in overlapping_events]
+    updated_events = sort_unique_ts_history(encoded_events + cur_events)
+    if overlapping_events == updated_events:
         return False
 
-    with combined_events_file.open(mode='w') as json_file:
-        logger.debug('Updating {} with {} entries'.format(combined_events_file, len(updated_events_history)))
-        json.dump(updated_events_history, fp=json_file, default=lambda o: o.__dict__, sort_keys=True, indent=2)
+    # The history must not refer to templates that aren't saved yet
+    catalog.save()
+
+    logger.debug('Updating {} with {} events from {}'.format(combined_events_file, len(updated_events), offset))
+    # The events before offset are older than any in the sorted, unique tail, so a sorted history stays sorted
+    was_sorted = checkpoint is not None and checkpoint.is_sorted(combined_events_file)
+    splice_history(combined_events_file, offset, updated_events)
+    if was_sorted:
+        checkpoint.set_sorted(combined_events_file)
+
+    # Only counted once they are stored; if the run stops before this, the next one counts the history again
+    stored_events = {json.dumps(e, sort_keys=True) for e in encoded_events}
+    catalog.add_events([e for e in updated_events if json.dumps(e, sort_keys=True) not in stored_events])
+    catalog.set_counted(combined_events_file)
+    catalog.save()
     return True
 
 
@@ -105,8 +133,10 @@ def extract_events(src_file: Path) -> List[dict]:
 
     with src_file.open() as file:
         logger.info('Processing {}'.format(src_file))
-        cur_events = json.load(file)
+        return parse_events(json.load(file))
 
+
+def parse_events(cur_events) -> List[dict]:
     # 3 versions of source files exist: One with a list of events and one with 'result' value is the list of events
     if not isinstance(cur_events, list):
         if 'result' in cur_events:
@@ -116,6 +146,32 @@ def extract_events(src_file: Path) -> List[dict]:
     return cur_events
 
 
+def process_src_file(src_file: Path, root_path: Path, device: HNAPDevice, checkpoint: Checkpoint = None):
+    process_stats_file(src_file, root_path,
+                       lambda file: transform_events(extract_events(file), root_path / Path(combined_file), device,
+                                                     checkpoint), logger, checkpoint)
+
+
+def process_log(root_path: Path, device: HNAPDevice, checkpoint: Checkpoint) -> int:
+    return process_stats_log(root_path, checkpoint,
+                             lambda json_stats: transform_events(parse_events(json_stats),
+                                                                 root_path / Path(combined_file), device, checkpoint),
+                             logger)
+
+
+def finalize(root_path: Path, checkpoint: Checkpoint = None):
+    # Finalize all target files: combined_file
+    finalize_target_files(root_path, target_file_patterns, logger, checkpoint)
+
+
+def run(device_id: str, device_type: str = None):
+    root_path = Path('devices', device_id, 'events')
+    device = create_device(device_id, device_type)
+    run_stats_etl(root_path, target_file_patterns,
+                  lambda src_file, checkpoint: process_src_file(src_file, root_path, device, checkpoint),
+                  lambda checkpoint: process_log(root_path, device, checkpoint), logger)
+
+
 def main():
     with open('devices/devices.json') as devices_file:
         supported_devices = json.load(devices_file)
@@ -124,30 +180,7 @@ def main():
     parser.add_argument('device_id', choices=supported_devices.keys())
     args = parser.parse_args()
 
-    root_path = Path('devices', args.device_id, 'events')
-    processed_path = root_path / Path('processed')
-    processed_path.mkdir(exist_ok=True)
-    combined_events_file = root_path / Path(combined_file)
-
-    device = create_device(args.device_id)
-
-    src_file_pattern = '20*.json'
-    src_files = sorted(root_path.glob(src_file_pattern))
-    if not src_files:
-        logger.info('No source files from {}/{}'.format(root_path, src_file_pattern))
-        return
-
-    logger.info('Checking {} files in {}'.format(len(src_files), root_path))
-    for src_file in src_files:
-        events = extract_events(src_file)
-        transform_events(events, combined_events_file, device)
-
-        # Getting here means the source file has been completely processed
-        # Move source file to processed area
-        src_file.rename(processed_path / src_file.name)
-
-    # Finalize all target files: combined_file, upstream/*.json and downstream/*.json
-    finalize_target_files(root_path, [combined_file], logger)
+    run(args.device_id, supported_devices[args.device_id].get('device_type', None))
 
 
 if __name__ == '__main__':
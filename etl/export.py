@@ -0,0 +1,210 @@
+import argparse
+import csv
+import json
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import log_config
+from etl.catalog import decode_events
+from etl.counters import decode_counter_history
+from etl.history import HistoryFile, atomic_write, get_counters_before
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+log_config.configure('export.log')
+logger = logging.getLogger('transformer')
+
+# Column names and types for each exported history. 'dictionary' columns hold a handful of distinct strings.
+schemas = {'downstream': [('timestamp', 'timestamp'),
+                          ('channel_id', 'int32'),
+                          ('lock_status', 'dictionary'),
+                          ('freq_mhz', 'float64'),
+                          ('power_dbmv', 'float64'),
+                          ('snr', 'float64'),
+                          ('corrected', 'int64'),
+                          ('uncorrected', 'int64'),
+                          ('corrected_delta', 'int64'),
+                          ('uncorrected_delta', 'int64'),
+                          ('modulation', 'dictionary')],
+           'upstream': [('timestamp', 'timestamp'),
+                        ('channel_id', 'int32'),
+                        ('lock_status', 'dictionary'),
+                        ('freq_mhz', 'float64'),
+                        ('power_dbmv', 'float64'),
+                        ('channel_type', 'dictionary'),
+                        ('symb_rate', 'float64')],
+           'events': [('timestamp', 'timestamp'),
+                      ('priority', 'dictionary'),
+                      ('desc', 'string'),
+                      ('repeat_count', 'int64'),
+                      ('last_timestamp', 'string')]}
+
+state_file_name = '_export.json'
+
+
+def get_history_files(device_id: str, dataset: str) -> List[Path]:
+    if dataset == 'events':
+        return [Path('devices', device_id, 'events', 'events.json')]
+    return sorted(Path('devices', device_id, 'details', dataset).glob('ch*.json'))
+
+
+def get_new_days(history_files: List[Path], watermark: str) -> Tuple[Set[str], str]:
+    # Days with entries at or after the watermark, along with the newest timestamp seen
+    days = set()
+    last_ts = watermark
+    for history_file in history_files:
+        with HistoryFile(history_file) as history:
+            for record in history.iter_range(watermark or None):
+                timestamp = record.get('timestamp', '')
+                days.add(timestamp[:10])
+                last_ts = max(last_ts, timestamp)
+    return days, last_ts
+
+
+def get_day_rows(history_files: List[Path], dataset: str, day: str) -> List[dict]:
+    start = day
+    end = (datetime.fromisoformat(day) + timedelta(days=1)).date().isoformat()
+    rows = list()
+    for history_file in history_files:
+        with HistoryFile(history_file) as history:
+            records = list(history.iter_range(start, end))
+            if dataset == 'downstream':
+                # Channel counters are delta-encoded; resolve them from the keyframe before this day
+                records = decode_counter_history(records, get_counters_before(history, history.bisect(start)))
+        if dataset == 'events':
+            # Event descriptions are stored as catalog templates
+            records = decode_events(history_file.parent, records)
+        rows.extend(records)
+    rows.sort(key=lambda r: (r.get('timestamp', ''), r.get('channel_id', 0)))
+    return rows
+
+
+def to_columns(rows: List[dict], schema: List[Tuple[str, str]]) -> Dict[str, list]:
+    columns = {name: [r.get(name, None) for r in rows] for (name, _) in schema}
+    columns['timestamp'] = [datetime.fromisoformat(ts) if ts else None for ts in columns['timestamp']]
+    return columns
+
+
+def write_parquet(partition_path: Path, rows: List[dict], schema: List[Tuple[str, str]]) -> Path:
+    types = {'timestamp': pyarrow.timestamp('us'),
+             'int32': pyarrow.int32(),
+             'int64': pyarrow.int64(),
+             'float64': pyarrow.float64(),
+             'string': pyarrow.string(),
+             'dictionary': pyarrow.dictionary(pyarrow.int32(), pyarrow.string())}
+    columns = to_columns(rows, schema)
+    arrow_schema = pyarrow.schema([(name, types[col_type]) for (name, col_type) in schema])
+    table = pyarrow.Table.from_pydict(columns, schema=arrow_schema)
+
+    part_file = partition_path / 'part.parquet'
+    with atomic_write(part_file, mode='wb') as file:
+        pyarrow.parquet.write_table(table, file, compression='zstd')
+    return part_file
+
+
+def write_csv(partition_path: Path, rows: List[dict], schema: List[Tuple[str, str]]) -> Path:
+    # Stdlib fallback: dictionary columns are written as integer codes, with the values in the schema file
+    dictionaries = {name: dict() for (name, col_type) in schema if col_type == 'dictionary'}
+    part_file = partition_path / 'part.csv'
+    with atomic_write(part_file) as file:
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow([name for (name, _) in schema])
+        for row in rows:
+            values = list()
+            for (name, col_type) in schema:
+                value = row.get(name, None)
+                if col_type == 'dictionary' and value is not None:
+                    value = dictionaries[name].setdefault(value, len(dictionaries[name]))
+                values.append('' if value is None else value)
+            writer.writerow(values)
+
+    with atomic_write(partition_path / '_schema.json') as json_file:
+        json.dump({'columns': [{'name': name, 'type': col_type} for (name, col_type) in schema],
+                   'dictionaries': {name: list(values.keys()) for (name, values) in dictionaries.items()},
+                   'rows': len(rows)}, fp=json_file, indent=2)
+    return part_file
+
+
+def read_csv_partition(partition_path: Path) -> List[dict]:
+    with (partition_path / '_schema.json').open() as json_file:
+        schema = json.load(json_file)
+    converters = {'int32': int, 'int64': int, 'float64': float, 'timestamp': str, 'string': str}
+    rows = list()
+    with (partition_path / 'part.csv').open(newline='') as file:
+        for row in csv.DictReader(file):
+            for column in schema['columns']:
+                name, col_type = column['name'], column['type']
+                value = row[name]
+                if value == '':
+                    row[name] = None
+                elif col_type == 'dictionary':
+                    row[name] = schema['dictionaries'][name][int(value)]
+                else:
+                    row[name] = converters[col_type](value)
+            rows.append(row)
+    return rows
+
+
+def read_state(dataset_path: Path) -> dict:
+    state_file = dataset_path / state_file_name
+    if not state_file.exists():
+        return dict()
+    with state_file.open() as json_file:
+        return json.load(json_file)
+
+
+def export_dataset(device_id: str, dataset: str, export_path: Path, export_format: str) -> int:
+    dataset_path = export_path / device_id / dataset
+    state = read_state(dataset_path)
+    if state and state.get('format', None) != export_format:
+        # Changing the format means every partition has to be written again
+        state = dict()
+    watermark = state.get('last_timestamp', '')
+
+    history_files = get_history_files(device_id, dataset)
+    days, last_ts = get_new_days(history_files, watermark)
+    write_partition = write_parquet if export_format == 'parquet' else write_csv
+    for day in sorted(days):
+        rows = get_day_rows(history_files, dataset, day)
+        partition_path = dataset_path / 'day={}'.format(day)
+        partition_path.mkdir(parents=True, exist_ok=True)
+        part_file = write_partition(partition_path, rows, schemas[dataset])
+        logger.info('Exported {} {} rows to {}'.format(len(rows), dataset, part_file))
+
+    if days:
+        with atomic_write(dataset_path / state_file_name) as json_file:
+            json.dump({'last_timestamp': last_ts, 'format': export_format}, fp=json_file, indent=2)
+    return len(days)
+
+
+def run(device_id: str, export_path: Path = Path('export'), export_format: Optional[str] = None):
+    export_format = export_format or ('parquet' if pyarrow else 'csv')
+    if export_format == 'parquet' and not pyarrow:
+        raise ValueError('pyarrow is required for parquet exports')
+
+    for dataset in schemas.keys():
+        exported = export_dataset(device_id, dataset, export_path, export_format)
+        logger.info('Exported {} day partitions of {} for {}'.format(exported, dataset, device_id))
+
+
+def main():
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--export_path', default='export', help='Root directory of the exported partitions')
+    parser.add_argument('--format', choices=['parquet', 'csv'], help='Defaults to parquet when pyarrow is installed')
+    parser.add_argument('device_id', choices=supported_devices.keys())
+    args = parser.parse_args()
+
+    run(args.device_id, Path(args.export_path), args.format)
+
+
+if __name__ == '__main__':
+    main()
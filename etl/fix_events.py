@@ -7,6 +7,7 @@ from pathlib import Path
 import log_config
 from common import get_stats_history, set_stats_history
 from devices import create_device
+from etl.catalog import EventCatalog
 
 log_config.configure('fix_events.log')
 logger = logging.getLogger('transformer')
@@ -22,21 +23,24 @@ def main():
 
     root_path = Path('devices', args.device_id, 'events')
 
-    device = create_device(args.device_id)
+    device = create_device(args.device_id, supported_devices[args.device_id].get('device_type', None))
 
+    catalog = EventCatalog(root_path).load()
     new_history = list()
     history = get_stats_history(device, 'events', logger)
     logger.info('Starting with {} history events'.format(len(history)))
     client_events_count = 0
     for event in history:
-        if not event.get('desc', '').startswith('(Client'):
+        # The history refers to descriptions by catalog template; the source files hold them in full
+        decoded_event = catalog.decode(event)
+        if not (decoded_event.get('desc', None) or '').startswith('(Client'):
             new_history.append(event)
             continue
 
         ts = datetime.fromisoformat(event.get('timestamp', None))
         output_file = Path(root_path, '{}.json'.format(ts.strftime('%Y%m%d_%H%M%S')))
         with output_file.open(mode='w') as file:
-            json.dump([event], fp=file)
+            json.dump([decoded_event], fp=file)
             client_events_count += 1
 
     history_removed_count = len(history) - len(new_history)
@@ -0,0 +1,123 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, Tuple
+
+import log_config
+from etl import count_pending_log_bytes, nodes
+from etl.checkpoint import Checkpoint, etl_lock
+from etl.partitions import find_src_files
+
+log_config.configure('fleet.log')
+logger = logging.getLogger('transformer')
+
+# ETL scripts to run (in order) for each stat type. Each stat type owns its target files, so stat types
+# (and devices) can be processed in parallel while the scripts for one stat type run in sequence.
+etl_types = {'summary': ['summary', 'archive', 'retention'],
+             'events': ['events', 'archive', 'retention'],
+             'details': ['details', 'rollups', 'archive', 'retention']}
+
+
+def count_backlog(device_id: str, stat_type: str) -> Tuple[int, int]:
+    # Source files and bytes appended to the stats log that the ETL hasn't applied yet
+    root_path = Path('devices', device_id, stat_type)
+    checkpoint = Checkpoint(root_path, list()).load()
+    return len(find_src_files(root_path, checkpoint.last_partition)), count_pending_log_bytes(root_path, checkpoint)
+
+
+def init_worker(log_filename: str):
+    # Importing the ETL scripts configures logging for each of them; send the worker logs to one file instead
+    for etl_names in etl_types.values():
+        for etl_name in etl_names:
+            importlib.import_module('etl.{}'.format(etl_name))
+    log_config.configure(log_filename)
+
+
+def run_etl(device_id: str, device_type: str, stat_type: str) -> Tuple[str, str, float]:
+    started_at = time.monotonic()
+    root_path = Path('devices', device_id, stat_type)
+    root_path.mkdir(parents=True, exist_ok=True)
+
+    # Each script takes the ETL lock itself; holding it across them keeps other runs from slipping in between
+    with etl_lock(root_path):
+        for etl_name in etl_types[stat_type]:
+            etl_module = importlib.import_module('etl.{}'.format(etl_name))
+            if etl_name == 'events':
+                etl_module.run(device_id, device_type)
+            elif etl_name in ['archive', 'retention']:
+                etl_module.run(device_id, [stat_type])
+            else:
+                etl_module.run(device_id)
+    return device_id, stat_type, time.monotonic() - started_at
+
+
+def build_tasks(supported_devices: dict, device_ids: List[str]) -> List[Tuple[str, str, str]]:
+    tasks = list()
+    for device_id in device_ids:
+        device_type = supported_devices[device_id].get('device_type', None)
+        for stat_type in etl_types.keys():
+            if Path('devices', device_id, stat_type).is_dir():
+                tasks.append((count_backlog(device_id, stat_type), device_id, device_type, stat_type))
+
+    # Start the biggest backlogs first so one large device doesn't finish long after everything else
+    tasks.sort(key=lambda t: t[0], reverse=True)
+    return [(device_id, device_type, stat_type) for (_, device_id, device_type, stat_type) in tasks]
+
+
+def run_fleet(supported_devices: dict, device_ids: List[str], workers: int = None) -> int:
+    tasks = build_tasks(supported_devices, device_ids)
+    logger.info('Running {} ETL tasks for {} devices with {} workers'.format(len(tasks), len(device_ids),
+                                                                          workers or os.cpu_count()))
+    failed = 0
+    started_at = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=('fleet.log',)) as executor:
+        futures = {executor.submit(run_etl, *task): task for task in tasks}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            device_id, _, stat_type = futures[future]
+            try:
+                _, _, elapsed = future.result()
+                msg = '{}/{} {} {} complete in {:.1f}s'.format(completed, len(tasks), device_id, stat_type, elapsed)
+                logger.info(msg)
+            except Exception as e:
+                failed += 1
+                msg = '{}/{} {} {} FAILED ({})'.format(completed, len(tasks), device_id, stat_type, e)
+                logger.error(msg)
+            print(msg, flush=True)
+
+    logger.info('Completed {} ETL tasks ({} failed) in {:.1f}s'.format(len(tasks), failed,
+                                                                       time.monotonic() - started_at))
+    return failed
+
+
+def main():
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (defaults to the CPU count)')
+    parser.add_argument('--skip_nodes', action='store_true', help="Don't aggregate channel rollups by frequency")
+    parser.add_argument('device_ids', nargs='*', help='Devices to process (defaults to every device with stats)')
+    args = parser.parse_args()
+
+    unknown_device_ids = [d for d in args.device_ids if d not in supported_devices]
+    if unknown_device_ids:
+        parser.error('unknown device_ids: {}'.format(', '.join(unknown_device_ids)))
+
+    device_ids = args.device_ids or [d for d in supported_devices.keys() if Path('devices', d).is_dir()]
+    failed = run_fleet(supported_devices, device_ids, args.workers)
+
+    # Regroup the devices' fresh channel rollups by frequency (see etl.nodes)
+    if not args.skip_nodes:
+        updated = nodes.run(device_ids)
+        print('Updated {} node buckets'.format(updated), flush=True)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+import json
+import logging
+import mmap
+import os
+import re
+import zlib
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from etl.counters import counter_keys, is_keyframe, decode_counter_history
+from models import to_json
+
+logger = logging.getLogger(__name__)
+
+# Histories are written with json.dump(..., indent=2), so every top-level record of the array
+# starts with '\n  {' and ends with '\n  }'. Nested objects are indented further, and JSON strings
+# can't hold a raw newline, so these markers only ever match top-level records.
+record_start = b'\n  {'
+record_end = b'\n  }'
+
+priority_pattern = re.compile(r'\d+')
+
+# Sidecar index next to each history (e.g. events.json.idx) with the offset of every Nth record
+index_suffix = '.idx'
+index_interval = 64
+
+
+@contextmanager
+def atomic_write(target_file: Path, mode: str = 'w'):
+    # Write to a temp file next to the target and rename it over the target once complete, so a crash
+    # leaves either the previous or the new version of the file (never a truncated one)
+    tmp_file = target_file.with_name('.{}.tmp'.format(target_file.name))
+    try:
+        with tmp_file.open(mode=mode) as file:
+            yield file
+        os.replace(tmp_file, target_file)
+    finally:
+        if tmp_file.exists():
+            tmp_file.unlink()
+
+
+class HistoryFile:
+    # Read-only view of a timestamp sorted JSON history that decodes only the records it needs
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = None
+        self.data = b''
+        self.records = None
+        self.index = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.path)
+
+    def open(self):
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return
+        self.file = self.path.open(mode='rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Anything not laid out the way the ETL writes it is simply parsed in full
+        if self.data[:5] != b'[\n  {' and self.data[:].strip() != b'[]':
+            logger.debug('{} is not an indented history; parsing it in full'.format(self.path))
+            self.records = json.loads(self.data[:])
+        else:
+            self.index = self.load_index()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self.file:
+            self.file.close()
+        self.file = None
+        self.data = b''
+
+    def size(self) -> int:
+        return len(self.records) if self.records is not None else len(self.data)
+
+    def first_offset(self) -> int:
+        return self.next_offset(0)
+
+    def next_offset(self, pos: int) -> int:
+        # Offset of the first record starting at or after pos (or size() if there are none)
+        if self.records is not None:
+            return min(pos, len(self.records))
+        found = self.data.find(record_start, max(pos - len(record_start) + 1, 0))
+        return found + len(record_start) - 1 if found >= 0 else len(self.data)
+
+    def prev_offset(self, pos: int) -> Optional[int]:
+        # Offset of the last record starting before pos
+        if self.records is not None:
+            return pos - 1 if pos > 0 else None
+        found = self.data.rfind(record_start, 0, pos)
+        return found + len(record_start) - 1 if found >= 0 else None
+
+    def record_at(self, offset: int) -> Tuple[dict, int]:
+        # Decode the record starting at offset; returns it with the offset just past its end
+        if self.records is not None:
+            return self.records[offset], offset + 1
+        end = self.data.find(record_end, offset)
+        if end < 0:
+            raise ValueError('Unterminated record at {} in {}'.format(offset, self.path))
+        end += len(record_end)
+        return json.loads(self.data[offset:end]), end
+
+    def load_index(self) -> Optional[dict]:
+        index = read_history_index(self.path)
+        if not index or not index['entries'] or index['end'] > len(self.data):
+            return None
+
+        # The history may have been rewritten since it was indexed; make sure the last entry still lines up
+        ts, offset = index['entries'][len(index['entries']) - 1]
+        try:
+            record, _ = self.record_at(offset)
+        except ValueError:
+            record = dict()
+        if self.data[offset - len(record_start) + 1:offset + 1] != record_start or record.get('timestamp') != ts:
+            logger.debug('Ignoring stale index for {}'.format(self.path))
+            return None
+        return index
+
+    def bisect(self, timestamp: str, lo: int = None) -> int:
+        # Offset of the first record with a timestamp >= the given one (or size() if there are none)
+        hi = self.size()
+        if lo is None and self.index:
+            # Narrow the search down to the records between two index entries
+            entries = self.index['entries']
+            i = bisect_left([ts for ts, _ in entries], timestamp)
+            lo = entries[i - 1][1] if i > 0 else None
+            hi = entries[i][1] if i < len(entries) else hi
+        lo = self.first_offset() if lo is None else lo
+        best = hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = self.next_offset(mid)
+            if offset >= hi:
+                # No record starts between mid and hi
+                hi = mid
+                continue
+            record, end = self.record_at(offset)
+            if record.get('timestamp', '') >= timestamp:
+                best = hi = offset
+            else:
+                lo = end
+        return best
+
+    def iter_from(self, offset: int) -> Iterator[Tuple[int, dict]]:
+        size = self.size()
+        offset = self.next_offset(offset)
+        while offset < size:
+            record, end = self.record_at(offset)
+            yield offset, record
+            offset = self.next_offset(end)
+
+    def iter_back_from(self, offset: int) -> Iterator[Tuple[int, dict]]:
+        offset = self.prev_offset(offset)
+        while offset is not None:
+            record, _ = self.record_at(offset)
+            yield offset, record
+            offset = self.prev_offset(offset)
+
+    def iter_range(self, start: str = None, end: str = None) -> Iterator[dict]:
+        # Records with start <= timestamp < end
+        offset = self.bisect(start) if start else self.first_offset()
+        for _, record in self.iter_from(offset):
+            if end and record.get('timestamp', '') >= end:
+                break
+            yield record
+
+
+def format_history_records(records: List[dict]) -> bytes:
+    # Same layout as json.dump(records, indent=2, sort_keys=True), minus the enclosing brackets
+    formatted = [json.dumps(r, default=to_json, sort_keys=True, indent=2).replace('\n', '\n  ')
+                 for r in records]
+    return ',\n'.join('  ' + f for f in formatted).encode()
+
+
+def splice_history(history_file: Path, offset: int, records: List[dict]):
+    # Replace every record from offset onwards with the given ones (offset=size() simply appends).
+    # The records before offset are copied over as bytes; they are neither decoded nor re-encoded.
+    with HistoryFile(history_file) as history, atomic_write(history_file, mode='wb') as file:
+        if history.records is not None or not history.size():
+            kept_records = (history.records or [])[:offset]
+            file.write(json.dumps(kept_records + records, default=to_json, sort_keys=True,
+                                  indent=2).encode())
+            return
+
+        kept = 0 if offset <= history.first_offset() else \
+            history.data.rfind(record_end, 0, offset) + len(record_end)
+        if kept:
+            file.write(history.data[:kept])
+            file.write(b',\n' + format_history_records(records) + b'\n]' if records else b'\n]')
+        else:
+            file.write(b'[\n' + format_history_records(records) + b'\n]' if records else b'[]')
+
+
+def replace_history_range(history_file: Path, start: int, end: int, records: List[dict]):
+    # Replace the records from offset start up to (not including) the one at offset end with the given ones.
+    # The records before start and from end onwards are copied over as bytes.
+    with HistoryFile(history_file) as history, atomic_write(history_file, mode='wb') as file:
+        if history.records is not None or not history.size():
+            all_records = history.records or []
+            file.write(json.dumps(all_records[:start] + records + all_records[end:], default=to_json,
+                                  sort_keys=True, indent=2).encode())
+            return
+
+        # Each record is preceded by its two spaces of indent
+        indent = 2
+        parts = list()
+        if start > history.first_offset():
+            parts.append(history.data[history.first_offset() - indent:
+                                      history.data.rfind(record_end, 0, start) + len(record_end)])
+        if records:
+            parts.append(format_history_records(records))
+        if end < history.size():
+            parts.append(history.data[end - indent:history.data.rfind(record_end) + len(record_end)])
+        file.write(b'[\n' + b',\n'.join(parts) + b'\n]' if parts else b'[]')
+
+
+def append_history(history_file: Path, records: List[dict]):
+    with HistoryFile(history_file) as history:
+        offset = history.size()
+    splice_history(history_file, offset, records)
+
+
+def build_index_path(history_file: Path) -> Path:
+    return history_file.with_name(history_file.name + index_suffix)
+
+
+def read_history_index(history_file: Path) -> Optional[dict]:
+    index_file = build_index_path(history_file)
+    if not index_file.exists():
+        return None
+    with index_file.open() as json_file:
+        return json.load(json_file)
+
+
+def update_history_index(history_file: Path, every: int = index_interval) -> bool:
+    # Extend (or rebuild) the sidecar index of a history; only records after the indexed ones are decoded
+    index_file = build_index_path(history_file)
+    index = read_history_index(history_file)
+    with HistoryFile(history_file) as history:
+        if history.records is not None or not history.size():
+            # Nothing to index, or not a layout that can be indexed by offset
+            if index_file.exists():
+                index_file.unlink()
+            return False
+
+        if index and index.get('every') == every and index['end'] <= history.size() and \
+                index['crc32'] == zlib.crc32(history.data[:index['end']]):
+            offset = history.next_offset(index['end'])
+        else:
+            index = {'every': every, 'count': 0, 'end': 0, 'crc32': 0, 'entries': []}
+            offset = history.first_offset()
+
+        added = 0
+        for offset, record in history.iter_from(offset):
+            if index['count'] % every == 0:
+                index['entries'].append([record.get('timestamp', ''), offset])
+            index['count'] += 1
+            index['end'] = history.data.find(record_end, offset) + len(record_end)
+            added += 1
+        if not added:
+            return False
+        index['crc32'] = zlib.crc32(history.data[:index['end']])
+
+    with atomic_write(index_file) as json_file:
+        logger.debug('Indexed {} more records of {}'.format(added, history_file))
+        json.dump(index, fp=json_file)
+    return True
+
+
+def query_history(history_file: Path, start: str = None, end: str = None,
+                  predicate: Callable[[dict], bool] = None) -> List[dict]:
+    with HistoryFile(history_file) as history:
+        return [r for r in history.iter_range(start, end) if predicate is None or predicate(r)]
+
+
+def build_history_path(device_id: str, stat_type: str, *parts: str) -> Path:
+    parts = parts or ('{}.json'.format(stat_type),)
+    return Path('devices', device_id, stat_type, *parts)
+
+
+def build_channel_path(device_id: str, channel_type: str, channel_id: int, resolution: str = None) -> Path:
+    if resolution:
+        return build_history_path(device_id, 'details', 'rollups', resolution, channel_type,
+                                  'ch{:02}.json'.format(channel_id))
+    return build_history_path(device_id, 'details', channel_type, 'ch{:02}.json'.format(channel_id))
+
+
+def to_priority_level(priority) -> Optional[int]:
+    # e.g. '3' or 'Critical (3)'
+    match = priority_pattern.search(str(priority or ''))
+    return int(match.group()) if match else None
+
+
+def query_events(device_id: str, start: str = None, end: str = None, max_priority: int = None,
+                 template_ids: List[int] = None) -> List[dict]:
+    # Events are returned as stored; template_ids (see etl.catalog) limits them to those types of events
+    def is_wanted(event: dict) -> bool:
+        if template_ids is not None and event.get('template', None) not in template_ids:
+            return False
+        level = to_priority_level(event.get('priority', None))
+        return max_priority is None or (level is not None and level <= max_priority)
+
+    return query_history(build_history_path(device_id, 'events'), start, end, is_wanted)
+
+
+def query_channel(device_id: str, channel_type: str, channel_id: int, start: str = None, end: str = None,
+                  fields: List[str] = None, resolution: str = None) -> List[dict]:
+    channel_file = build_channel_path(device_id, channel_type, channel_id, resolution)
+    with HistoryFile(channel_file) as history:
+        records = list(history.iter_range(start, end))
+
+        # Absolute counters in a delta-encoded history need the keyframe preceding the range
+        if not resolution and any(not fields or k in fields for k in counter_keys):
+            offset = history.bisect(start) if start else history.first_offset()
+            records = decode_counter_history(records, get_counters_before(history, offset))
+
+    if fields:
+        return [{k: r.get(k, None) for k in ['timestamp'] + fields} for r in records]
+    return records
+
+
+def get_counters_before(history: HistoryFile, offset: int) -> Optional[dict]:
+    # Absolute counters as of the last record before offset
+    deltas = {k: 0 for k in counter_keys}
+    for _, record in history.iter_back_from(offset):
+        if is_keyframe(record):
+            return {k: record[k] + deltas[k] for k in counter_keys}
+        for k in counter_keys:
+            deltas[k] += record.get('{}_delta'.format(k), 0)
+    return None
@@ -0,0 +1,149 @@
+import argparse
+import fcntl
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import log_config
+from etl.history import HistoryFile, atomic_write, splice_history
+from etl.rollups import channel_fields, resolutions
+
+logger = logging.getLogger('transformer')
+
+# Modems on the same plant node share their channel frequencies, so the channel rollups of every device are
+# regrouped by frequency: nodes/<resolution>/<channel_type>/<freq>MHz.json holds a bucket per time bucket with the
+# mean values of each device channel (keyed by <device_id>/<channel>, as a device may have several channels on a
+# frequency) and percentiles across them. A node-wide impairment moves the median; a single bad
+# modem only moves the tail.
+nodes_path = Path('nodes')
+state_file_name = '_nodes.json'
+percentiles = [10, 50, 90]
+
+# (channel_type, freq) -> bucket timestamp -> device_id/channel -> field -> mean
+NodeUpdates = Dict[Tuple[str, str], Dict[str, Dict[str, Dict[str, float]]]]
+
+
+def to_freq_key(freq_mhz: float) -> str:
+    return '{:.1f}'.format(freq_mhz)
+
+
+def build_node_path(channel_type: str, freq_key: str, resolution: str = '1h', path: Path = nodes_path) -> Path:
+    return path / resolution / channel_type / '{}MHz.json'.format(freq_key)
+
+
+def calc_percentile(sorted_values: List[float], percentile: float) -> float:
+    # Linear interpolation between the closest ranks
+    pos = (len(sorted_values) - 1) * percentile / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+
+def summarize(values: List[float]) -> dict:
+    values = sorted(values)
+    summary = {'p{}'.format(p): round(calc_percentile(values, p), 6) for p in percentiles}
+    summary.update({'min': values[0], 'max': values[len(values) - 1], 'devices': len(values)})
+    return summary
+
+
+def read_state(path: Path) -> dict:
+    state_file = path / state_file_name
+    if not state_file.exists():
+        return dict()
+    with state_file.open() as json_file:
+        return json.load(json_file)
+
+
+def collect_device(device_id: str, resolution: str, state: dict, updates: NodeUpdates,
+                   devices_path: Path = Path('devices')) -> int:
+    # Add the device's rollup buckets since the last run to updates. The last bucket a run sees may still have
+    # been filling up, so it is read again next time; a channel's values simply replace its earlier ones.
+    collected = 0
+    for (channel_type, fields) in channel_fields.items():
+        rollups_path = devices_path / device_id / 'details' / 'rollups' / resolution / channel_type
+        for rollup_file in sorted(rollups_path.glob('ch*.json')):
+            key = '{}/{}/{}/{}'.format(device_id, resolution, channel_type, rollup_file.stem)
+            with HistoryFile(rollup_file) as history:
+                buckets = list(history.iter_range(state.get(key, None)))
+            for bucket in buckets:
+                # Rolled up before buckets recorded their frequency
+                if bucket.get('freq_mhz', None) is None:
+                    continue
+                node_buckets = updates.setdefault((channel_type, to_freq_key(bucket['freq_mhz'])), dict())
+                values = {f: bucket[f]['mean'] for f in fields if bucket.get(f, None)}
+                node_buckets.setdefault(bucket['timestamp'], dict())[
+                    '{}/{}'.format(device_id, rollup_file.stem)] = values
+                collected += 1
+            if buckets:
+                state[key] = buckets[len(buckets) - 1]['timestamp']
+    return collected
+
+
+def apply_updates(node_file: Path, channel_type: str, freq_key: str, node_buckets: Dict[str, dict]) -> int:
+    # Merge device values into the node history; only the buckets they touch are summarized again, and only the
+    # history from the earliest of them on (usually the last few buckets) is read and rewritten
+    with HistoryFile(node_file) as history:
+        offset = history.bisect(min(node_buckets.keys()))
+        tail = [b for (_, b) in history.iter_from(offset)]
+    by_ts = {b['timestamp']: b for b in tail}
+    for (bucket_ts, device_values) in node_buckets.items():
+        bucket = by_ts.get(bucket_ts, None)
+        if bucket is None:
+            bucket = by_ts[bucket_ts] = {'timestamp': bucket_ts, 'freq_mhz': float(freq_key), 'devices': dict()}
+            tail.append(bucket)
+        bucket['devices'].update(device_values)
+        for field in channel_fields[channel_type]:
+            values = [v[field] for v in bucket['devices'].values() if field in v]
+            if values:
+                bucket[field] = summarize(values)
+
+    # Devices lag each other, so buckets may arrive out of order
+    tail.sort(key=lambda b: b['timestamp'])
+    node_file.parent.mkdir(parents=True, exist_ok=True)
+    splice_history(node_file, offset, tail)
+    return len(node_buckets)
+
+
+def run(device_ids: List[str], resolution: str = '1h', path: Path = nodes_path,
+        devices_path: Path = Path('devices')) -> int:
+    path.mkdir(parents=True, exist_ok=True)
+    with (path / '.nodes.lock').open(mode='w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        state = read_state(path)
+        updates = dict()
+        for device_id in device_ids:
+            collected = collect_device(device_id, resolution, state, updates, devices_path)
+            logger.debug('Collected {} {} rollup buckets from {}'.format(collected, resolution, device_id))
+
+        updated = 0
+        for ((channel_type, freq_key), node_buckets) in sorted(updates.items()):
+            updated += apply_updates(build_node_path(channel_type, freq_key, resolution, path), channel_type,
+                                     freq_key, node_buckets)
+
+        # Saved only once the node histories are written, so an interrupted run reads the same buckets again
+        with atomic_write(path / state_file_name) as json_file:
+            json.dump(state, fp=json_file, sort_keys=True, indent=2)
+    logger.info('Updated {} {} node buckets for {} frequencies from {} devices'.format(
+        updated, resolution, len(updates), len(device_ids)))
+    return updated
+
+
+def main():
+    log_config.configure('nodes.log')
+
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(description='Aggregate channel rollups across devices by frequency',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--resolution', choices=resolutions.keys(), default='1h', help='Rollups to aggregate')
+    parser.add_argument('device_ids', nargs='*', help='Devices to aggregate (defaults to every device with stats)')
+    args = parser.parse_args()
+
+    device_ids = args.device_ids or [d for d in supported_devices.keys() if Path('devices', d).is_dir()]
+    run(device_ids, args.resolution)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import log_config
+from etl.checkpoint import Checkpoint, etl_lock
+
+logger = logging.getLogger('transformer')
+
+stat_types = ['summary', 'events', 'details']
+
+# Raw and processed source files (e.g. 20220907_112233_123456.json) are kept in day partitions, e.g.
+# 2022/09/07/20220907_112233_123456.json, so finding new files means listing a few small directories from the
+# last partition the ETL processed rather than every file ever written
+
+
+def is_src_file(name: str) -> bool:
+    return name.startswith('20') and name.endswith('.json')
+
+
+def to_partition(name: str) -> str:
+    return '{}/{}/{}'.format(name[:4], name[4:6], name[6:8])
+
+
+def build_partition_path(path: Path, name: str) -> Path:
+    return path / to_partition(name) / name
+
+
+def scan_dirs(path: Path, name_len: int) -> List[str]:
+    with os.scandir(path) as entries:
+        return sorted(e.name for e in entries if len(e.name) == name_len and e.name.isdigit() and e.is_dir())
+
+
+def iter_partitions(path: Path, since: str = None) -> Iterator[Tuple[str, Path]]:
+    # (partition, directory) of each day partition at or after since, in order
+    if not path.is_dir():
+        return
+    for year in scan_dirs(path, 4):
+        if since and year < since[:4]:
+            continue
+        for month in scan_dirs(path / year, 2):
+            if since and '{}/{}'.format(year, month) < since[:7]:
+                continue
+            for day in scan_dirs(path / year / month, 2):
+                partition = '{}/{}/{}'.format(year, month, day)
+                if not since or partition >= since:
+                    yield partition, path / year / month / day
+
+
+def scan_src_files(path: Path) -> List[Path]:
+    with os.scandir(path) as entries:
+        return [Path(e.path) for e in entries if is_src_file(e.name) and e.is_file()]
+
+
+def find_src_files(path: Path, since_partition: str = None) -> List[Path]:
+    # Source files in the partitions at or after since_partition, plus any left in path itself by an older
+    # version of the monitor, in name (i.e. time) order
+    if not path.is_dir():
+        return list()
+    src_files = scan_src_files(path)
+    for (_, partition_path) in iter_partitions(path, since_partition):
+        src_files.extend(scan_src_files(partition_path))
+    return sorted(src_files, key=lambda f: f.name)
+
+
+def move_to_processed(src_file: Path, root_path: Path):
+    processed_file = build_partition_path(root_path / Path('processed'), src_file.name)
+    processed_file.parent.mkdir(parents=True, exist_ok=True)
+    src_file.rename(processed_file)
+
+
+def rewind_partition(root_path: Path, partition: str):
+    # Files written into a partition the ETL has moved past (e.g. restored or replayed ones) are only found if
+    # the ETL goes back to it; the ETL lock keeps a running ETL (or watch.py) from overwriting the checkpoint
+    # meanwhile, as they reload it once they have the lock
+    with etl_lock(root_path):
+        checkpoint = Checkpoint(root_path, list()).load()
+        if checkpoint.last_partition and partition < checkpoint.last_partition:
+            checkpoint.last_partition = partition
+            checkpoint.save()
+            logger.info('Rewound {} to partition {}'.format(checkpoint, partition))
+
+
+def migrate(root_path: Path) -> Optional[int]:
+    # Move the flat raw and processed files of a stat type into day partitions
+    if not root_path.is_dir():
+        return None
+    moved = 0
+    with etl_lock(root_path):
+        for path in [root_path, root_path / Path('processed')]:
+            if not path.is_dir():
+                continue
+            for src_file in scan_src_files(path):
+                partition_file = build_partition_path(path, src_file.name)
+                partition_file.parent.mkdir(parents=True, exist_ok=True)
+                src_file.rename(partition_file)
+                moved += 1
+    logger.info('Moved {} files into partitions in {}'.format(moved, root_path))
+    return moved
+
+
+def main():
+    log_config.configure('partitions.log')
+
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(description='Move flat source files into day partitions (run once)')
+    parser.add_argument('device_ids', nargs='*', help='Devices to migrate (defaults to every device)')
+    args = parser.parse_args()
+
+    for device_id in args.device_ids or supported_devices.keys():
+        for stat_type in stat_types:
+            moved = migrate(Path('devices', device_id, stat_type))
+            if moved is not None:
+                print('{}/{}: moved {} files'.format(device_id, stat_type, moved))
+
+
+if __name__ == '__main__':
+    main()
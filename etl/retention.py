@@ -0,0 +1,198 @@
+import argparse
+import json
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import log_config
+from etl import details, events, summary, build_stats_log
+from etl.checkpoint import Checkpoint, etl_lock
+from etl.counters import counter_keys, is_keyframe
+from etl.history import HistoryFile, atomic_write, get_counters_before, replace_history_range, \
+    update_history_index
+from etl.rollups import resolutions
+
+# Importing the ETL scripts configures logging for each of them; use this script's log file instead
+log_config.configure('retention.log')
+logger = logging.getLogger('transformer')
+
+stat_types = ['summary', 'events', 'details']
+
+# Days to keep raw samples and each rollup resolution for (None keeps them forever). Events are never dropped;
+# runs of the same event older than compact_events_days are compacted into one entry with a repeat_count.
+default_policy = {'raw_days': 90,
+                  'rollup_days': {'1m': 30, '1h': 730, '1d': None},
+                  'compact_events_days': 30}
+
+policy_file = Path('devices', 'retention.json')
+state_file_name = 'retention.json'
+
+
+def load_policy() -> dict:
+    # Site-wide overrides of the default policy
+    policy = dict(default_policy, rollup_days=dict(default_policy['rollup_days']))
+    if policy_file.exists():
+        with policy_file.open() as json_file:
+            overrides = json.load(json_file)
+        policy['rollup_days'].update(overrides.pop('rollup_days', dict()))
+        policy.update(overrides)
+    return policy
+
+
+def to_cutoff(days: Optional[int], now: datetime) -> Optional[str]:
+    return (now - timedelta(days=days)).isoformat() if days is not None else None
+
+
+def get_file_size(history_file: Path) -> int:
+    return history_file.stat().st_size if history_file.exists() else 0
+
+
+def trim_history(history_file: Path, cutoff: str, has_counters: bool = False) -> int:
+    # Drop the records older than cutoff, except for the last of them: it holds the state as of the cutoff.
+    # Delta-encoded counters in that record are replaced by absolute ones, since its keyframe may be dropped.
+    size = get_file_size(history_file)
+    with HistoryFile(history_file) as history:
+        offset = history.bisect(cutoff)
+        kept_offset = history.prev_offset(offset)
+        first_offset = history.first_offset()
+        if kept_offset is None or kept_offset <= first_offset:
+            return 0
+
+        kept, _ = history.record_at(kept_offset)
+        if has_counters and not is_keyframe(kept) and any('{}_delta'.format(k) in kept for k in counter_keys):
+            counters = get_counters_before(history, kept_offset)
+            if counters is not None:
+                for k in counter_keys:
+                    kept[k] = counters[k] + kept.get('{}_delta'.format(k), 0)
+                kept['keyframe'] = True
+
+    replace_history_range(history_file, first_offset, offset, [kept])
+    update_history_index(history_file)
+    reclaimed = size - get_file_size(history_file)
+    logger.info('Dropped entries before {} from {}; reclaimed {} bytes'.format(cutoff, history_file, reclaimed))
+    return reclaimed
+
+
+def to_event_type(event: dict) -> tuple:
+    # Events are stored either with a description or with a catalog template and its args
+    return event.get('priority'), event.get('desc'), event.get('template'), event.get('args')
+
+
+def compact_event_runs(events_list: List[dict]) -> List[dict]:
+    # Collapse consecutive repeats of the same event into the first one
+    compacted = list()
+    for event in events_list:
+        prev = compacted[len(compacted) - 1] if compacted else None
+        if prev and to_event_type(prev) == to_event_type(event):
+            prev['repeat_count'] = prev.get('repeat_count', 1) + event.get('repeat_count', 1)
+            prev['last_timestamp'] = event.get('last_timestamp', event.get('timestamp'))
+        else:
+            compacted.append(dict(event))
+    return compacted
+
+
+def compact_events(events_file: Path, compacted_until: str, cutoff: str) -> int:
+    # Compact the events between the previous cutoff and this one (starting one event early so a run
+    # that spans the previous cutoff is still collapsed)
+    size = get_file_size(events_file)
+    with HistoryFile(events_file) as history:
+        end = history.bisect(cutoff)
+        start = history.bisect(compacted_until) if compacted_until else history.first_offset()
+        prev_offset = history.prev_offset(start)
+        start = prev_offset if prev_offset is not None else start
+        if start >= end:
+            return 0
+        events_list = list()
+        for offset, event in history.iter_from(start):
+            if offset >= end:
+                break
+            events_list.append(event)
+
+    compacted = compact_event_runs(events_list)
+    if len(compacted) == len(events_list):
+        return 0
+
+    replace_history_range(events_file, start, end, compacted)
+    update_history_index(events_file)
+    reclaimed = size - get_file_size(events_file)
+    logger.info('Compacted {} events before {} into {} in {}; reclaimed {} bytes'.format(
+        len(events_list), cutoff, len(compacted), events_file, reclaimed))
+    return reclaimed
+
+
+def read_state(root_path: Path) -> dict:
+    state_file = root_path / state_file_name
+    if not state_file.exists():
+        return dict()
+    with state_file.open() as json_file:
+        return json.load(json_file)
+
+
+def apply_policy(stat_type: str, root_path: Path, policy: dict, now: datetime) -> int:
+    raw_cutoff = to_cutoff(policy['raw_days'], now)
+    reclaimed = 0
+    if stat_type == 'summary' and raw_cutoff:
+        reclaimed += trim_history(root_path / summary.combined_file, raw_cutoff)
+    elif stat_type == 'details':
+        if raw_cutoff:
+            reclaimed += trim_history(root_path / details.combined_file, raw_cutoff)
+            for channel_file in sorted(root_path.glob('*stream/ch*.json')):
+                reclaimed += trim_history(channel_file, raw_cutoff, has_counters=True)
+        for resolution in resolutions.keys():
+            rollup_cutoff = to_cutoff(policy['rollup_days'].get(resolution, None), now)
+            if rollup_cutoff:
+                for rollup_file in sorted((root_path / 'rollups' / resolution).glob('*/ch*.json')):
+                    reclaimed += trim_history(rollup_file, rollup_cutoff)
+    elif stat_type == 'events':
+        cutoff = to_cutoff(policy['compact_events_days'], now)
+        if cutoff:
+            state = read_state(root_path)
+            reclaimed += compact_events(root_path / events.combined_file, state.get('compacted_until', ''), cutoff)
+            with atomic_write(root_path / state_file_name) as json_file:
+                json.dump({'compacted_until': cutoff}, fp=json_file, indent=2)
+    return reclaimed
+
+
+def run(device_id: str, stat_types_to_apply: List[str] = None, policy: dict = None) -> Dict[str, int]:
+    policy = policy or load_policy()
+    now = datetime.now()
+    etl_modules = {'summary': summary, 'events': events, 'details': details}
+    reclaimed = dict()
+    for stat_type in stat_types_to_apply or stat_types:
+        root_path = Path('devices', device_id, stat_type)
+        if not root_path.is_dir():
+            continue
+
+        with etl_lock(root_path):
+            # Entries are only ever removed, so histories that were sorted and deduped still are
+            checkpoint = Checkpoint(root_path, etl_modules[stat_type].target_file_patterns).load()
+            finalized = not checkpoint.needs_finalize()
+            reclaimed[stat_type] = apply_policy(stat_type, root_path, policy, now)
+            if finalized and reclaimed[stat_type]:
+                checkpoint.set_finalized()
+            if policy['raw_days'] is not None:
+                # Raw results in the stats log are only dropped once the ETL has applied them
+                raw_cutoff = now - timedelta(days=policy['raw_days'])
+                reclaimed[stat_type] += build_stats_log(root_path).delete_before(checkpoint.log_offset,
+                                                                                 raw_cutoff.timestamp())
+        logger.info('Reclaimed {} bytes from {}'.format(reclaimed[stat_type], root_path))
+    return reclaimed
+
+
+def main():
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--stat_types', nargs='+', choices=stat_types, default=stat_types)
+    parser.add_argument('device_id', choices=supported_devices.keys())
+    args = parser.parse_args()
+
+    reclaimed = run(args.device_id, args.stat_types)
+    for stat_type, reclaimed_bytes in reclaimed.items():
+        print('{} {}: reclaimed {} bytes'.format(args.device_id, stat_type, reclaimed_bytes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import logging
+import math
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List, Dict, Optional, Tuple
+
+import log_config
+from etl.checkpoint import etl_lock
+from etl import read_pending_samples
+from etl.counters import apply_pending_samples, get_last_timestamp, get_samples
+from etl.history import HistoryFile, splice_history
+
+log_config.configure('rollups.log')
+logger = logging.getLogger('transformer')
+
+# Bucket sizes in seconds
+resolutions = {'1m': 60,
+               '1h': 60 * 60,
+               '1d': 24 * 60 * 60}
+
+# Values aggregated for each channel type
+channel_fields = {'downstream': ['power_dbmv', 'snr', 'corrected_delta', 'uncorrected_delta'],
+                  'upstream': ['power_dbmv']}
+
+
+def to_bucket_ts(timestamp: str, resolution_secs: int) -> str:
+    ts = datetime.fromisoformat(timestamp)
+    day_secs = ts.hour * 3600 + ts.minute * 60 + ts.second
+    bucket_secs = day_secs - (day_secs % resolution_secs)
+    return ts.replace(hour=bucket_secs // 3600, minute=(bucket_secs % 3600) // 60, second=bucket_secs % 60,
+                      microsecond=0).isoformat()
+
+
+def new_bucket(bucket_ts: str) -> dict:
+    return {'timestamp': bucket_ts, 'last_timestamp': None, 'count': 0}
+
+
+def iter_poll_buckets(entry: dict, start: int, resolution_secs: int) -> Iterator[Tuple[str, int, int]]:
+    # (bucket timestamp, first poll, polls) for the polls of an entry from the start-th on. Unchanged polls aren't
+    # stored one by one, so they are taken to be evenly spaced from the entry's timestamp to its last_timestamp.
+    samples = get_samples(entry)
+    first_ts = datetime.fromisoformat(entry['timestamp'])
+    interval_secs = (datetime.fromisoformat(get_last_timestamp(entry)) - first_ts).total_seconds() / \
+        max(samples - 1, 1)
+    poll = start
+    while poll < samples:
+        bucket_ts = to_bucket_ts((first_ts + timedelta(seconds=interval_secs * poll)).isoformat(), resolution_secs)
+        # The polls before the end of the bucket
+        bucket_end_secs = (datetime.fromisoformat(bucket_ts) - first_ts).total_seconds() + resolution_secs
+        end = min(samples, math.ceil(bucket_end_secs / interval_secs)) if interval_secs else samples
+        end = max(end, poll + 1)
+        yield bucket_ts, poll, end - poll
+        poll = end
+
+
+def add_to_bucket(bucket: dict, entry: dict, fields: List[str], polls: int = None, first: bool = True,
+                  rolled_up: int = None):
+    # An entry stands for get_samples(entry) polls: itself and the unchanged ones after it, which had the same
+    # signal and no new errors. Only polls of them are added here; first says whether the entry's own poll is
+    # among them (counter deltas belong to that poll alone) and rolled_up how many of the entry's polls have been
+    # added to buckets once these are.
+    polls = get_samples(entry) if polls is None else polls
+    bucket['count'] += polls
+    bucket['last_timestamp'] = entry['timestamp']
+    bucket['last_samples'] = get_samples(entry) if rolled_up is None else rolled_up
+    # The frequency the channel was on, so buckets can be compared across devices (see etl.nodes)
+    if entry.get('freq_mhz', None) is not None:
+        bucket['freq_mhz'] = entry['freq_mhz']
+    for field in fields:
+        value = entry.get(field, None)
+        if value is None:
+            continue
+        if field.endswith('_delta'):
+            # The unchanged polls counted no errors
+            unchanged = polls - 1 if first else polls
+            values = ([value] if first else []) + ([0] if unchanged else [])
+            added_sum = value if first else 0
+        else:
+            values = [value]
+            added_sum = value * polls
+        agg = bucket.get(field, None)
+        if agg is None:
+            agg = bucket[field] = {'min': min(values), 'max': max(values), 'sum': 0, 'count': 0}
+        agg['min'] = min(agg['min'], min(values))
+        agg['max'] = max(agg['max'], max(values))
+        agg['sum'] += added_sum
+        agg['count'] += polls
+        agg['mean'] = round(agg['sum'] / agg['count'], 6)
+        agg['last'] = values[len(values) - 1]
+
+
+def get_watermark(rollup_history: List[dict]) -> str:
+    # Everything up to (and including) the last source timestamp has been rolled up
+    if not rollup_history:
+        return ''
+    return rollup_history[len(rollup_history) - 1].get('last_timestamp', None) or ''
+
+
+def rollup_entries(rollup_history: List[dict], entries: List[dict], resolution_secs: int,
+                   fields: List[str]) -> int:
+    # Merge new (sorted) source entries into the rollup history (or its last bucket), touching only the affected
+    # buckets. The entry at the watermark is looked at again: it may count more samples since it was rolled up.
+    watermark = get_watermark(rollup_history)
+    buckets: Dict[str, dict] = dict()
+    last_bucket_ts = None
+    rolled_up_samples = 0
+    if rollup_history:
+        last_bucket = rollup_history[len(rollup_history) - 1]
+        last_bucket_ts = last_bucket['timestamp']
+        buckets[last_bucket_ts] = last_bucket
+        # Buckets rolled up before entries counted samples have seen all of them
+        rolled_up_samples = last_bucket.get('last_samples', None)
+
+    added = 0
+    for entry in entries:
+        timestamp = entry.get('timestamp', None)
+        if not timestamp or timestamp < watermark:
+            continue
+        start = 0
+        if timestamp == watermark:
+            start = get_samples(entry) if rolled_up_samples is None else rolled_up_samples
+            if start >= get_samples(entry):
+                continue
+        for (bucket_ts, poll, polls) in iter_poll_buckets(entry, start, resolution_secs):
+            # Polls spaced unevenly may be spread before the last bucket; they are added to it instead
+            bucket_ts = max(bucket_ts, last_bucket_ts or bucket_ts)
+            bucket = buckets.get(bucket_ts, None)
+            if bucket is None:
+                bucket = buckets[bucket_ts] = new_bucket(bucket_ts)
+                rollup_history.append(bucket)
+            add_to_bucket(bucket, entry, fields, polls, poll == 0, poll + polls)
+            last_bucket_ts = bucket_ts
+        added += 1
+    return added
+
+
+def read_last_bucket(rollup_file: Path) -> Tuple[Optional[int], List[dict]]:
+    # Offset and contents of the last bucket of the rollup history (which the next entries may still add to)
+    with HistoryFile(rollup_file) as history:
+        last_offset = history.prev_offset(history.size())
+        if last_offset is None:
+            return None, list()
+        return last_offset, [history.record_at(last_offset)[0]]
+
+
+def transform_rollups(channel_type: str, channel_stats_file: Path, rollups_path: Path,
+                      pending_samples: dict = None) -> int:
+    # Resumes each rollup from its last bucket, reading only the source entries since then, and rewrites only
+    # the rollup history from that bucket on
+    fields = channel_fields[channel_type]
+    tails = dict()
+    for resolution in resolutions.keys():
+        rollup_file = rollups_path / resolution / channel_type / channel_stats_file.name
+        tails[resolution] = (rollup_file,) + read_last_bucket(rollup_file)
+
+    # Read the source history once for all resolutions, from the earliest watermark
+    watermarks = [get_watermark(tail) for (_, _, tail) in tails.values()]
+    with HistoryFile(channel_stats_file) as history:
+        entries = list(history.iter_range(min(watermarks) or None))
+    # The last entry may have counted unchanged polls since it was stored
+    if entries and pending_samples:
+        pending = pending_samples.get('{}/{}'.format(channel_type, channel_stats_file.name), None)
+        entries[len(entries) - 1] = apply_pending_samples(entries[len(entries) - 1], pending)
+
+    total_added = 0
+    for (resolution, resolution_secs) in resolutions.items():
+        rollup_file, last_offset, tail = tails[resolution]
+        added = rollup_entries(tail, entries, resolution_secs, fields)
+        if not added:
+            logger.debug('No new entries for {}'.format(rollup_file))
+            continue
+
+        rollup_file.parent.mkdir(parents=True, exist_ok=True)
+        logger.debug('Rolling up {} new entries into {}'.format(added, rollup_file))
+        with HistoryFile(rollup_file) as history:
+            offset = history.size() if last_offset is None else last_offset
+        splice_history(rollup_file, offset, tail)
+        total_added += added
+    return total_added
+
+
+def run(device_id: str):
+    root_path = Path('devices', device_id, 'details')
+    rollups_path = root_path / Path('rollups')
+
+    if not root_path.is_dir():
+        return
+
+    # Otherwise the channel histories could be read while details.py is rewriting them
+    with etl_lock(root_path):
+        pending_samples = read_pending_samples(root_path)
+        for channel_type in channel_fields.keys():
+            channel_stats_files = sorted((root_path / channel_type).glob('ch*.json'))
+            logger.info('Checking {} {} channel files in {}'.format(len(channel_stats_files), channel_type, root_path))
+            for channel_stats_file in channel_stats_files:
+                added = transform_rollups(channel_type, channel_stats_file, rollups_path, pending_samples)
+                logger.info('Rolled up {} entries from {}'.format(added, channel_stats_file))
+
+
+def main():
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('device_id', choices=supported_devices.keys())
+    args = parser.parse_args()
+
+    run(args.device_id)
+
+
+if __name__ == '__main__':
+    main()
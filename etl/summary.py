@@ -5,12 +5,15 @@ from pathlib import Path
 
 import log_config
 from common import calc_stats_ts
-from etl import finalize_target_files, compare_ts_history_with_current, TimestampedResult
+from etl import finalize_target_files, compare_ts_history_with_current, TimestampedResult, read_ts_history, \
+    write_ts_history, process_stats_file, process_stats_log, run_stats_etl
+from etl.checkpoint import Checkpoint
 from models import ConnectionSummary
 
 log_config.configure('summary.log')
 logger = logging.getLogger('transformer')
 combined_file = 'summary.json'
+target_file_patterns = [combined_file]
 
 
 def extract_summary(src_file: Path) -> TimestampedResult:
@@ -20,7 +23,11 @@ def extract_summary(src_file: Path) -> TimestampedResult:
 
     # json_stats will be a dict that SHOULD contain 'timestamp', 'result' keys
     # If not, calculate the timestamp from the filename
-    timestamp = json_stats.get('timestamp', calc_stats_ts(src_file))
+    return parse_summary(json_stats, json_stats.get('timestamp', None) or calc_stats_ts(src_file))
+
+
+def parse_summary(json_stats: dict, timestamp: str = None) -> TimestampedResult:
+    timestamp = timestamp or json_stats['timestamp']
     result = json_stats.get('result', json_stats)
     if 'error' in result:
         return TimestampedResult(timestamp=timestamp, error=result['error'])
@@ -29,11 +36,7 @@ def extract_summary(src_file: Path) -> TimestampedResult:
 
 
 def transform_summary(cur_ts_summary: TimestampedResult, combined_summaries_file: Path) -> bool:
-    summaries_history = list()
-    if combined_summaries_file.exists():
-        with combined_summaries_file.open() as json_file:
-            logger.debug('Reading {}'.format(combined_summaries_file))
-            summaries_history = json.load(json_file)
+    summaries_history = read_ts_history(combined_summaries_file, logger)
 
     cur_summary = dict()
 
@@ -52,13 +55,36 @@ def transform_summary(cur_ts_summary: TimestampedResult, combined_summaries_file
         logger.debug('No changes; ignoring {}'.format(cur_ts_summary))
         return False
 
-    with combined_summaries_file.open(mode='w') as json_file:
-        logger.info('Updating {} with {} entries'.format(combined_summaries_file, len(summaries_history)))
-        json.dump(summaries_history, fp=json_file, default=lambda o: o.__dict__, sort_keys=True, indent=2)
+    logger.info('Updating {} with {} entries'.format(combined_summaries_file, len(summaries_history)))
+    write_ts_history(combined_summaries_file, summaries_history, logger)
 
     return changed
 
 
+def process_src_file(src_file: Path, root_path: Path, checkpoint: Checkpoint = None):
+    process_stats_file(src_file, root_path,
+                       lambda file: transform_summary(extract_summary(file), root_path / Path(combined_file)), logger,
+                       checkpoint)
+
+
+def process_log(root_path: Path, checkpoint: Checkpoint) -> int:
+    return process_stats_log(root_path, checkpoint,
+                             lambda json_stats: transform_summary(parse_summary(json_stats),
+                                                                  root_path / Path(combined_file)), logger)
+
+
+def finalize(root_path: Path, checkpoint: Checkpoint = None):
+    # Finalize all target files: combined_file
+    finalize_target_files(root_path, target_file_patterns, logger, checkpoint)
+
+
+def run(device_id: str):
+    root_path = Path('devices', device_id, 'summary')
+    run_stats_etl(root_path, target_file_patterns,
+                  lambda src_file, checkpoint: process_src_file(src_file, root_path, checkpoint),
+                  lambda checkpoint: process_log(root_path, checkpoint), logger)
+
+
 def main():
     with open('devices/devices.json') as devices_file:
         supported_devices = json.load(devices_file)
@@ -67,28 +93,7 @@ def main():
     parser.add_argument('device_id', choices=supported_devices.keys())
     args = parser.parse_args()
 
-    root_path = Path('devices', args.device_id, 'summary')
-    processed_path = root_path / Path('processed')
-    processed_path.mkdir(exist_ok=True)
-    combined_summaries_file = root_path / Path(combined_file)
-
-    src_file_pattern = '20*.json'
-    src_files = sorted(root_path.glob(src_file_pattern))
-    if not src_files:
-        logger.info('No source files from {}/{}'.format(root_path, src_file_pattern))
-        return
-
-    logger.info('Checking {} files in {}'.format(len(src_files), root_path))
-    for src_file in src_files:
-        summary = extract_summary(src_file)
-        transform_summary(summary, combined_summaries_file)
-
-        # Getting here means the source file has been completely processed
-        # Move source file to processed area
-        src_file.rename(processed_path / src_file.name)
-
-    # Finalize all target files: combined_file, upstream/*.json and downstream/*.json
-    finalize_target_files(root_path, [combined_file], logger)
+    run(args.device_id)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,54 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from etl.archive import archive_processed_files, build_archive_path, iter_processed_files, read_index, \
+    read_processed_file, restore_processed_files
+from etl.partitions import build_partition_path
+
+
+class TestArchive(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root_path = Path(self.tmp_dir.name)
+        self.processed_path = self.root_path / 'processed'
+        self.processed_path.mkdir()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def write_src_files(self, names):
+        for name in names:
+            with (self.processed_path / name).open(mode='w') as json_file:
+                json.dump({'timestamp': name, 'result': []}, fp=json_file)
+
+    def test_archive_processed_files(self):
+        self.write_src_files(['20220906_235900_000000.json', '20220907_000100_000000.json',
+                              '20220907_000000_000000.json', '20220908_000000_000000.json'])
+        self.assertEqual(3, archive_processed_files(self.root_path, '20220908'))
+        self.assertEqual(['20220908_000000_000000.json'], sorted(f.name for f in self.processed_path.glob('*.json')))
+
+        index = read_index(build_archive_path(self.root_path))
+        self.assertEqual(['20220906', '20220907'], sorted(index.keys()))
+        self.assertEqual(2, index['20220907']['files'])
+        self.assertEqual('20220907_000000_000000.json', index['20220907']['first'])
+
+        # Late arrivals are merged into the day's bundle
+        self.write_src_files(['20220907_000030_000000.json'])
+        self.assertEqual(1, archive_processed_files(self.root_path, '20220908'))
+        self.assertEqual(3, read_index(build_archive_path(self.root_path))['20220907']['files'])
+
+        names = [name for name, _ in iter_processed_files(self.root_path)]
+        self.assertEqual(['20220906_235900_000000.json', '20220907_000000_000000.json',
+                          '20220907_000030_000000.json', '20220907_000100_000000.json',
+                          '20220908_000000_000000.json'], names)
+        names = [name for name, _ in iter_processed_files(self.root_path, '20220907', '20220907')]
+        self.assertEqual(3, len(names))
+
+        data = read_processed_file(self.root_path, '20220907_000030_000000.json')
+        self.assertEqual('20220907_000030_000000.json', json.loads(data)['timestamp'])
+        self.assertIsNone(read_processed_file(self.root_path, '20220907_000031_000000.json'))
+
+        self.assertEqual(1, restore_processed_files(self.root_path, '20220906'))
+        self.assertTrue(build_partition_path(self.root_path, '20220906_235900_000000.json').exists())
@@ -0,0 +1,38 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from etl.checkpoint import Checkpoint
+
+
+class TestCheckpoint(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root_path = Path(self.tmp_dir.name)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_checkpoint(self):
+        target_file = self.root_path / 'events.json'
+        target_file.write_text('[]')
+
+        checkpoint = Checkpoint(self.root_path, ['events.json']).load()
+        self.assertTrue(checkpoint.needs_finalize())
+        checkpoint.set_finalized()
+        self.assertFalse(checkpoint.needs_finalize())
+
+        src_file = self.root_path / '20220907_120800.json'
+        checkpoint.set_applied(src_file)
+        self.assertTrue(checkpoint.needs_finalize())
+
+        # A restarted run knows the source file was applied
+        checkpoint = Checkpoint(self.root_path, ['events.json']).load()
+        self.assertTrue(checkpoint.is_applied(src_file))
+        self.assertFalse(checkpoint.is_applied(self.root_path / '20220907_120500.json'))
+        self.assertTrue(checkpoint.needs_finalize())
+
+        checkpoint.set_finalized()
+        self.assertEqual([], checkpoint.get_changed_targets())
+        target_file.write_text('[\n  {}\n]')
+        self.assertEqual([target_file], checkpoint.get_changed_targets())
@@ -1,9 +1,14 @@
 import json
+import tempfile
 from datetime import datetime, timedelta
 from pathlib import Path
 from unittest import TestCase
 
-from etl.details import extract_connection_stats, is_channel_stats_changed, transform_details_stats
+from etl import build_stats_log, count_pending_log_bytes, read_pending_samples
+from etl.checkpoint import Checkpoint
+from etl.counters import parse_uptime, decode_counter_history
+from etl.details import extract_connection_stats, is_channel_stats_changed, transform_details_stats, \
+    is_channel_counters_changed, process_log, target_file_patterns, transform_channel_stats
 from hnap import HNAPDevice
 from models import ConnectionDetails, StartupStep
 
@@ -30,6 +35,28 @@ class TestDetails(TestCase):
         self.assertEqual(32, len(act.result.downstream_channels))
         self.assertEqual('Allowed', act.result.network_access)
 
+    def test_process_log(self):
+        with Path('data', 'details', '20220907_120800.json').open() as json_file:
+            json_stats = json.load(json_file)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root_path = Path(tmp_dir)
+            stats_log = build_stats_log(root_path)
+            for minutes in [0, 5]:
+                timestamp = (datetime(2022, 9, 7, 12, 8) + timedelta(minutes=minutes)).isoformat()
+                stats_log.append(json.dumps(dict(json_stats, timestamp=timestamp)).encode())
+            stats_log.close()
+
+            checkpoint = Checkpoint(root_path, target_file_patterns)
+            self.assertEqual(2, process_log(root_path, checkpoint))
+            self.assertEqual(0, count_pending_log_bytes(root_path, checkpoint))
+            self.assertTrue((root_path / 'details.json').exists())
+            self.assertEqual(32, len(list((root_path / 'downstream').glob('ch*.json'))))
+
+            # The next run picks up where this one stopped
+            checkpoint = Checkpoint(root_path, target_file_patterns).load()
+            self.assertEqual(stats_log.get_end_offset(), checkpoint.log_offset)
+            self.assertEqual(0, process_log(root_path, checkpoint))
+
     def test_model_init(self):
         cd = ConnectionDetails()
         self.assertEqual(5, len(cd.startup_steps))
@@ -152,3 +179,80 @@ class TestDetails(TestCase):
         unique_ts_history = [json.loads(d) for d in unique_ts_history]
         self.assertFalse(ts_history == unique_ts_history)
         self.assertEqual(4, len(unique_ts_history))
+
+    def test_parse_uptime(self):
+        self.assertEqual(timedelta(days=1, hours=7, minutes=20, seconds=41), parse_uptime('1 days 07h:20m:41s'))
+        self.assertEqual(timedelta(minutes=5, seconds=2), parse_uptime('00h:05m:02s'))
+        self.assertIsNone(parse_uptime(''))
+        self.assertIsNone(parse_uptime('unknown'))
+
+    def test_is_channel_counters_changed(self):
+        json_filepath = Path('data', 'details', '20220907_120800.json')
+        cur_ts_stats = extract_connection_stats(json_filepath)
+        ts = datetime.fromisoformat(cur_ts_stats.timestamp)
+        uptime = cur_ts_stats.result.uptime
+
+        cur_stats = vars(cur_ts_stats.result.downstream_channels[0]).copy()
+        history = list()
+        self.assertTrue(is_channel_counters_changed(history, cur_stats.copy(), ts.isoformat(), uptime))
+        self.assertTrue(history[0]['keyframe'])
+        self.assertEqual(cur_stats['corrected'], history[0]['corrected'])
+
+        # No new errors and no signal change
+        ts += timedelta(minutes=5)
+        self.assertFalse(is_channel_counters_changed(history, cur_stats.copy(), ts.isoformat(), uptime))
+        self.assertEqual(1, len(history))
+
+        # Only the deltas are stored until the next keyframe
+        ts += timedelta(minutes=5)
+        cur_stats['corrected'] += 30
+        self.assertTrue(is_channel_counters_changed(history, cur_stats.copy(), ts.isoformat(), uptime))
+        self.assertEqual(2, len(history))
+        self.assertFalse('corrected' in history[1])
+        self.assertEqual(30, history[1]['corrected_delta'])
+        self.assertEqual(0, history[1]['uncorrected_delta'])
+        self.assertEqual(0.05, history[1]['corrected_rate'])
+
+        # Counters restart after a reboot
+        ts += timedelta(minutes=5)
+        cur_stats['corrected'] = 12
+        cur_stats['uncorrected'] = 3
+        self.assertTrue(is_channel_counters_changed(history, cur_stats.copy(), ts.isoformat(), '0 days 00h:02m:00s'))
+        self.assertTrue(history[2]['reset'])
+        self.assertEqual(12, history[2]['corrected_delta'])
+        self.assertEqual(120, history[2]['interval_secs'])
+
+        decoded = decode_counter_history(history)
+        self.assertEqual(cur_ts_stats.result.downstream_channels[0].corrected + 30, decoded[1]['corrected'])
+        self.assertEqual(12, decoded[2]['corrected'])
+
+    def test_transform_channel_stats_samples(self):
+        cur_ts_stats = extract_connection_stats(Path('data', 'details', '20220907_120800.json'))
+        ts = datetime.fromisoformat(cur_ts_stats.timestamp)
+        channels = cur_ts_stats.result.downstream_channels[:1]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root_path = Path(tmp_dir)
+            channel_file = root_path / 'downstream' / 'ch{:02}.json'.format(channels[0].channel_id)
+            pending_samples = dict()
+            transform_channel_stats('downstream', ts.isoformat(), channels, root_path, pending_samples=pending_samples)
+            version = channel_file.stat().st_mtime_ns
+
+            # Unchanged polls are counted without rewriting the history; a poll is only counted once
+            for minutes in [5, 10, 10]:
+                transform_channel_stats('downstream', (ts + timedelta(minutes=minutes)).isoformat(), channels,
+                                        root_path, pending_samples=pending_samples)
+            self.assertEqual(version, channel_file.stat().st_mtime_ns)
+            key = 'downstream/{}'.format(channel_file.name)
+            self.assertEqual({key: {'timestamp': ts.isoformat(), 'samples': 3,
+                                    'last_timestamp': (ts + timedelta(minutes=10)).isoformat()}}, pending_samples)
+
+            # The entry takes its count along once a new entry follows it
+            channels[0].corrected += 30
+            transform_channel_stats('downstream', (ts + timedelta(minutes=15)).isoformat(), channels, root_path,
+                                    pending_samples=pending_samples)
+            with channel_file.open() as json_file:
+                history = json.load(json_file)
+            self.assertEqual([3, 1], [h.get('samples', 1) for h in history])
+            self.assertEqual((ts + timedelta(minutes=10)).isoformat(), history[0]['last_timestamp'])
+            self.assertEqual(dict(), pending_samples)
+            self.assertEqual(dict(), read_pending_samples(root_path))
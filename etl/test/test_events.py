@@ -1,10 +1,18 @@
 import json
+import logging
+import tempfile
 from datetime import datetime
 from pathlib import Path
 from unittest import TestCase
+from unittest.mock import patch
 
 from devices.motorola import MotorolaDevice
-from etl.events import combine_events
+from etl import finalize_target_files
+from etl.catalog import EventCatalog, decode_events, rebuild
+from etl.checkpoint import Checkpoint
+from etl.events import combine_events, transform_events
+from etl.history import HistoryFile
+from models import to_template, render_template
 
 device = MotorolaDevice('test')
 
@@ -75,3 +83,105 @@ class TestEvents(TestCase):
         # Check idempotency
         act = combine_events(act, device)
         self.assertEqual(4, len(act))
+
+    def test_combine_events_order(self):
+        cur_events = list()
+        cur_events.append({"timestamp": "2022-09-01T11:22:33", "priority": "Critical (3)", "desc": "d2"})
+        cur_events.append({"timestamp": "2022-09-01T11:22:33", "priority": "Critical (3)", "desc": "d1"})
+        cur_events.append({"timestamp": "2022-09-01T11:22:30", "priority": "Warning (2)", "desc": "w1"})
+        cur_events.append({"timestamp": "2022-09-01T11:22:33", "priority": "Critical (3)", "desc": "d2"})
+
+        act = combine_events(cur_events, device)
+        self.assertEqual(['w1', 'd1', 'd2'], [e['desc'] for e in act])
+        self.assertEqual(act, combine_events(list(reversed(cur_events)), device))
+
+    def test_to_template(self):
+        desc = 'No Ranging Response received - T3 time-out;CM-MAC=00:40:36:8c:cc:2d;CMTS-MAC=00:01:5c:be:54:36;' \
+               'CM-QOS=1.1;CM-VER=3.1;'
+        template, args = to_template(desc)
+        self.assertEqual('No Ranging Response received - T3 time-out;CM-MAC=<MAC>;CMTS-MAC=<MAC>;CM-QOS=1.1;'
+                         'CM-VER=3.1;', template)
+        self.assertEqual(['00:40:36:8c:cc:2d', '00:01:5c:be:54:36'], args)
+        self.assertEqual(desc, render_template(template, args))
+        self.assertEqual(('(Client <IP>): Ping failed', ['192.168.0.2']),
+                         to_template('(Client 192.168.0.2): Ping failed'))
+        self.assertEqual(('Literal <MAC> 00:40:36:8c:cc:2d', []), to_template('Literal <MAC> 00:40:36:8c:cc:2d'))
+
+    def test_transform_events_catalog(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root_path = Path(tmp_dir)
+            events_file = root_path / 'events.json'
+            with Path('data', 'events', '20220909_094503.json').open() as file:
+                cur_events = json.load(file)['result']
+            expected = combine_events(cur_events, device)
+
+            self.assertTrue(transform_events(cur_events, events_file, device))
+            self.assertFalse(transform_events(cur_events, events_file, device))
+            with HistoryFile(events_file) as history:
+                stored = [e for (_, e) in history.iter_from(history.first_offset())]
+            self.assertTrue(all('desc' not in e for e in stored))
+            self.assertCountEqual(expected, decode_events(root_path, stored))
+
+            catalog = EventCatalog(root_path).load()
+            self.assertEqual(7, len(catalog.entries))
+            self.assertEqual(len(expected), sum(catalog.get_counts().values()))
+            t3_ids = catalog.find('T3 time-out')
+            self.assertEqual(len([e for e in expected if 'T3 time-out' in e['desc']]), catalog.count(t3_ids))
+
+            # Histories written before the catalog are encoded (and recounted) in place
+            with events_file.open(mode='w') as json_file:
+                json.dump(expected, fp=json_file, sort_keys=True, indent=2)
+            catalog = rebuild(root_path)
+            with HistoryFile(events_file) as history:
+                self.assertCountEqual(stored, [e for (_, e) in history.iter_from(history.first_offset())])
+            self.assertEqual(len(expected), sum(catalog.get_counts().values()))
+
+    def test_transform_events_interrupted(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root_path = Path(tmp_dir)
+            events_file = root_path / 'events.json'
+            with Path('data', 'events', '20220909_094503.json').open() as file:
+                cur_events = json.load(file)['result']
+            expected = combine_events(cur_events, device)
+
+            # A run that stops after writing the events but before counting them
+            with patch.object(EventCatalog, 'set_counted', side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    transform_events(cur_events, events_file, device)
+            self.assertEqual(0, sum(EventCatalog(root_path).load().get_counts().values()))
+
+            # The next run counts the stored events, only once
+            self.assertFalse(transform_events(cur_events, events_file, device))
+            self.assertEqual(len(expected), sum(EventCatalog(root_path).load().get_counts().values()))
+            self.assertFalse(transform_events(cur_events, events_file, device))
+            self.assertEqual(len(expected), sum(EventCatalog(root_path).load().get_counts().values()))
+
+    def test_transform_events_sorted(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root_path = Path(tmp_dir)
+            events_file = root_path / 'events.json'
+            with Path('data', 'events', '20220909_094503.json').open() as file:
+                cur_events = json.load(file)['result']
+
+            # Splicing onto a missing (or finalized) history keeps it sorted, so finalize doesn't sort it again
+            checkpoint = Checkpoint(root_path, ['events.json'])
+            self.assertTrue(transform_events(cur_events, events_file, device, checkpoint))
+            self.assertTrue(checkpoint.is_sorted(events_file))
+            checkpoint.save()
+            self.assertTrue(Checkpoint(root_path, ['events.json']).load().is_sorted(events_file))
+            finalize_target_files(root_path, ['events.json'], logging.getLogger(), checkpoint)
+            self.assertTrue(checkpoint.is_sorted(events_file))
+            self.assertEqual(dict(), checkpoint.sorted_targets)
+
+            # Once something else rewrites the history it has to be sorted again
+            with HistoryFile(events_file) as history:
+                stored = [e for (_, e) in history.iter_from(history.first_offset())]
+            with events_file.open(mode='w') as json_file:
+                json.dump(list(reversed(stored)), fp=json_file, sort_keys=True, indent=2)
+            self.assertFalse(checkpoint.is_sorted(events_file))
+            transform_events(cur_events, events_file, device, checkpoint)
+            self.assertFalse(checkpoint.is_sorted(events_file))
+            finalize_target_files(root_path, ['events.json'], logging.getLogger(), checkpoint)
+            with HistoryFile(events_file) as history:
+                timestamps = [e['timestamp'] for (_, e) in history.iter_from(history.first_offset())]
+            self.assertEqual(sorted(timestamps), timestamps)
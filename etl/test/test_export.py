@@ -0,0 +1,44 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from etl.export import get_day_rows, get_new_days, read_csv_partition, schemas, write_csv
+
+
+class TestExport(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.channel_file = Path(self.tmp_dir.name, 'ch01.json')
+        history = [{'timestamp': '2022-09-06T23:59:00', 'channel_id': 1, 'modulation': 'QAM256', 'snr': 39.0,
+                    'corrected': 100, 'uncorrected': 5, 'keyframe': True},
+                   {'timestamp': '2022-09-07T00:01:00', 'channel_id': 1, 'modulation': 'QAM256', 'snr': 38.5,
+                    'corrected_delta': 10, 'uncorrected_delta': 0},
+                   {'timestamp': '2022-09-07T00:02:00', 'channel_id': 1, 'modulation': 'OFDM PLC', 'snr': 38.0,
+                    'corrected_delta': 2, 'uncorrected_delta': 1}]
+        with self.channel_file.open(mode='w') as json_file:
+            json.dump(history, fp=json_file, sort_keys=True, indent=2)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_get_new_days(self):
+        self.assertEqual(({'2022-09-06', '2022-09-07'}, '2022-09-07T00:02:00'), get_new_days([self.channel_file], ''))
+        self.assertEqual(({'2022-09-07'}, '2022-09-07T00:02:00'),
+                         get_new_days([self.channel_file], '2022-09-07T00:02:00'))
+
+    def test_csv_partition(self):
+        rows = get_day_rows([self.channel_file], 'downstream', '2022-09-07')
+        self.assertEqual([110, 112], [r['corrected'] for r in rows])
+
+        partition_path = Path(self.tmp_dir.name, 'day=2022-09-07')
+        partition_path.mkdir()
+        write_csv(partition_path, rows, schemas['downstream'])
+        with (partition_path / '_schema.json').open() as json_file:
+            self.assertEqual(['QAM256', 'OFDM PLC'], json.load(json_file)['dictionaries']['modulation'])
+
+        exported = read_csv_partition(partition_path)
+        self.assertEqual(2, len(exported))
+        self.assertEqual({'timestamp': '2022-09-07T00:02:00', 'channel_id': 1, 'lock_status': None, 'freq_mhz': None,
+                          'power_dbmv': None, 'snr': 38.0, 'corrected': 112, 'uncorrected': 6, 'corrected_delta': 2,
+                          'uncorrected_delta': 1, 'modulation': 'OFDM PLC'}, exported[1])
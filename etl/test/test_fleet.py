@@ -0,0 +1,83 @@
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from etl.checkpoint import Checkpoint, etl_lock, held_locks, lock_file_name
+from etl.fleet import build_tasks, run_etl
+from etl.history import HistoryFile
+from etl.partitions import build_partition_path
+
+supported_devices = {'d1': {'device_type': 'motorola'}, 'd2': {'device_type': 'motorola'}}
+
+
+class TestFleet(TestCase):
+    def setUp(self) -> None:
+        self.data_path = Path('data').resolve()
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        # The ETL scripts work on devices/ under the current directory
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def write_src_files(self, device_id: str, stat_type: str, names):
+        root_path = Path('devices', device_id, stat_type)
+        for name in names:
+            src_file = build_partition_path(root_path, name)
+            src_file.parent.mkdir(parents=True, exist_ok=True)
+            with src_file.open(mode='w') as json_file:
+                json.dump({'timestamp': name, 'result': []}, fp=json_file)
+
+    def test_build_tasks(self):
+        # A task for each stat type a device has stats for, biggest backlog first
+        self.write_src_files('d1', 'summary', ['20220907_000000_000000.json'])
+        self.write_src_files('d1', 'details', ['20220907_000000_000000.json', '20220908_000000_000000.json'])
+        self.write_src_files('d2', 'events', ['20220907_000000_000000.json', '20220908_000000_000000.json',
+                                              '20220909_000000_000000.json'])
+        self.assertEqual([('d2', 'motorola', 'events'), ('d1', 'motorola', 'details'), ('d1', 'motorola', 'summary')],
+                         build_tasks(supported_devices, ['d1', 'd2']))
+
+        # Applied source files are no longer a backlog
+        checkpoint = Checkpoint(Path('devices', 'd2', 'events'), list())
+        checkpoint.last_partition = '2022/09/09'
+        checkpoint.save()
+        self.assertEqual([('d1', 'motorola', 'details'), ('d1', 'motorola', 'summary'), ('d2', 'motorola', 'events')],
+                         build_tasks(supported_devices, ['d1', 'd2']))
+
+    def test_run_etl(self):
+        root_path = Path('devices', 'd1', 'events')
+        src_file = build_partition_path(root_path, '20220909_094503_000000.json')
+        src_file.parent.mkdir(parents=True)
+        shutil.copy(self.data_path / 'events' / '20220909_094503.json', src_file)
+
+        # The scripts take the lock run_etl already holds
+        device_id, stat_type, _ = run_etl('d1', 'motorola', 'events')
+        self.assertEqual(('d1', 'events'), (device_id, stat_type))
+        self.assertEqual(dict(), held_locks)
+        self.assertFalse(src_file.exists())
+        with HistoryFile(root_path / 'events.json') as history:
+            self.assertLess(0, len(list(history.iter_from(history.first_offset()))))
+        checkpoint = Checkpoint(root_path, ['events.json']).load()
+        self.assertEqual('2022/09/09', checkpoint.last_partition)
+        self.assertFalse(checkpoint.needs_finalize())
+
+    def test_etl_lock(self):
+        root_path = Path('devices', 'd1', 'summary')
+        root_path.mkdir(parents=True)
+        with etl_lock(root_path):
+            with etl_lock(root_path):
+                # Other runs (e.g. combine.sh) have to wait
+                with (root_path / lock_file_name).open(mode='w') as lock_file:
+                    with self.assertRaises(BlockingIOError):
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            with (root_path / lock_file_name).open(mode='w') as lock_file:
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        with (root_path / lock_file_name).open(mode='w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
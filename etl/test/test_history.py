@@ -0,0 +1,148 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from etl.history import HistoryFile, query_history, to_priority_level, get_counters_before, update_history_index, \
+    read_history_index, append_history, splice_history, replace_history_range
+
+
+def write_history(path: Path, history: list, indent=2):
+    with path.open(mode='w') as json_file:
+        json.dump(history, fp=json_file, sort_keys=True, indent=indent)
+
+
+class TestHistory(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.history_file = Path(self.tmp_dir.name, 'history.json')
+        self.history = [{'timestamp': '2022-09-07T11:22:{:02}'.format(s), 'nested': {'seq': s}, 'desc': 'd{}'.format(s)}
+                        for s in range(0, 60, 3)]
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_bisect(self):
+        write_history(self.history_file, self.history)
+        with HistoryFile(self.history_file) as history:
+            offset = history.bisect('2022-09-07T11:22:30')
+            self.assertEqual(self.history[10], history.record_at(offset)[0])
+            offset = history.bisect('2022-09-07T11:22:31')
+            self.assertEqual(self.history[11], history.record_at(offset)[0])
+            self.assertEqual(history.first_offset(), history.bisect('2022'))
+            self.assertEqual(history.size(), history.bisect('2023'))
+
+    def test_iter_back_from(self):
+        write_history(self.history_file, self.history)
+        with HistoryFile(self.history_file) as history:
+            records = [r for _, r in history.iter_back_from(history.bisect('2022-09-07T11:22:09'))]
+            self.assertEqual(list(reversed(self.history[:3])), records)
+
+    def test_query_history(self):
+        for indent in [2, None]:
+            write_history(self.history_file, self.history, indent)
+            self.assertEqual(self.history, query_history(self.history_file))
+            self.assertEqual(self.history[10:12],
+                             query_history(self.history_file, '2022-09-07T11:22:30', '2022-09-07T11:22:36'))
+            self.assertEqual([self.history[11]],
+                             query_history(self.history_file, '2022-09-07T11:22:30', '2022-09-07T11:22:36',
+                                           lambda r: r['desc'] == 'd33'))
+            self.assertEqual([], query_history(self.history_file, '2023'))
+
+        write_history(self.history_file, [])
+        self.assertEqual([], query_history(self.history_file, '2022'))
+        self.assertEqual([], query_history(Path(self.tmp_dir.name, 'missing.json')))
+
+    def test_get_counters_before(self):
+        history = [{'timestamp': '2022-09-07T11:00:00', 'corrected': 100, 'uncorrected': 10, 'keyframe': True},
+                   {'timestamp': '2022-09-07T11:05:00', 'corrected_delta': 5, 'uncorrected_delta': 1},
+                   {'timestamp': '2022-09-07T11:10:00', 'corrected_delta': 7, 'uncorrected_delta': 0}]
+        write_history(self.history_file, history)
+        with HistoryFile(self.history_file) as history:
+            self.assertEqual({'corrected': 105, 'uncorrected': 11},
+                             get_counters_before(history, history.bisect('2022-09-07T11:10:00')))
+            self.assertIsNone(get_counters_before(history, history.first_offset()))
+
+    def test_to_priority_level(self):
+        self.assertEqual(3, to_priority_level('Critical (3)'))
+        self.assertEqual(6, to_priority_level('6'))
+        self.assertIsNone(to_priority_level(None))
+
+    def test_update_history_index(self):
+        write_history(self.history_file, self.history)
+        self.assertTrue(update_history_index(self.history_file, every=4))
+        index = read_history_index(self.history_file)
+        self.assertEqual(20, index['count'])
+        self.assertEqual(5, len(index['entries']))
+        self.assertFalse(update_history_index(self.history_file, every=4))
+
+        # Appending only indexes the new records
+        self.history.append({'timestamp': '2022-09-07T11:23:00', 'desc': 'd60'})
+        write_history(self.history_file, self.history)
+        self.assertTrue(update_history_index(self.history_file, every=4))
+        index = read_history_index(self.history_file)
+        self.assertEqual(21, index['count'])
+        self.assertEqual(6, len(index['entries']))
+
+        with HistoryFile(self.history_file) as history:
+            self.assertIsNotNone(history.index)
+            for i, record in enumerate(self.history):
+                offset = history.bisect(record['timestamp'])
+                self.assertEqual(record, history.record_at(offset)[0])
+            self.assertEqual(history.size(), history.bisect('2023'))
+
+        # Rewriting earlier records invalidates the index
+        self.history.insert(0, {'timestamp': '2022-09-07T11:21:00', 'desc': 'first'})
+        write_history(self.history_file, self.history)
+        with HistoryFile(self.history_file) as history:
+            self.assertIsNone(history.index)
+        self.assertTrue(update_history_index(self.history_file, every=4))
+        self.assertEqual(22, read_history_index(self.history_file)['count'])
+        self.assertEqual(self.history[10:12],
+                         query_history(self.history_file, self.history[10]['timestamp'], self.history[12]['timestamp']))
+
+    def test_append_history(self):
+        expected_file = Path(self.tmp_dir.name, 'expected.json')
+        for initial in [[], self.history[:1], self.history[:10]]:
+            write_history(self.history_file, initial)
+            append_history(self.history_file, self.history[len(initial):])
+            write_history(expected_file, self.history)
+            self.assertEqual(expected_file.read_text(), self.history_file.read_text())
+
+        append_history(Path(self.tmp_dir.name, 'new.json'), self.history)
+        self.assertEqual(expected_file.read_text(), Path(self.tmp_dir.name, 'new.json').read_text())
+
+    def test_splice_history(self):
+        expected_file = Path(self.tmp_dir.name, 'expected.json')
+        replacement = [{'timestamp': '2022-09-07T11:22:31', 'desc': 'new'}]
+        for indent in [2, None]:
+            write_history(self.history_file, self.history, indent)
+            with HistoryFile(self.history_file) as history:
+                offset = history.bisect('2022-09-07T11:22:30')
+            splice_history(self.history_file, offset, replacement)
+            write_history(expected_file, self.history[:10] + replacement)
+            self.assertEqual(json.loads(expected_file.read_text()), json.loads(self.history_file.read_text()))
+        self.assertEqual(expected_file.read_text(), self.history_file.read_text())
+
+        # Replacing everything
+        with HistoryFile(self.history_file) as history:
+            offset = history.first_offset()
+        splice_history(self.history_file, offset, [])
+        self.assertEqual('[]', self.history_file.read_text())
+
+    def test_replace_history_range(self):
+        expected_file = Path(self.tmp_dir.name, 'expected.json')
+        replacement = [{'timestamp': '2022-09-07T11:22:31', 'desc': 'new'}]
+        # Replacing the middle, the head and the tail of the history
+        cases = [('2022-09-07T11:22:30', '2022-09-07T11:22:36', self.history[:10] + replacement + self.history[12:]),
+                 ('2022-09-07T11:22:00', '2022-09-07T11:22:36', replacement + self.history[12:]),
+                 ('2022-09-07T11:22:30', '2022-09-07T11:23:00', self.history[:10] + replacement)]
+        for (start_ts, end_ts, expected) in cases:
+            for indent in [2, None]:
+                write_history(self.history_file, self.history, indent)
+                with HistoryFile(self.history_file) as history:
+                    start, end = history.bisect(start_ts), history.bisect(end_ts)
+                replace_history_range(self.history_file, start, end, replacement)
+                write_history(expected_file, expected)
+                self.assertEqual(expected, json.loads(self.history_file.read_text()))
+            self.assertEqual(expected_file.read_text(), self.history_file.read_text())
@@ -0,0 +1,82 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from etl.nodes import build_node_path, calc_percentile, run
+from etl.rollups import channel_fields, resolutions, rollup_entries
+
+
+class TestNodes(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.devices_path = Path(self.tmp_dir.name, 'devices')
+        self.nodes_path = Path(self.tmp_dir.name, 'nodes')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def write_rollups(self, device_id: str, channel_id: int, entries: list):
+        history = list()
+        rollup_entries(history, entries, resolutions['1h'], channel_fields['downstream'])
+        rollup_file = self.devices_path / device_id / 'details' / 'rollups' / '1h' / 'downstream' / \
+            'ch{:02}.json'.format(channel_id)
+        rollup_file.parent.mkdir(parents=True, exist_ok=True)
+        with rollup_file.open(mode='w') as json_file:
+            json.dump(history, fp=json_file, sort_keys=True, indent=2)
+
+    def read_node(self, freq_key: str) -> list:
+        with build_node_path('downstream', freq_key, '1h', self.nodes_path).open() as json_file:
+            return json.load(json_file)
+
+    def test_calc_percentile(self):
+        self.assertEqual(2.5, calc_percentile([1, 2, 3, 4], 50))
+        self.assertEqual(1, calc_percentile([1, 2, 3, 4], 0))
+        self.assertEqual(7, calc_percentile([7], 90))
+
+    def test_run(self):
+        # Devices number their channels differently; the frequency is what they share
+        for (device_id, channel_id, snr) in [('d1', 1, 39.0), ('d2', 5, 38.0), ('d3', 2, 30.0)]:
+            self.write_rollups(device_id, channel_id, [
+                {'timestamp': '2022-09-07T11:05:00', 'freq_mhz': 375.0, 'power_dbmv': -7.0, 'snr': snr},
+                {'timestamp': '2022-09-07T12:05:00', 'freq_mhz': 375.0, 'power_dbmv': -7.0, 'snr': snr}])
+        device_ids = ['d1', 'd2', 'd3']
+        self.assertEqual(2, run(device_ids, '1h', self.nodes_path, self.devices_path))
+
+        node = self.read_node('375.0')
+        self.assertEqual(['2022-09-07T11:00:00', '2022-09-07T12:00:00'], [b['timestamp'] for b in node])
+        self.assertEqual({'p10': 31.6, 'p50': 38.0, 'p90': 38.8, 'min': 30.0, 'max': 39.0, 'devices': 3},
+                         node[0]['snr'])
+        self.assertEqual(-7.0, node[0]['devices']['d3/ch02']['power_dbmv'])
+
+        # Only the last bucket of each device is read again; a device's new values replace its earlier ones
+        self.write_rollups('d3', 2, [
+            {'timestamp': '2022-09-07T11:05:00', 'freq_mhz': 375.0, 'power_dbmv': -7.0, 'snr': 30.0},
+            {'timestamp': '2022-09-07T12:05:00', 'freq_mhz': 375.0, 'power_dbmv': -7.0, 'snr': 30.0},
+            {'timestamp': '2022-09-07T12:35:00', 'freq_mhz': 375.0, 'power_dbmv': -7.0, 'snr': 38.0}])
+        self.assertEqual(1, run(device_ids, '1h', self.nodes_path, self.devices_path))
+        node = self.read_node('375.0')
+        self.assertEqual(2, len(node))
+        self.assertEqual(34.0, node[1]['devices']['d3/ch02']['snr'])
+        self.assertEqual(3, node[1]['snr']['devices'])
+
+        # Buckets arriving after later ones are spliced in place; the earlier buckets are kept as they are
+        self.write_rollups('d4', 3, [
+            {'timestamp': '2022-09-07T11:35:00', 'freq_mhz': 375.0, 'power_dbmv': -7.0, 'snr': 36.0}])
+        self.assertEqual(1, run(['d4'], '1h', self.nodes_path, self.devices_path))
+        node = self.read_node('375.0')
+        self.assertEqual(['2022-09-07T11:00:00', '2022-09-07T12:00:00'], [b['timestamp'] for b in node])
+        self.assertEqual(4, node[0]['snr']['devices'])
+        self.assertEqual(3, node[1]['snr']['devices'])
+
+    def test_run_same_freq(self):
+        # Two channels of a device on the same frequency both count
+        self.write_rollups('d1', 1, [
+            {'timestamp': '2022-09-07T11:05:00', 'freq_mhz': 375.0, 'power_dbmv': -7.0, 'snr': 39.0}])
+        self.write_rollups('d1', 2, [
+            {'timestamp': '2022-09-07T11:05:00', 'freq_mhz': 375.0, 'power_dbmv': -9.0, 'snr': 33.0}])
+        self.assertEqual(1, run(['d1'], '1h', self.nodes_path, self.devices_path))
+        node = self.read_node('375.0')
+        self.assertEqual({'d1/ch01', 'd1/ch02'}, set(node[0]['devices'].keys()))
+        self.assertEqual({'p10': 33.6, 'p50': 36.0, 'p90': 38.4, 'min': 33.0, 'max': 39.0, 'devices': 2},
+                         node[0]['snr'])
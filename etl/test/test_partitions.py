@@ -0,0 +1,59 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from etl.archive import archive_processed_files
+from etl.checkpoint import Checkpoint
+from etl.partitions import build_partition_path, find_src_files, migrate, move_to_processed, rewind_partition
+
+
+class TestPartitions(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root_path = Path(self.tmp_dir.name)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def write_src_files(self, path: Path, names):
+        path.mkdir(parents=True, exist_ok=True)
+        for name in names:
+            with (path / name).open(mode='w') as json_file:
+                json.dump({'timestamp': name, 'result': []}, fp=json_file)
+
+    def test_migrate_and_find(self):
+        self.write_src_files(self.root_path, ['20220907_000100_000000.json', '20221231_235959_000000.json',
+                                              '20230101_000000_000000.json', 'notes.json'])
+        self.write_src_files(self.root_path / 'processed', ['20220906_000000_000000.json'])
+        self.assertEqual(4, migrate(self.root_path))
+        self.assertTrue((self.root_path / '2022' / '12' / '31' / '20221231_235959_000000.json').exists())
+        self.assertTrue((self.root_path / 'processed' / '2022' / '09' / '06').is_dir())
+
+        # A file left unpartitioned is always found; partitions only from since on
+        self.write_src_files(self.root_path, ['20220908_000000_000000.json'])
+        self.assertEqual(['20220907_000100_000000.json', '20220908_000000_000000.json',
+                          '20221231_235959_000000.json', '20230101_000000_000000.json'],
+                         [f.name for f in find_src_files(self.root_path)])
+        self.assertEqual(['20220908_000000_000000.json', '20221231_235959_000000.json',
+                          '20230101_000000_000000.json'],
+                         [f.name for f in find_src_files(self.root_path, '2022/10/01')])
+
+    def test_checkpoint_partition(self):
+        names = ['20220907_000100_000000.json', '20220908_000000_000000.json']
+        for name in names:
+            self.write_src_files(build_partition_path(self.root_path, name).parent, [name])
+
+        checkpoint = Checkpoint(self.root_path, list())
+        for src_file in find_src_files(self.root_path):
+            checkpoint.set_applied(src_file)
+            move_to_processed(src_file, self.root_path)
+        self.assertEqual('2022/09/08', checkpoint.last_partition)
+        self.assertEqual([], find_src_files(self.root_path, checkpoint.last_partition))
+
+        # Processed partitions are archived (and removed) like unpartitioned processed files
+        self.assertEqual(2, archive_processed_files(self.root_path, '20220909'))
+        self.assertFalse((self.root_path / 'processed' / '2022').exists())
+
+        rewind_partition(self.root_path, '2022/09/01')
+        self.assertEqual('2022/09/01', Checkpoint(self.root_path, list()).load().last_partition)
@@ -0,0 +1,69 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from etl.counters import decode_counter_history
+from etl.retention import compact_event_runs, compact_events, trim_history
+
+
+def write_history(path: Path, history: list):
+    with path.open(mode='w') as json_file:
+        json.dump(history, fp=json_file, sort_keys=True, indent=2)
+
+
+def read_history(path: Path) -> list:
+    with path.open() as json_file:
+        return json.load(json_file)
+
+
+class TestRetention(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_trim_history(self):
+        channel_file = Path(self.tmp_dir.name, 'ch01.json')
+        history = [{'timestamp': '2022-09-05T00:00:00', 'corrected': 100, 'uncorrected': 5, 'keyframe': True},
+                   {'timestamp': '2022-09-06T00:00:00', 'corrected_delta': 10, 'uncorrected_delta': 1},
+                   {'timestamp': '2022-09-06T12:00:00', 'corrected_delta': 20, 'uncorrected_delta': 0},
+                   {'timestamp': '2022-09-07T00:00:00', 'corrected_delta': 30, 'uncorrected_delta': 2}]
+        write_history(channel_file, history)
+        expected = decode_counter_history(read_history(channel_file))
+
+        self.assertLess(0, trim_history(channel_file, '2022-09-06T13:00:00', has_counters=True))
+        trimmed = read_history(channel_file)
+        self.assertEqual(['2022-09-06T12:00:00', '2022-09-07T00:00:00'], [e['timestamp'] for e in trimmed])
+        self.assertEqual({'timestamp': '2022-09-06T12:00:00', 'corrected': 130, 'uncorrected': 6,
+                          'corrected_delta': 20, 'uncorrected_delta': 0, 'keyframe': True}, trimmed[0])
+        self.assertEqual([(e['corrected'], e['uncorrected']) for e in expected[2:]],
+                         [(e['corrected'], e['uncorrected']) for e in decode_counter_history(trimmed)])
+
+        # Nothing more to drop
+        self.assertEqual(0, trim_history(channel_file, '2022-09-06T13:00:00', has_counters=True))
+
+    def test_compact_events(self):
+        events_file = Path(self.tmp_dir.name, 'events.json')
+        history = [{'timestamp': '2022-09-05T00:00:0{}'.format(s), 'priority': 'Critical (3)', 'desc': 'T3 time-out'}
+                   for s in range(5)]
+        history.append({'timestamp': '2022-09-05T00:00:05', 'priority': 'Notice (6)', 'desc': 'Ranging OK'})
+        history.append({'timestamp': '2022-09-07T00:00:00', 'priority': 'Critical (3)', 'desc': 'T3 time-out'})
+        write_history(events_file, history)
+
+        self.assertLess(0, compact_events(events_file, '', '2022-09-06T00:00:00'))
+        compacted = read_history(events_file)
+        self.assertEqual(3, len(compacted))
+        self.assertEqual(5, compacted[0]['repeat_count'])
+        self.assertEqual('2022-09-05T00:00:04', compacted[0]['last_timestamp'])
+        self.assertEqual(history[5:], compacted[1:])
+
+    def test_compact_event_runs(self):
+        events = [{'timestamp': 't1', 'priority': '3', 'desc': 'a', 'repeat_count': 2, 'last_timestamp': 't2'},
+                  {'timestamp': 't3', 'priority': '3', 'desc': 'a'},
+                  {'timestamp': 't4', 'priority': '5', 'desc': 'a'}]
+        compacted = compact_event_runs(events)
+        self.assertEqual(2, len(compacted))
+        self.assertEqual(3, compacted[0]['repeat_count'])
+        self.assertEqual('t3', compacted[0]['last_timestamp'])
@@ -0,0 +1,112 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from etl.rollups import rollup_entries, resolutions, to_bucket_ts, channel_fields, transform_rollups
+
+
+class TestRollups(TestCase):
+    def test_to_bucket_ts(self):
+        self.assertEqual('2022-09-07T11:22:00', to_bucket_ts('2022-09-07T11:22:33.100', resolutions['1m']))
+        self.assertEqual('2022-09-07T11:00:00', to_bucket_ts('2022-09-07T11:22:33.100', resolutions['1h']))
+        self.assertEqual('2022-09-07T00:00:00', to_bucket_ts('2022-09-07T11:22:33.100', resolutions['1d']))
+
+    def test_rollup_entries(self):
+        fields = channel_fields['downstream']
+        entries = [{'timestamp': '2022-09-07T11:22:33', 'power_dbmv': -7.0, 'snr': 39.0},
+                   {'timestamp': '2022-09-07T11:25:00', 'power_dbmv': -8.0, 'snr': 38.0, 'corrected_delta': 10},
+                   {'timestamp': '2022-09-07T12:01:00', 'power_dbmv': -9.0, 'snr': 37.0, 'corrected_delta': 20}]
+
+        history = list()
+        self.assertEqual(3, rollup_entries(history, entries, resolutions['1h'], fields))
+        self.assertEqual(2, len(history))
+        self.assertEqual(2, history[0]['count'])
+        self.assertEqual({'min': -8.0, 'max': -7.0, 'sum': -15.0, 'count': 2, 'mean': -7.5, 'last': -8.0},
+                         history[0]['power_dbmv'])
+        self.assertEqual(10, history[0]['corrected_delta']['sum'])
+
+        # Already rolled up entries are skipped; only the last bucket is updated
+        entries.append({'timestamp': '2022-09-07T12:30:00', 'power_dbmv': -6.0, 'snr': 40.0, 'corrected_delta': 0})
+        self.assertEqual(1, rollup_entries(history, entries, resolutions['1h'], fields))
+        self.assertEqual(2, len(history))
+        self.assertEqual(2, history[1]['count'])
+        self.assertEqual(-6.0, history[1]['power_dbmv']['max'])
+        self.assertEqual('2022-09-07T12:30:00', history[1]['last_timestamp'])
+
+    def test_rollup_entries_samples(self):
+        # An entry counts the unchanged polls after it; they had its signal and no new errors
+        fields = channel_fields['downstream']
+        entries = [{'timestamp': '2022-09-07T11:00:00', 'snr': 39.0, 'corrected_delta': 10, 'samples': 3},
+                   {'timestamp': '2022-09-07T11:15:00', 'snr': 35.0, 'corrected_delta': 20}]
+        history = list()
+        self.assertEqual(2, rollup_entries(history, entries, resolutions['1h'], fields))
+        self.assertEqual(4, history[0]['count'])
+        self.assertEqual({'min': 35.0, 'max': 39.0, 'sum': 152.0, 'count': 4, 'mean': 38.0, 'last': 35.0},
+                         history[0]['snr'])
+        self.assertEqual({'min': 0, 'max': 20, 'sum': 30, 'count': 4, 'mean': 7.5, 'last': 20},
+                         history[0]['corrected_delta'])
+
+        # The last entry went on to count 2 more polls; only those are added
+        entries[1]['samples'] = 3
+        self.assertEqual(1, rollup_entries(history, entries, resolutions['1h'], fields))
+        self.assertEqual(6, history[0]['count'])
+        self.assertEqual(30, history[0]['corrected_delta']['sum'])
+        self.assertEqual(0, history[0]['corrected_delta']['last'])
+        self.assertEqual(37.0, history[0]['snr']['mean'])
+        self.assertEqual(0, rollup_entries(history, entries, resolutions['1h'], fields))
+
+    def test_rollup_entries_samples_spread(self):
+        # A run of unchanged polls is spread over the buckets it covers, not piled into the entry's first one
+        fields = channel_fields['downstream']
+        entries = [{'timestamp': '2022-09-07T11:00:30', 'snr': 39.0, 'corrected_delta': 10, 'samples': 6,
+                    'last_timestamp': '2022-09-07T11:05:30'}]
+        minutes = list()
+        self.assertEqual(1, rollup_entries(minutes, entries, resolutions['1m'], fields))
+        self.assertEqual(['2022-09-07T11:0{}:00'.format(m) for m in range(6)], [b['timestamp'] for b in minutes])
+        self.assertEqual([1] * 6, [b['count'] for b in minutes])
+        self.assertEqual([10, 0, 0, 0, 0, 0], [b['corrected_delta']['sum'] for b in minutes])
+        self.assertEqual([39.0] * 6, [b['snr']['mean'] for b in minutes])
+
+        # The run goes on; only the new polls are added, each to its own bucket
+        entries[0].update({'samples': 8, 'last_timestamp': '2022-09-07T11:07:30'})
+        self.assertEqual(1, rollup_entries(minutes, entries, resolutions['1m'], fields))
+        self.assertEqual([1] * 8, [b['count'] for b in minutes])
+        self.assertEqual(0, rollup_entries(minutes, entries, resolutions['1m'], fields))
+
+        # 400 minutes of unchanged polls
+        entries = [{'timestamp': '2022-09-07T11:00:30', 'snr': 39.0, 'corrected_delta': 10, 'samples': 401,
+                    'last_timestamp': '2022-09-07T17:40:30'}]
+        minutes = list()
+        rollup_entries(minutes, entries, resolutions['1m'], fields)
+        self.assertEqual(401, len(minutes))
+        self.assertEqual({1}, {b['count'] for b in minutes})
+        hours = list()
+        rollup_entries(hours, entries, resolutions['1h'], fields)
+        self.assertEqual([60] * 6 + [41], [b['count'] for b in hours])
+        self.assertEqual(10, sum(b['corrected_delta']['sum'] for b in hours))
+
+    def test_transform_rollups(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            channel_file = Path(tmp_dir, 'upstream', 'ch01.json')
+            channel_file.parent.mkdir()
+            rollups_path = Path(tmp_dir, 'rollups')
+            entries = [{'timestamp': '2022-09-07T11:{:02}:00'.format(m), 'power_dbmv': 40.0 + m}
+                       for m in range(0, 60, 5)]
+            with channel_file.open(mode='w') as json_file:
+                json.dump(entries[:6], fp=json_file, sort_keys=True, indent=2)
+            self.assertEqual(18, transform_rollups('upstream', channel_file, rollups_path))
+
+            # The next run picks up from the last bucket of each rollup
+            with channel_file.open(mode='w') as json_file:
+                json.dump(entries, fp=json_file, sort_keys=True, indent=2)
+            self.assertEqual(6 * 2 + 6, transform_rollups('upstream', channel_file, rollups_path))
+            self.assertEqual(0, transform_rollups('upstream', channel_file, rollups_path))
+            with (rollups_path / '1m' / 'upstream' / 'ch01.json').open() as json_file:
+                self.assertEqual([e['timestamp'][:16] for e in entries],
+                                 [b['timestamp'][:16] for b in json.load(json_file)])
+            with (rollups_path / '1h' / 'upstream' / 'ch01.json').open() as json_file:
+                hour = json.load(json_file)
+            self.assertEqual(1, len(hour))
+            self.assertEqual({'min': 40.0, 'max': 95.0, 'sum': 810.0, 'count': 12, 'mean': 67.5, 'last': 95.0},
+                             hour[0]['power_dbmv'])
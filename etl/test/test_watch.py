@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from etl import events
+from etl.checkpoint import Checkpoint
+from etl.history import HistoryFile
+from etl.partitions import build_partition_path, rewind_partition
+from etl.watch import WatchedStats
+
+
+class TestWatch(TestCase):
+    def setUp(self) -> None:
+        self.data_path = Path('data').resolve()
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        # The ETL scripts work on devices/ under the current directory
+        os.chdir(self.tmp_dir.name)
+        self.root_path = Path('devices', 'd1', 'events')
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def copy_src_file(self, data_name: str, name: str) -> Path:
+        src_file = build_partition_path(self.root_path, name)
+        src_file.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(self.data_path / 'events' / data_name, src_file)
+        return src_file
+
+    def read_timestamps(self) -> list:
+        with HistoryFile(self.root_path / events.combined_file) as history:
+            return [e['timestamp'] for (_, e) in history.iter_from(history.first_offset())]
+
+    def test_process_and_finalize(self):
+        # The watcher picks up where the batch ETL stopped
+        self.copy_src_file('20220909_094503.json', '20220909_094503_000000.json')
+        events.run('d1', 'motorola')
+        stats = WatchedStats('d1', 'motorola', 'events')
+        stats.setup()
+        self.assertEqual([], stats.scan())
+        self.assertFalse(stats.pending_finalize)
+        batch_timestamps = self.read_timestamps()
+
+        # Files restored into a partition the ETL moved past are found once it is rewound, even though the
+        # watcher's checkpoint was loaded before
+        restored_file = self.copy_src_file('20220817_182857.json', '20220817_182857_000000.json')
+        rewind_partition(self.root_path, '2022/08/17')
+        self.assertEqual([restored_file], stats.scan())
+        stats.process(stats.scan())
+        self.assertFalse(restored_file.exists())
+        self.assertTrue(stats.pending_finalize)
+        stats.finalize()
+
+        timestamps = self.read_timestamps()
+        self.assertEqual(sorted(timestamps), timestamps)
+        self.assertLess(len(batch_timestamps), len(timestamps))
+        self.assertTrue(set(batch_timestamps).issubset(timestamps))
+        checkpoint = Checkpoint(self.root_path, events.target_file_patterns).load()
+        self.assertEqual('2022/08/17', checkpoint.last_partition)
+        self.assertFalse(checkpoint.needs_finalize())
+
+        # A restarted watcher has nothing left to do
+        stats = WatchedStats('d1', 'motorola', 'events')
+        stats.setup()
+        self.assertEqual([], stats.scan())
+        self.assertFalse(stats.pending_finalize)
@@ -0,0 +1,183 @@
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+from typing import List
+
+import log_config
+from devices import create_device
+from etl import details, events, rollups, summary, build_stats_log, count_pending_log_bytes
+from etl.checkpoint import Checkpoint, etl_lock
+from etl.partitions import find_src_files, is_src_file
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+# Importing the ETL scripts configures logging for each of them; send everything to one file instead
+log_config.configure('watch.log')
+logger = logging.getLogger('transformer')
+
+stat_types = ['summary', 'events', 'details']
+
+
+class WatchedStats:
+    # Source files for one device and stat type. The transforms keep their parsed histories cached between
+    # files, so each new file only costs its own parsing plus the history writes. Other runs (the batch ETL, a
+    # rewind) may change the checkpoint in between, so each step takes the ETL lock and reloads it first.
+    def __init__(self, device_id: str, device_type: str, stat_type: str):
+        self.device_id = device_id
+        self.stat_type = stat_type
+        self.root_path = Path('devices', device_id, stat_type)
+        self.device = create_device(device_id, device_type) if stat_type == 'events' else None
+        self.etl_module = {'summary': summary, 'events': events, 'details': details}[stat_type]
+        self.checkpoint = Checkpoint(self.root_path, self.etl_module.target_file_patterns)
+        self.failed = set()
+        self.pending_finalize = False
+        self.finalized_at = time.monotonic()
+        self.scanned_at = time.monotonic()
+
+    def __repr__(self):
+        return '{}({}/{})'.format(self.__class__.__name__, self.device_id, self.stat_type)
+
+    def setup(self):
+        (self.root_path / Path('processed')).mkdir(parents=True, exist_ok=True)
+        build_stats_log(self.root_path).path.mkdir(parents=True, exist_ok=True)
+        self.checkpoint.load()
+        self.pending_finalize = self.checkpoint.needs_finalize()
+
+    def scan(self, settle_secs: float = 0.0) -> List[Path]:
+        # Source files that aren't still being written (i.e. not modified in the last settle_secs)
+        self.checkpoint.load()
+        now = time.time()
+        return [f for f in find_src_files(self.root_path, self.checkpoint.last_partition)
+                if f.name not in self.failed and now - f.stat().st_mtime >= settle_secs]
+
+    def process(self, src_files: List[Path]):
+        with etl_lock(self.root_path):
+            self.checkpoint.load()
+            self.process_src_files(src_files)
+
+    def process_src_files(self, src_files: List[Path]):
+        for src_file in sorted(src_files):
+            if src_file.name in self.failed or not src_file.exists():
+                continue
+            try:
+                if self.stat_type == 'events':
+                    events.process_src_file(src_file, self.root_path, self.device, self.checkpoint)
+                else:
+                    self.etl_module.process_src_file(src_file, self.root_path, self.checkpoint)
+                self.pending_finalize = True
+            except Exception as e:
+                # Leave the file where it is for the batch ETL (or a person) to look at
+                logger.error('Processing {} FAILED ({}); skipping it'.format(src_file, e))
+                self.failed.add(src_file.name)
+
+    def process_log(self):
+        with etl_lock(self.root_path):
+            self.checkpoint.load()
+            self.process_pending_log()
+
+    def process_pending_log(self):
+        if not count_pending_log_bytes(self.root_path, self.checkpoint):
+            return
+        try:
+            if self.stat_type == 'events':
+                applied = events.process_log(self.root_path, self.device, self.checkpoint)
+            else:
+                applied = self.etl_module.process_log(self.root_path, self.checkpoint)
+            self.pending_finalize = self.pending_finalize or applied > 0
+        except Exception as e:
+            # The record stays unapplied; it is retried on the next append (or by the batch ETL)
+            logger.error('Processing {}/log FAILED ({})'.format(self.root_path, e))
+
+    def finalize(self):
+        with etl_lock(self.root_path):
+            self.checkpoint.load()
+            self.etl_module.finalize(self.root_path, self.checkpoint)
+            if self.stat_type == 'details':
+                rollups.run(self.device_id)
+        self.pending_finalize = False
+        self.finalized_at = time.monotonic()
+
+
+def watch(watched_stats: List[WatchedStats], poll_interval: float, finalize_interval: float):
+    for stats in watched_stats:
+        stats.setup()
+        # Catch up on anything that landed while nothing was watching
+        stats.process(stats.scan())
+        stats.process_log()
+
+    notifier = None
+    watch_descriptors = dict()
+    log_watch_descriptors = dict()
+    if INotify:
+        notifier = INotify()
+        for stats in watched_stats:
+            wd = notifier.add_watch(str(stats.root_path), flags.CLOSE_WRITE | flags.MOVED_TO)
+            watch_descriptors[wd] = stats
+            wd = notifier.add_watch(str(build_stats_log(stats.root_path).path), flags.MODIFY)
+            log_watch_descriptors[wd] = stats
+        logger.info('Watching {} with inotify'.format(watched_stats))
+    else:
+        logger.info('Watching {} by polling every {}s'.format(watched_stats, poll_interval))
+
+    while True:
+        if notifier:
+            new_files = dict()
+            appended = set()
+            for event in notifier.read(timeout=int(poll_interval * 1000)):
+                stats = watch_descriptors.get(event.wd, None)
+                if stats and is_src_file(event.name):
+                    new_files.setdefault(stats, list()).append(stats.root_path / event.name)
+                elif event.wd in log_watch_descriptors:
+                    appended.add(log_watch_descriptors[event.wd])
+            for stats, src_files in new_files.items():
+                stats.process(src_files)
+            for stats in appended:
+                stats.process_log()
+        else:
+            time.sleep(poll_interval)
+            for stats in watched_stats:
+                stats.process(stats.scan(settle_secs=1.0))
+                stats.process_log()
+
+        for stats in watched_stats:
+            if notifier and time.monotonic() - stats.scanned_at >= poll_interval:
+                # Only the top directory is watched; pick up files that landed in day partitions, which only
+                # means listing the few partitions since the checkpoint's
+                stats.process(stats.scan(settle_secs=1.0))
+                stats.scanned_at = time.monotonic()
+            # Finalizing rewrites whole histories, so do it once in a while rather than after every file
+            if stats.pending_finalize and time.monotonic() - stats.finalized_at >= finalize_interval:
+                stats.finalize()
+
+
+def main():
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--poll_interval', type=float, default=2.0, help='Check for new files every S seconds')
+    parser.add_argument('--finalize_interval', type=float, default=60.0,
+                        help='Sort, dedupe and index the histories at most every S seconds')
+    parser.add_argument('device_ids', nargs='+', choices=supported_devices.keys())
+    args = parser.parse_args()
+
+    watched_stats = list()
+    for device_id in args.device_ids:
+        device_type = supported_devices[device_id].get('device_type', None)
+        watched_stats.extend(WatchedStats(device_id, device_type, stat_type) for stat_type in stat_types)
+
+    try:
+        watch(watched_stats, args.poll_interval, args.finalize_interval)
+    except KeyboardInterrupt:
+        for stats in watched_stats:
+            if stats.pending_finalize:
+                stats.finalize()
+
+
+if __name__ == '__main__':
+    main()
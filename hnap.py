@@ -1,15 +1,20 @@
 import hmac
 import json
 import logging
+import random
+import socket
 import time
 from datetime import datetime, timedelta
+from pathlib import Path
 
 import requests
 # Disable warnings for ignoring SSL cert verification
 import urllib3
 from requests import Response
 
+from capture import ResponseCapture, build_capture_path
 from models import ConnectionSummary, ConnectionDetails, DeviceInfo
+from timestamps import to_epoch
 
 urllib3.disable_warnings()
 
@@ -30,6 +35,8 @@ class HNAPSession:
         self.encoded_password = None
         self.request_ts = None
         self.max_inactive = timedelta(seconds=600)
+        # Where raw responses are stored, if capturing (see HNAPDevice.enable_capture)
+        self.capture = None
 
     def __str__(self):
         return '{} for {} on {}://{}/'.format(self.__class__.__name__, self.username, self.scheme, self.host)
@@ -70,12 +77,92 @@ class HNAPSession:
         return self.private_key and self.cookie_id and self.encoded_password and not self.is_expired()
 
 
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Stops sending requests to a device that keeps failing to respond. After failure_threshold consecutive
+    # failures the circuit opens and every command fails fast until the backoff passes; then one trial
+    # command is let through (half open) which either closes the circuit or opens it again for twice as long.
+    closed = 'closed'
+    open = 'open'
+    half_open = 'half_open'
+
+    def __init__(self, failure_threshold: int = 3, base_backoff_secs: float = 5.0, max_backoff_secs: float = 300.0,
+                 jitter: float = 0.2, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.base_backoff_secs = base_backoff_secs
+        self.max_backoff_secs = max_backoff_secs
+        self.jitter = jitter
+        self.clock = clock
+        self.state = self.closed
+        self.consecutive_failures = 0
+        self.consecutive_opens = 0
+        self.retry_at = None
+        self.trial_in_progress = False
+        self.failures_total = 0
+        self.opened_total = 0
+        self.rejected_total = 0
+
+    def __str__(self):
+        return '{}(state={}, failures={})'.format(self.__class__.__name__, self.state, self.consecutive_failures)
+
+    def before_call(self):
+        if self.state == self.open:
+            if self.clock() < self.retry_at:
+                self.rejected_total += 1
+                raise CircuitOpenError('Circuit open for {:.1f}s more'.format(self.retry_at - self.clock()))
+            self.state = self.half_open
+            self.trial_in_progress = False
+        if self.state == self.half_open:
+            if self.trial_in_progress:
+                self.rejected_total += 1
+                raise CircuitOpenError('Circuit half open; waiting on the trial command')
+            self.trial_in_progress = True
+
+    def record_success(self):
+        if self.state != self.closed:
+            logger.info('Closing {}'.format(self))
+        self.state = self.closed
+        self.consecutive_failures = 0
+        self.consecutive_opens = 0
+        self.trial_in_progress = False
+
+    def record_inconclusive(self):
+        # Neither a success nor a failure; a half open circuit lets the next command be its trial instead
+        self.trial_in_progress = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.failures_total += 1
+        self.trial_in_progress = False
+        if self.state == self.half_open or self.consecutive_failures >= self.failure_threshold:
+            self.consecutive_opens += 1
+            self.opened_total += 1
+            backoff_secs = min(self.max_backoff_secs, self.base_backoff_secs * 2 ** (self.consecutive_opens - 1))
+            backoff_secs *= random.uniform(1 - self.jitter, 1 + self.jitter)
+            self.retry_at = self.clock() + backoff_secs
+            self.state = self.open
+            logger.warning('Opened {} for {:.1f}s'.format(self, backoff_secs))
+
+    def get_metrics(self) -> dict:
+        retry_in_secs = max(self.retry_at - self.clock(), 0.0) if self.state == self.open else 0.0
+        return {'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'retry_in_secs': round(retry_in_secs, 1),
+                'failures_total': self.failures_total,
+                'opened_total': self.opened_total,
+                'rejected_total': self.rejected_total}
+
+
 class HNAPCommand:
-    def __init__(self, operation, payload_default='', read_only=True, method='POST'):
+    def __init__(self, operation, payload_default='', read_only=True, method='POST', capturable=True):
         self.operation = operation
         self.payload_default = payload_default
         self.read_only = read_only
         self.method = method
+        self.capturable = capturable and read_only
 
     def __str__(self):
         return '{} ({} operation={})'.format(self.__class__.__name__, self.method, self.operation)
@@ -83,6 +170,9 @@ class HNAPCommand:
     def build_payload_data(self, **kwargs) -> str:
         return self.payload_default
 
+    def capture_key(self) -> str:
+        return self.operation
+
     def execute(self, session: HNAPSession, **kwargs) -> dict:
         url = '{}://{}/HNAP1/'.format(session.scheme, session.host)
         auth = session.authenticate_operation(self.operation)
@@ -94,6 +184,11 @@ class HNAPCommand:
         resp = session.do_request(self.method, url, headers=headers, cookies=cookies, json=body, verify=False,
                                   timeout=(3.0, 10.0))
         logger.debug("<<<< {}: url={}, code={}, body={}".format(self, url, resp.status_code, resp.text))
+        if session.capture and self.capturable:
+            try:
+                session.capture.capture(self.capture_key(), resp.status_code, resp.text)
+            except Exception as e:
+                logger.warning('Capturing {} FAILED ({}) in {}'.format(self, e, session.capture))
         return self.validate_response(resp)
 
     def validate_response(self, response: Response) -> dict:
@@ -121,7 +216,7 @@ class HNAPCommand:
 
 class LoginRequest(HNAPCommand):
     def __init__(self):
-        super().__init__('Login')
+        super().__init__('Login', capturable=False)
 
     def build_payload_data(self, **kwargs) -> dict:
         return {'Action': 'request',
@@ -142,7 +237,7 @@ class Login(LoginRequest):
 
 class Logout(HNAPCommand):
     def __init__(self):
-        super().__init__('Logout')
+        super().__init__('Logout', capturable=False)
 
     def build_payload_data(self, **kwargs) -> dict:
         return {'Action': 'logout',
@@ -155,6 +250,9 @@ class GetMultipleCommands(HNAPCommand):
         super().__init__('GetMultipleHNAPs')
         self.commands = commands
 
+    def capture_key(self) -> str:
+        return '{}.{}'.format(self.operation, '+'.join(c.operation for c in self.commands))
+
     def build_payload_data(self, **kwargs) -> dict:
         payload_data = {}
         for command in self.commands:
@@ -175,6 +273,14 @@ class HNAPDevice:
         self.model = None
         self.serial_number = None
         self.mac_address = None
+        self.breaker = CircuitBreaker()
+        # Most pings only check that the web server answers; every hnap_ping_every-th ping (or any ping after a
+        # failure) makes a full HNAP call
+        self.hnap_ping_every = 10
+        self.pings_since_hnap = 0
+        self.ping_doubted = True
+        self.ping_rtts = dict()
+        self.capture = None
 
     def __str__(self):
         return '{}(id={}, model={}, serial_number={}, mac_address={})'.format(self.__class__.__name__,
@@ -185,6 +291,7 @@ class HNAPDevice:
     def login(self, scheme, host, username, password) -> HNAPSession:
         logger.debug('Attempting login for {} on {}://{}'.format(username, scheme, host))
         self.session = HNAPSession(host, scheme, username, password)
+        self.session.capture = self.capture
 
         # Ask server to encode credentials
         command = LoginRequest()
@@ -202,6 +309,12 @@ class HNAPDevice:
         logger.info('Completed login; {}'.format(self.session))
         return self.session
 
+    def enable_capture(self, path: Path = None):
+        # Keep the raw response to every read-only command (see capture and replay)
+        self.capture = ResponseCapture(path or build_capture_path(self.device_id))
+        if self.session:
+            self.session.capture = self.capture
+
     def logout(self) -> dict:
         if not self.session:
             return {}
@@ -229,13 +342,74 @@ class HNAPDevice:
     def reboot(self):
         raise NotImplementedError
 
-    def ping(self):
-        self.do_command(HNAPCommand('GetHomeConnection'))
+    def ping(self) -> str:
+        # Liveness check in tiers, cheapest first: a TCP connect, then an unauthenticated GET on the pooled
+        # connection, escalating to a signed HNAP call periodically, when in doubt (the last ping failed or the
+        # circuit isn't closed) or when the GET fails. Returns the tier that confirmed the device is alive.
+        escalate = self.ping_doubted or self.breaker.state != CircuitBreaker.closed or \
+            self.pings_since_hnap + 1 >= self.hnap_ping_every
+        try:
+            if not escalate:
+                self.timed_ping('tcp', self.ping_tcp)
+                try:
+                    self.timed_ping('http', self.ping_http)
+                    self.pings_since_hnap += 1
+                    return 'http'
+                except requests.RequestException as e:
+                    logger.info('HTTP ping FAILED ({}) for {}; escalating to HNAP'.format(e, self))
+            self.timed_ping('hnap', lambda: self.do_command(HNAPCommand('GetHomeConnection', capturable=False)))
+        except Exception:
+            self.ping_doubted = True
+            raise
+        self.pings_since_hnap = 0
+        self.ping_doubted = False
+        return 'hnap'
+
+    def timed_ping(self, tier: str, ping_func):
+        started_at = time.monotonic()
+        ping_func()
+        self.ping_rtts[tier] = {'rtt_ms': round((time.monotonic() - started_at) * 1000, 1),
+                                'at': datetime.now().isoformat()}
+
+    def ping_tcp(self):
+        host, _, port = self.session.host.partition(':')
+        port = int(port) if port else (443 if self.session.scheme == 'https' else 80)
+        try:
+            with socket.create_connection((host, port), timeout=3.0):
+                pass
+        except OSError:
+            # Nothing is listening, so HNAP calls would fail too
+            self.breaker.record_failure()
+            raise
+
+    def ping_http(self):
+        # Any answer means the web server is up; this bypasses do_request so it doesn't keep the HNAP session alive
+        url = '{}://{}/'.format(self.session.scheme, self.session.host)
+        self.session.http_session.request('HEAD', url, verify=False, timeout=(3.0, 5.0), allow_redirects=False)
 
     def do_command(self, command: HNAPCommand, **kwargs) -> dict:
-        if not self.is_session_valid():
-            self.refresh_session()
-        return command.execute(self.session, **kwargs)
+        self.breaker.before_call()
+        try:
+            if not self.is_session_valid():
+                self.refresh_session()
+            response = command.execute(self.session, **kwargs)
+        except requests.RequestException:
+            # Only an unreachable (or unresponsive) device counts against the breaker
+            self.breaker.record_failure()
+            raise
+        except ValueError:
+            # A device that answers with an error (see HNAPCommand.validate_response) is alive
+            self.breaker.record_success()
+            raise
+        except Exception:
+            # Anything else (e.g. a response we couldn't make sense of) says nothing about the device either way
+            self.breaker.record_inconclusive()
+            raise
+        self.breaker.record_success()
+        return response
+
+    def get_metrics(self) -> dict:
+        return {'circuit_breaker': self.breaker.get_metrics(), 'ping_rtts': self.ping_rtts}
 
     def is_session_valid(self) -> bool:
         if not self.session:
@@ -256,5 +430,9 @@ class HNAPDevice:
     def to_timestamp(self, date: str, time: str) -> datetime:
         return datetime.strptime('{} {}'.format(date, time), '%Y-%m-%d %H:%M:%S')
 
+    def parse_timestamp(self, date: str, time: str) -> float:
+        # Seconds since the epoch (see timestamps)
+        return to_epoch(self.to_timestamp(date, time))
+
     def to_event_priority(self, level: int) -> str:
         return str(level)
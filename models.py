@@ -1,4 +1,8 @@
+import re
 from datetime import datetime
+from typing import List, Tuple, Union
+
+from timestamps import to_epoch, to_iso
 
 
 class DeviceInfo(object):
@@ -107,17 +111,58 @@ class UpstreamChannelStats(ChannelStats):
         self.symb_rate = symb_rate
 
 
+# Variable parts of event descriptions (e.g. the CM-MAC=...;CMTS-MAC=... suffix of DOCSIS events and the local IP of
+# client events). Replacing them with placeholders leaves a template that identifies the type of event.
+variable_pattern = re.compile(r'(?P<MAC>\b[0-9A-Fa-f]{2}(?::[0-9A-Fa-f]{2}){5}\b)|(?P<IP>\b\d{1,3}(?:\.\d{1,3}){3}\b)')
+placeholder_pattern = re.compile(r'<(?:MAC|IP)>')
+
+
+def to_template(desc: str) -> Tuple[str, List[str]]:
+    # (template, args) such that render_template(template, args) == desc
+    if placeholder_pattern.search(desc):
+        # Can't tell a literal placeholder from an argument, so the description is its own template
+        return desc, []
+    args = [m.group() for m in variable_pattern.finditer(desc)]
+    return variable_pattern.sub(lambda m: '<{}>'.format(m.lastgroup), desc), args
+
+
+def render_template(template: str, args: List[str]) -> str:
+    if not args:
+        return template
+    args = iter(args)
+    return placeholder_pattern.sub(lambda _: next(args), template)
+
+
 class EventLogEntry(object):
-    def __init__(self, timestamp: datetime, priority, desc):
-        self.timestamp = timestamp.isoformat()
+    def __init__(self, timestamp: Union[datetime, float], priority, desc):
+        # The timestamp is kept as an epoch (see timestamps) and only rendered as ISO text when written out
+        self.epoch = to_epoch(timestamp) if isinstance(timestamp, datetime) else timestamp
         self.priority = priority
         self.desc = desc
 
+    @property
+    def timestamp(self) -> str:
+        return to_iso(self.epoch)
+
+    @property
+    def template(self) -> str:
+        # The type of event, e.g. 'No Ranging Response received - T3 time-out;CM-MAC=<MAC>;CMTS-MAC=<MAC>;...'
+        return to_template(self.desc or '')[0]
+
+    def to_json(self) -> dict:
+        return {'timestamp': self.timestamp, 'priority': self.priority, 'desc': self.desc}
+
     def __eq__(self, other):
-        return self.timestamp == other.timestamp
+        return self.epoch == other.epoch
 
     def __hash__(self):
-        return hash((self.timestamp, self.priority, self.desc))
+        return hash((self.epoch, self.priority, self.desc))
 
     def __repr__(self):
-        return '{}({})'.format(self.__class__.__name__, self.__dict__)
+        return '{}({})'.format(self.__class__.__name__, self.to_json())
+
+
+def to_json(o) -> dict:
+    # json.dump default for model objects; objects that aren't written out as their attributes say how
+    to_json_method = getattr(o, 'to_json', None)
+    return to_json_method() if to_json_method else o.__dict__
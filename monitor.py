@@ -8,10 +8,13 @@ from time import sleep
 import schedule
 
 import log_config
-from common import get_local_ip, build_unique_stats_path
+from anomaly import AnomalyDetector, build_state_path, count_anomalous_channels
+from common import get_local_ip, append_stats, build_metrics_path
 from devices import create_device
-from hnap import HNAPDevice
-from models import EventLogEntry
+from etl.history import atomic_write
+from hnap import HNAPDevice, CircuitOpenError
+from models import EventLogEntry, to_json
+from reboot_planner import fleet_slot, get_reboot_times, read_plan, record_recovery
 
 log_config.configure('monitor.log')
 logger = logging.getLogger('monitor')
@@ -34,12 +37,16 @@ class JobRunSummary:
 
 
 class DeviceMonitor:
-    def __init__(self, scheduler: schedule.Scheduler, check_interval: timedelta = None, device: HNAPDevice = None):
+    def __init__(self, scheduler: schedule.Scheduler, check_interval: timedelta = None, device: HNAPDevice = None,
+                 anomaly_detector: AnomalyDetector = None, anomaly_reboot_channels: int = None):
         self.scheduler = scheduler
         self.interval = int(check_interval.total_seconds()) if check_interval else 30
         self.device = device
         self.all_jobs_history = list()
         self.check_job = None
+        self.anomaly_detector = anomaly_detector
+        # Reboot when this many channels are anomalous in one sample (None to never reboot for anomalies)
+        self.anomaly_reboot_channels = anomaly_reboot_channels
 
     def __str__(self):
         if self.check_job:
@@ -70,18 +77,27 @@ def log_client_event(device: HNAPDevice, level: int, desc: str):
     ts = datetime.now()
     event = EventLogEntry(timestamp=ts, priority=device.to_event_priority(level),
                           desc='(Client {}): {}'.format(get_local_ip(), desc))
-    event_json = json.loads(json.dumps(event, default=lambda o: o.__dict__))
+    event_json = json.loads(json.dumps(event, default=to_json))
 
-    # Make this look like the other event files
-    timestamped_json_result = {'timestamp': ts.isoformat(), 'result': [event_json]}
-    stats_file = build_unique_stats_path(device, 'events')
-    with stats_file.open(mode='w') as file:
-        file.write(json.dumps(timestamped_json_result, default=lambda o: o.__dict__))
+    # Make this look like the other event results
+    append_stats(device, 'events', {'timestamp': ts.isoformat(), 'result': [event_json]})
 
 
-def setup(device_id: str, device_attrs: dict, action_ids: list, note: str) -> HNAPDevice:
-    device = create_device(device_id)
-    device.login(device_attrs['scheme'], device_attrs['host'], device_attrs['username'], device_attrs['password'])
+def write_metrics(device: HNAPDevice):
+    # Overwritten on every check, so it always holds the device's current state (e.g. for a dashboard to scrape)
+    metrics = {'timestamp': datetime.now().isoformat(), 'device_id': device.device_id}
+    metrics.update(device.get_metrics())
+    with atomic_write(build_metrics_path(device)) as file:
+        file.write(json.dumps(metrics, sort_keys=True))
+
+
+def setup(device_id: str, device_attrs: dict, action_ids: list, note: str, capture: bool = False) -> HNAPDevice:
+    device = create_device(device_id, device_attrs.get('device_type', None))
+    if capture:
+        device.enable_capture()
+    with fleet_slot('login', read_plan()['max_concurrent_logins']):
+        device.login(device_attrs['scheme'], device_attrs['host'], device_attrs['username'],
+                     device_attrs['password'])
 
     # Create directories to hold JSON results and add any specified note to the README file
     for action_id in action_ids:
@@ -100,9 +116,29 @@ def setup(device_id: str, device_attrs: dict, action_ids: list, note: str) -> HN
     return device
 
 
+def detect_anomalies(device_monitor: DeviceMonitor, details) -> bool:
+    # Returns whether the anomalies found warrant a reboot
+    device = device_monitor.device
+    anomalies = device_monitor.anomaly_detector.update(details)
+    device_monitor.anomaly_detector.save(build_state_path(device.device_id))
+    for anomaly in anomalies:
+        logger.info('{} for {}'.format(anomaly, device))
+        log_client_event(device, logging.WARNING, anomaly.to_desc())
+
+    channels = count_anomalous_channels(anomalies)
+    recommended = device_monitor.anomaly_reboot_channels is not None and \
+        channels >= device_monitor.anomaly_reboot_channels
+    if recommended:
+        msg = 'Reboot is recommended since {} channels are anomalous'.format(channels)
+        logger.info(msg)
+        log_client_event(device, logging.INFO, msg)
+    return recommended
+
+
 def get_stats(stat_ids: list, device_monitor: DeviceMonitor) -> None:
     job_run_summary = JobRunSummary('get_stats')
     device = device_monitor.device
+    reboot_recommended = False
     try:
         for stat_id in stat_ids:
             stat_name = actions.get(stat_id, None)
@@ -116,12 +152,14 @@ def get_stats(stat_ids: list, device_monitor: DeviceMonitor) -> None:
                 continue
 
             try:
-                stats_file = build_unique_stats_path(device, stat_id)
                 json_result = stat_func()
-                timestamped_json_result = {'timestamp': datetime.now().isoformat(), 'result': json_result}
-                with stats_file.open(mode='w') as file:
-                    file.write(json.dumps(timestamped_json_result, default=lambda o: o.__dict__))
-                logger.debug('Get {} stats complete for {}; results in {}'.format(stat_id, device, stats_file))
+                offset = append_stats(device, stat_id, {'timestamp': datetime.now().isoformat(), 'result': json_result})
+                logger.debug('Get {} stats complete for {}; appended at offset {}'.format(stat_id, device, offset))
+                if stat_id == 'details' and device_monitor.anomaly_detector:
+                    reboot_recommended = detect_anomalies(device_monitor, json_result)
+            except CircuitOpenError as e:
+                logger.info('Get {} stats skipped ({}) for {}'.format(stat_id, e, device))
+                raise e
             except Exception as e:
                 msg = 'Get {} stats FAILED ({}) for {}'.format(stat_id, e, device)
                 logger.warning(msg)
@@ -136,6 +174,9 @@ def get_stats(stat_ids: list, device_monitor: DeviceMonitor) -> None:
         job_run_summary.completed_at = datetime.now()
         device_monitor.all_jobs_history.append(job_run_summary)
 
+    if reboot_recommended:
+        reboot(device_monitor)
+
 
 def reboot(device_monitor: DeviceMonitor):
     job_run_summary = JobRunSummary('reboot')
@@ -143,11 +184,17 @@ def reboot(device_monitor: DeviceMonitor):
     job_run_history = device_monitor.all_jobs_history
     try:
         logger.info('reboot; job history={}'.format([(e.name, e.succeeded) for e in job_run_history]))
-        log_client_event(device, logging.CRITICAL, 'Rebooting {}'.format(device))
-        device.reboot()
-        # Pause monitoring while the device reboots
-        logger.info('Waiting 60 seconds for {}'.format(device))
-        sleep(60)
+        plan = read_plan()
+        # Only a few devices in the fleet may be down (or logging back in) at once
+        with fleet_slot('reboot', plan['max_concurrent_reboots']):
+            log_client_event(device, logging.CRITICAL, 'Rebooting {}'.format(device))
+            rebooted_at = datetime.now()
+            device.reboot()
+            # Pause monitoring while the device reboots
+            logger.info('Waiting 60 seconds for {}'.format(device))
+            sleep(60)
+            relogin(device, plan['max_concurrent_logins'])
+            record_recovery(device.device_id, rebooted_at, datetime.now())
     except Exception as e:
         job_run_summary.succeeded = False
         logger.error('reboot FAILED ({}) for {}'.format(e, device))
@@ -158,12 +205,30 @@ def reboot(device_monitor: DeviceMonitor):
     logger.info('reboot complete for {}'.format(device))
 
 
+def relogin(device: HNAPDevice, max_concurrent_logins: int, attempts: int = 30, pause_secs: int = 10):
+    for attempt in range(1, attempts + 1):
+        try:
+            with fleet_slot('login', max_concurrent_logins):
+                device.refresh_session()
+            return
+        except Exception as e:
+            if attempt == attempts:
+                raise e
+            logger.info('login attempt {} FAILED...retry in {} seconds; {}'.format(attempt, pause_secs, e))
+            sleep(pause_secs)
+
+
 def ping(device_monitor: DeviceMonitor):
     job_run_summary = JobRunSummary('ping')
     device = device_monitor.device
     job_run_history = device_monitor.all_jobs_history
     try:
-        device.ping()
+        tier = device.ping()
+        logger.debug('ping ({}) succeeded for {}'.format(tier, device))
+    except CircuitOpenError as e:
+        # The device already failed enough to open the circuit; don't hammer it (or the event log) again
+        logger.debug('ping skipped ({}) for {}'.format(e, device))
+        job_run_summary.succeeded = False
     except Exception as e:
         msg = 'ping FAILED ({}) for {}'.format(e, device)
         logger.warning(msg)
@@ -173,6 +238,7 @@ def ping(device_monitor: DeviceMonitor):
     finally:
         job_run_summary.completed_at = datetime.now()
         job_run_history.append(job_run_summary)
+        write_metrics(device)
     logger.debug('ping complete for {}'.format(device))
 
     if job_run_summary.succeeded and is_reboot_recommended(device, job_run_history):
@@ -218,12 +284,18 @@ def main():
 
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('--note', required=False, help='Add this note to the stats README file')
-    parser.add_argument('--reboot_times', default=['04:00'], nargs='*',
-                        help='Times of day that an automatic reboot should occur')
+    parser.add_argument('--reboot_times', nargs='*',
+                        help='Times of day that an automatic reboot should occur (defaults to the reboot plan)')
     parser.add_argument('--check_interval', type=int, choices=range(30, 61), metavar='[30-60]', default=30,
                         help='Check every S seconds')
     parser.add_argument('--stats_interval', type=int, choices=range(1, 6), metavar='[1-5]', default=5,
                         help='Get stats every M minutes')
+    parser.add_argument('--capture', action='store_true', help='Keep raw responses for replay.py')
+    parser.add_argument('--anomaly_threshold', type=float, default=4.0,
+                        help='Log an event for channel values this many standard deviations off their moving '
+                             'average (0 to not detect anomalies)')
+    parser.add_argument('--anomaly_reboot_channels', type=int,
+                        help='Reboot when this many channels are anomalous at once')
     parser.add_argument('device_id', choices=supported_devices.keys())
     args = parser.parse_args()
 
@@ -236,7 +308,7 @@ def main():
     device = None
     for r in range(1, 7):
         try:
-            device = setup(args.device_id, device_attrs, stat_ids, args.note)
+            device = setup(args.device_id, device_attrs, stat_ids, args.note, args.capture)
             setup_failure = None
             break
         except Exception as setup_failure:
@@ -246,14 +318,19 @@ def main():
         raise setup_failure
 
     scheduler = schedule.Scheduler()
-    device_monitor = DeviceMonitor(scheduler, timedelta(seconds=args.check_interval), device)
+    anomaly_detector = None
+    if args.anomaly_threshold and 'details' in stat_ids:
+        # Picks up the moving averages from the last run, so a restart doesn't need another warmup
+        anomaly_detector = AnomalyDetector(threshold=args.anomaly_threshold).load(build_state_path(args.device_id))
+    device_monitor = DeviceMonitor(scheduler, timedelta(seconds=args.check_interval), device, anomaly_detector,
+                                   args.anomaly_reboot_channels)
     stats_job = scheduler.every(args.stats_interval).minutes.at(':00').do(get_stats, stat_ids=stat_ids,
                                                                           device_monitor=device_monitor)
     logger.info('Stats schedule (next at {}): {}'.format(stats_job.next_run, stats_job))
 
     # Reboot the device N times daily
     reboot_scheduler = schedule.Scheduler()
-    for reboot_time in args.reboot_times:
+    for reboot_time in args.reboot_times or get_reboot_times(args.device_id):
         job = reboot_scheduler.every().day.at(reboot_time).do(reboot, device_monitor=device_monitor)
         logger.info('Reboot schedule (next at {}): {}'.format(job.next_run, job))
 
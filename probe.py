@@ -0,0 +1,173 @@
+import argparse
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+from requests import RequestException
+
+import log_config
+from devices import create_device
+from etl.history import atomic_write
+from hnap import CircuitOpenError, HNAPCommand, HNAPDevice, GetMultipleCommands
+
+log_config.configure('probe.log')
+logger = logging.getLogger('probe')
+
+# Operations each firmware version is known to support (or reject), by device type and firmware version
+capabilities_file = Path('devices', 'capabilities.json')
+capabilities_lock = threading.Lock()
+
+
+def read_capabilities() -> dict:
+    if not capabilities_file.exists():
+        return dict()
+    with capabilities_file.open() as json_file:
+        return json.load(json_file)
+
+
+def write_capabilities(capabilities: dict):
+    with atomic_write(capabilities_file) as json_file:
+        json.dump(capabilities, fp=json_file, indent=2, sort_keys=True)
+
+
+def get_firmware_version(device: HNAPDevice) -> str:
+    try:
+        return device.get_device_info().firmware_version or 'unknown'
+    except NotImplementedError:
+        return 'unknown'
+
+
+def execute_timed(device: HNAPDevice, command: HNAPCommand) -> float:
+    # Milliseconds taken by the command; raises whatever the command raises
+    started_at = time.monotonic()
+    device.do_command(command)
+    return round((time.monotonic() - started_at) * 1000, 1)
+
+
+def probe_commands(device: HNAPDevice, commands: List[HNAPCommand], batches: List[dict] = None) -> Dict[str, dict]:
+    # Try the commands as one batch. If the firmware rejects the batch, split it in half and try each half,
+    # down to single commands, so the rejected operations are isolated in log2(batch size) extra requests.
+    # The time taken by each accepted batch is added to batches; a single command's is its own latency.
+    try:
+        if len(commands) == 1:
+            batch_latency_ms = execute_timed(device, commands[0])
+        else:
+            batch_latency_ms = execute_timed(device, GetMultipleCommands(commands))
+        if batches is not None:
+            batches.append({'operations': [c.operation for c in commands], 'batch_latency_ms': batch_latency_ms})
+        if len(commands) == 1:
+            return {commands[0].operation: {'supported': True, 'batch_size': 1, 'latency_ms': batch_latency_ms}}
+        return {c.operation: {'supported': True, 'batch_size': len(commands)} for c in commands}
+    except (RequestException, CircuitOpenError):
+        # The device didn't answer (or isn't being called); that says nothing about what the firmware supports
+        raise
+    except ValueError as e:
+        # The device answered with an error result (see HNAPCommand.validate_response)
+        if len(commands) == 1:
+            logger.info('{} rejected {}: {}'.format(device, commands[0].operation, e))
+            return {commands[0].operation: {'supported': False, 'error': str(e)}}
+
+    middle = len(commands) // 2
+    results = probe_commands(device, commands[:middle], batches)
+    results.update(probe_commands(device, commands[middle:], batches))
+    return results
+
+
+def time_commands(device: HNAPDevice, commands: List[HNAPCommand], results: Dict[str, dict]):
+    # Time each supported command on its own (unless it was already probed on its own), so a slow operation
+    # isn't hidden in the round trip of its batch
+    for command in commands:
+        result = results.get(command.operation, None)
+        if not result or not result['supported'] or 'latency_ms' in result:
+            continue
+        try:
+            result['latency_ms'] = execute_timed(device, command)
+        except ValueError as e:
+            # Accepted in a batch but not on its own; it is still supported
+            logger.warning('{} rejected {} on its own: {}'.format(device, command.operation, e))
+
+
+def probe_device(device_id: str, device_attrs: dict, capabilities: dict, batch_size: int,
+                 recheck: bool = False) -> dict:
+    device = create_device(device_id, device_attrs.get('device_type', None))
+    device.login(device_attrs['scheme'], device_attrs['host'], device_attrs['username'], device_attrs['password'])
+    try:
+        device_type = device_attrs.get('device_type', None) or device_id
+        firmware_version = get_firmware_version(device)
+        with capabilities_lock:
+            known = dict(capabilities.get(device_type, dict()).get(firmware_version, dict()))
+
+        # Only read-only commands are probed; operations this firmware is known to reject are skipped
+        commands = [c for c in device.get_commands() if c.read_only]
+        skipped = [c.operation for c in commands
+                   if not recheck and known.get(c.operation, dict()).get('supported', None) is False]
+        commands = [c for c in commands if c.operation not in skipped]
+
+        # Raises if the device stops answering, so nothing is recorded from a partial probe
+        results = dict()
+        batches = list()
+        for i in range(0, len(commands), batch_size):
+            results.update(probe_commands(device, commands[i:i + batch_size], batches))
+        time_commands(device, commands, results)
+    finally:
+        device.logout()
+
+    checked_at = datetime.now().isoformat()
+    if firmware_version != 'unknown':
+        with capabilities_lock:
+            versions = capabilities.setdefault(device_type, dict())
+            known = versions.setdefault(firmware_version, dict())
+            for operation, result in results.items():
+                known[operation] = {'supported': result['supported'], 'checked_at': checked_at}
+
+    return {'device_id': device_id,
+            'device_type': device_type,
+            'firmware_version': firmware_version,
+            'supported': sorted(o for (o, r) in results.items() if r['supported']),
+            'unsupported': {o: r['error'] for (o, r) in results.items() if not r['supported']},
+            'skipped': skipped,
+            'latency_ms': {o: r['latency_ms'] for (o, r) in results.items() if 'latency_ms' in r},
+            'batches': batches}
+
+
+def main():
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--batch_size', type=int, default=8, help='Commands per GetMultipleHNAPs request')
+    parser.add_argument('--workers', type=int, default=8, help='Devices to probe at once')
+    parser.add_argument('--recheck', action='store_true', help='Probe operations already known to be unsupported')
+    parser.add_argument('device_ids', nargs='*', help='Devices to probe (defaults to every device)')
+    args = parser.parse_args()
+
+    unknown_device_ids = [d for d in args.device_ids if d not in supported_devices]
+    if unknown_device_ids:
+        parser.error('unknown device_ids: {}'.format(', '.join(unknown_device_ids)))
+
+    device_ids = args.device_ids or list(supported_devices.keys())
+    capabilities = read_capabilities()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(probe_device, device_id, supported_devices[device_id], capabilities,
+                                   args.batch_size, args.recheck): device_id for device_id in device_ids}
+        for future in as_completed(futures):
+            try:
+                print(json.dumps(future.result(), sort_keys=True), flush=True)
+            except Exception as e:
+                failed += 1
+                logger.error('Probing {} FAILED ({})'.format(futures[future], e))
+                print(json.dumps({'device_id': futures[future], 'error': str(e)}), flush=True)
+
+    write_capabilities(capabilities)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
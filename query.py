@@ -0,0 +1,52 @@
+import argparse
+import json
+import logging
+
+import log_config
+from etl.catalog import EventCatalog
+from etl.history import query_events, query_channel, query_history, build_history_path
+
+log_config.configure('query.log')
+logger = logging.getLogger('query')
+
+
+def main():
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('device_id', choices=supported_devices.keys())
+    parser.add_argument('history', choices=['events', 'event_types', 'summary', 'details', 'downstream', 'upstream'])
+    parser.add_argument('--start', help='Include entries at or after this ISO timestamp (e.g. 2022-09-01T12:00)')
+    parser.add_argument('--end', help='Include entries before this ISO timestamp')
+    parser.add_argument('--max_priority', type=int, help='Events with this priority level or more severe')
+    parser.add_argument('--event_type', help='Events whose description (template) contains this text')
+    parser.add_argument('--channel', type=int, help='Channel id for downstream/upstream histories')
+    parser.add_argument('--fields', nargs='*', help='Channel fields to include (e.g. power_dbmv snr)')
+    parser.add_argument('--resolution', choices=['1m', '1h', '1d'], help='Query channel rollups instead of samples')
+    args = parser.parse_args()
+
+    catalog = EventCatalog(build_history_path(args.device_id, 'events').parent).load()
+    template_ids = catalog.find(args.event_type) if args.event_type else None
+    if args.history == 'events':
+        results = [catalog.decode(e) for e in query_events(args.device_id, args.start, args.end, args.max_priority,
+                                                           template_ids)]
+    elif args.history == 'event_types':
+        # Counted as events are stored, so this doesn't read the history (--start/--end don't apply)
+        results = [dict(e, id=i) for (i, e) in enumerate(catalog.entries) if template_ids is None or i in template_ids]
+    elif args.history in ['downstream', 'upstream']:
+        if args.channel is None:
+            parser.error('--channel is required for {} histories'.format(args.history))
+        results = query_channel(args.device_id, args.history, args.channel, args.start, args.end, args.fields,
+                                args.resolution)
+    else:
+        results = query_history(build_history_path(args.device_id, args.history), args.start, args.end)
+
+    logger.info('Found {} {} entries for {} between {} and {}'.format(len(results), args.history, args.device_id,
+                                                                     args.start, args.end))
+    for result in results:
+        print(json.dumps(result, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import fcntl
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from statistics import median
+from typing import Dict, List
+
+import log_config
+from etl.history import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Daily reboot times for the fleet, spread over a window so only max_concurrent_reboots devices are down at once
+plan_file = Path('devices', 'reboot_plan.json')
+# Lock files backing the fleet-wide slots (see fleet_slot)
+locks_path = Path('devices', '.locks')
+
+default_plan = {'window_start': '04:00', 'window_minutes': 0, 'max_concurrent_reboots': 1,
+                'max_concurrent_logins': 2, 'devices': dict()}
+default_recovery_secs = 180
+max_recoveries = 30
+
+
+def read_plan() -> dict:
+    if not plan_file.exists():
+        return dict(default_plan)
+    with plan_file.open() as json_file:
+        return json.load(json_file)
+
+
+def write_plan(plan: dict):
+    with atomic_write(plan_file) as json_file:
+        json.dump(plan, fp=json_file, indent=2, sort_keys=True)
+
+
+def build_recoveries_path(device_id: str) -> Path:
+    return Path('devices', device_id, 'reboots.json')
+
+
+def read_recoveries(device_id: str) -> List[dict]:
+    recoveries_file = build_recoveries_path(device_id)
+    if not recoveries_file.exists():
+        return list()
+    with recoveries_file.open() as json_file:
+        return json.load(json_file)
+
+
+def record_recovery(device_id: str, rebooted_at: datetime, recovered_at: datetime):
+    # Keep the most recent recoveries; they predict how long the next reboot will take
+    recoveries = read_recoveries(device_id)
+    recoveries.append({'rebooted_at': rebooted_at.isoformat(), 'recovered_at': recovered_at.isoformat(),
+                       'recovery_secs': round((recovered_at - rebooted_at).total_seconds(), 1)})
+    recoveries_file = build_recoveries_path(device_id)
+    recoveries_file.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(recoveries_file) as json_file:
+        json.dump(recoveries[-max_recoveries:], fp=json_file, indent=2)
+
+
+def predict_recovery_secs(device_id: str) -> float:
+    recoveries = read_recoveries(device_id)
+    return median(r['recovery_secs'] for r in recoveries) if recoveries else default_recovery_secs
+
+
+def plan_reboots(device_ids: List[str], window_start: str, window_minutes: int, max_concurrent: int,
+                 recovery_secs: Dict[str, float]) -> Dict[str, dict]:
+    # Devices reboot in waves of max_concurrent. Waves are spread evenly over the window, but a wave never starts
+    # before the previous one is predicted to have recovered (which may push the last waves past the window).
+    start = datetime.strptime(window_start, '%H:%M')
+    waves = [device_ids[i:i + max_concurrent] for i in range(0, len(device_ids), max_concurrent)]
+    spacing_secs = window_minutes * 60 / len(waves) if waves else 0
+
+    planned = dict()
+    reboot_at = start
+    for wave in waves:
+        wave_recovery_secs = max(recovery_secs[d] for d in wave)
+        for device_id in wave:
+            planned[device_id] = {'reboot_at': reboot_at.strftime('%H:%M:%S'),
+                                  'predicted_up_at': (reboot_at + timedelta(seconds=recovery_secs[device_id]))
+                                  .strftime('%H:%M:%S')}
+        # Whole seconds keep the times schedulable
+        reboot_at += timedelta(seconds=int(max(spacing_secs, wave_recovery_secs) + 0.999))
+
+    if waves and reboot_at > start + timedelta(minutes=window_minutes):
+        logger.warning('Reboot plan for {} devices overruns the {} minute window starting at {}'.format(
+            len(device_ids), window_minutes, window_start))
+    return planned
+
+
+def get_reboot_times(device_id: str) -> List[str]:
+    planned = read_plan()['devices'].get(device_id, None)
+    return [planned['reboot_at']] if planned else [default_plan['window_start']]
+
+
+@contextmanager
+def fleet_slot(name: str, max_concurrent: int, max_jitter_secs: float = 5.0, poll_secs: float = 2.0):
+    # A counting semaphore shared by every monitor process on this host: a slot is one of max_concurrent lock
+    # files, held with flock (so a crashed holder releases it). Waiters start and retry at jittered times so they
+    # don't all pounce on a freed slot together.
+    locks_path.mkdir(parents=True, exist_ok=True)
+    time.sleep(random.uniform(0, max_jitter_secs))
+    while True:
+        for slot in range(max_concurrent):
+            lock_file = (locks_path / '{}.{}.lock'.format(name, slot)).open(mode='w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            try:
+                yield slot
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+            return
+        time.sleep(random.uniform(0.5, 1.5) * poll_secs)
+
+
+def build_timeline(plan: dict) -> List[dict]:
+    # The planned (predicted) timeline next to what happened on each device's last reboot
+    timeline = list()
+    for (device_id, planned) in sorted(plan['devices'].items(), key=lambda i: (i[1]['reboot_at'], i[0])):
+        entry = {'device_id': device_id}
+        entry.update(planned)
+        recoveries = read_recoveries(device_id)
+        if recoveries:
+            entry.update({'last_rebooted_at': recoveries[-1]['rebooted_at'],
+                          'last_recovered_at': recoveries[-1]['recovered_at'],
+                          'last_recovery_secs': recoveries[-1]['recovery_secs']})
+        timeline.append(entry)
+    return timeline
+
+
+def main():
+    log_config.configure('reboot_planner.log')
+
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--window_start', default=default_plan['window_start'], help='Start of the reboot window')
+    parser.add_argument('--window_minutes', type=int, default=60, help='Length of the reboot window')
+    parser.add_argument('--max_concurrent_reboots', type=int, default=default_plan['max_concurrent_reboots'],
+                        help='Devices that may be rebooting at once')
+    parser.add_argument('--max_concurrent_logins', type=int, default=default_plan['max_concurrent_logins'],
+                        help='Monitors that may be logging in at once')
+    parser.add_argument('--report', action='store_true', help='Only print the timeline of the current plan')
+    parser.add_argument('device_ids', nargs='*', help='Devices to plan (defaults to every device)')
+    args = parser.parse_args()
+
+    if not args.report:
+        unknown_device_ids = [d for d in args.device_ids if d not in supported_devices]
+        if unknown_device_ids:
+            parser.error('unknown device_ids: {}'.format(', '.join(unknown_device_ids)))
+
+        device_ids = args.device_ids or [d for (d, attrs) in supported_devices.items()
+                                         if 'reboot' in attrs['supported_actions']]
+        recovery_secs = {d: predict_recovery_secs(d) for d in device_ids}
+        write_plan({'window_start': args.window_start,
+                    'window_minutes': args.window_minutes,
+                    'max_concurrent_reboots': args.max_concurrent_reboots,
+                    'max_concurrent_logins': args.max_concurrent_logins,
+                    'devices': plan_reboots(device_ids, args.window_start, args.window_minutes,
+                                            args.max_concurrent_reboots, recovery_secs)})
+        logger.info('Planned reboots for {} devices'.format(len(device_ids)))
+
+    for entry in build_timeline(read_plan()):
+        print(json.dumps(entry, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
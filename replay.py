@@ -0,0 +1,149 @@
+import argparse
+import json
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Set, Tuple
+
+import log_config
+from capture import CapturedResponse, ResponseCapture, build_capture_path
+from devices.profile import ProfileDevice, CompiledProfile, compiled_profiles
+from etl.history import atomic_write
+from etl.partitions import build_partition_path, rewind_partition, to_partition
+from hnap import HNAPCommand
+from models import to_json
+
+logger = logging.getLogger('replay')
+
+# Same single word actions as the monitor
+actions = {'summary': 'get_connection_summary',
+           'events': 'get_events',
+           'details': 'get_connection_details'}
+
+
+class ReplayDevice(ProfileDevice):
+    # A device that answers from captured responses instead of the network: each captured response updates the
+    # latest section of its operations, and the profile's parsers run over those sections
+    def __init__(self, device_id: str, profile: CompiledProfile):
+        super().__init__(device_id, profile)
+        self.sections = dict()
+
+    def load(self, captured: CapturedResponse) -> Set[str]:
+        # Operations the response holds sections for (none if the device answered with an error)
+        if not 200 <= captured.status_code < 300:
+            return set()
+        body = json.loads(captured.text)
+        operation, _, multiple = captured.key.partition('.')
+        if not multiple:
+            self.sections[operation] = HNAPCommand(operation).validate_response_body(body)
+            return {operation}
+
+        response = HNAPCommand(operation).validate_response_body(body)
+        operations = multiple.split('+')
+        for operation in operations:
+            self.sections[operation] = HNAPCommand(operation).validate_response_body(response)
+        return set(operations)
+
+    def fetch_sections(self, operations: List[str]) -> Dict[str, dict]:
+        return {o: self.sections[o] for o in operations}
+
+    def get_sections(self, operations: List[str]) -> Dict[str, dict]:
+        return self.fetch_sections(operations)
+
+    def do_command(self, command: HNAPCommand, **kwargs) -> dict:
+        raise ValueError('{} cannot execute {}'.format(self, command))
+
+
+def get_polled_operations(profile: CompiledProfile, action: str) -> Set[str]:
+    # The operations the monitor fetches every time it runs the action; a captured response holding all of them
+    # marks one run. Operations with a poll interval were possibly served from cache, so they aren't required.
+    if action == 'events':
+        return {profile.events_operation}
+    return {o for o in profile.extractors[action].operations if o not in profile.poll_intervals}
+
+
+def replay(device: ReplayDevice, captured_responses: Iterator[CapturedResponse],
+           action_ids: List[str]) -> Iterator[Tuple[float, str, object]]:
+    # (epoch captured, action, result) for each run of the actions found in the captured responses
+    polled_operations = {a: get_polled_operations(device.profile, a) for a in action_ids}
+    for captured in captured_responses:
+        try:
+            operations = device.load(captured)
+        except ValueError as e:
+            logger.info('Skipping response at offset {} ({})'.format(captured.offset, e))
+            continue
+        for action_id in action_ids:
+            if operations and polled_operations[action_id] <= operations:
+                try:
+                    yield captured.epoch, action_id, getattr(device, actions[action_id])()
+                except (KeyError, ValueError) as e:
+                    logger.info('Cannot replay {} at offset {} ({})'.format(action_id, captured.offset, e))
+
+
+def write_result(device: ReplayDevice, action_id: str, epoch: float, result):
+    # Named and formatted like the monitor's stats files, so the ETL re-derives histories from them
+    captured_at = datetime.fromtimestamp(epoch)
+    unique = captured_at.strftime('%Y%m%d_%H%M%S_%f')
+    stats_file = build_partition_path(Path('devices', device.device_id, action_id), '{}.json'.format(unique))
+    stats_file.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(stats_file) as file:
+        file.write(json.dumps({'timestamp': captured_at.isoformat(), 'result': result}, default=to_json))
+    return stats_file
+
+
+def benchmark(device: ReplayDevice, capture: ResponseCapture, action_ids: List[str], offset: int) -> dict:
+    started_at = time.monotonic()
+    captured_responses = list(capture.read(offset))
+    loaded_secs = time.monotonic() - started_at
+
+    started_at = time.monotonic()
+    runs = sum(1 for _ in replay(device, iter(captured_responses), action_ids))
+    parsed_secs = time.monotonic() - started_at
+
+    parsed_bytes = sum(len(c.text) for c in captured_responses)
+    return {'responses': len(captured_responses),
+            'runs': runs,
+            'parsed_mb': round(parsed_bytes / 1024 / 1024, 2),
+            'load_secs': round(loaded_secs, 3),
+            'parse_secs': round(parsed_secs, 3),
+            'runs_per_sec': round(runs / parsed_secs, 1) if parsed_secs else None,
+            'mb_per_sec': round(parsed_bytes / 1024 / 1024 / parsed_secs, 1) if parsed_secs else None}
+
+
+def main():
+    log_config.configure('replay.log')
+
+    with open('devices/devices.json') as devices_file:
+        supported_devices = json.load(devices_file)
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--actions', nargs='*', default=list(actions.keys()), choices=actions.keys(),
+                        help='Actions to replay')
+    parser.add_argument('--offset', type=int, default=0, help='Replay captured responses from this offset')
+    parser.add_argument('--benchmark', action='store_true', help='Only time the parsers; write nothing')
+    parser.add_argument('device_id', choices=supported_devices.keys())
+    args = parser.parse_args()
+
+    device_attrs = supported_devices[args.device_id]
+    device = ReplayDevice(args.device_id, compiled_profiles[device_attrs.get('device_type', None) or args.device_id])
+    capture = ResponseCapture(build_capture_path(args.device_id))
+
+    if args.benchmark:
+        print(json.dumps(benchmark(device, capture, args.actions, args.offset), sort_keys=True))
+        return
+
+    written = 0
+    first_partitions = dict()
+    for (epoch, action_id, result) in replay(device, capture.read(args.offset), args.actions):
+        stats_file = write_result(device, action_id, epoch, result)
+        first_partitions.setdefault(action_id, to_partition(stats_file.name))
+        written += 1
+    # The results are older than what the ETL has processed; make it look at their partitions again
+    for (action_id, partition) in first_partitions.items():
+        rewind_partition(Path('devices', device.device_id, action_id), partition)
+    logger.info('Replayed {} results for {} from offset {}'.format(written, device, args.offset))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import logging
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# An append-only log of binary records split over segment files. Each record is a header (payload length, CRC32
+# of the payload, epoch seconds it was appended) followed by the payload. A record is addressed by its offset: the
+# number of bytes appended to the log before it, so segment files are named after the offset of their first record.
+record_header = struct.Struct('>IId')
+segment_suffix = '.seg'
+# Each segment has a sparse index of (epoch, position) entries, one at least every index_interval_bytes, used to
+# find records by time without reading whole segments
+index_entry = struct.Struct('>dQ')
+index_suffix = '.idx'
+index_interval_bytes = 64 * 1024
+
+
+def build_segment_path(path: Path, base_offset: int) -> Path:
+    return path / '{:020d}{}'.format(base_offset, segment_suffix)
+
+
+def build_index_path(path: Path, base_offset: int) -> Path:
+    return path / '{:020d}{}'.format(base_offset, index_suffix)
+
+
+def scan_segment(data: bytes, start: int = 0) -> Iterator[Tuple[int, float, bytes]]:
+    # (position, epoch, payload) of each complete record; stops at a torn or corrupt tail
+    pos = start
+    while pos + record_header.size <= len(data):
+        length, crc, epoch = record_header.unpack_from(data, pos)
+        payload = data[pos + record_header.size:pos + record_header.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        yield pos, epoch, payload
+        pos += record_header.size + length
+
+
+class SegmentLog:
+    def __init__(self, path: Path, max_segment_bytes: int = 16 * 1024 * 1024, max_segment_secs: int = 86400):
+        self.path = path
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_secs = max_segment_secs
+        self.active_file = None
+        self.active_index_file = None
+        self.active_base_offset = None
+        self.active_size = 0
+        self.active_started_at = None
+        self.active_indexed_at = None
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.path)
+
+    def get_base_offsets(self) -> List[int]:
+        if not self.path.is_dir():
+            return list()
+        with os.scandir(self.path) as entries:
+            return sorted(int(e.name[:-len(segment_suffix)]) for e in entries if e.name.endswith(segment_suffix))
+
+    def get_end_offset(self) -> int:
+        if self.active_file:
+            return self.active_base_offset + self.active_size
+        base_offsets = self.get_base_offsets()
+        if not base_offsets:
+            return 0
+        return base_offsets[-1] + build_segment_path(self.path, base_offsets[-1]).stat().st_size
+
+    def read_index(self, base_offset: int) -> List[Tuple[float, int]]:
+        index_file = build_index_path(self.path, base_offset)
+        if not index_file.exists():
+            return list()
+        data = index_file.read_bytes()
+        return [index_entry.unpack_from(data, pos) for pos in range(0, len(data) - index_entry.size + 1,
+                                                                     index_entry.size)]
+
+    def open_active(self):
+        # Resume the last segment, dropping any record torn by a crash mid-append
+        self.path.mkdir(parents=True, exist_ok=True)
+        base_offsets = self.get_base_offsets()
+        if not base_offsets:
+            self.roll(0)
+            return
+
+        segment_file = build_segment_path(self.path, base_offsets[-1])
+        data = segment_file.read_bytes()
+        size = 0
+        started_at = None
+        for (pos, epoch, payload) in scan_segment(data):
+            size = pos + record_header.size + len(payload)
+            started_at = epoch if started_at is None else started_at
+        if size < len(data):
+            logger.warning('Truncating {} torn bytes from {}'.format(len(data) - size, segment_file))
+            os.truncate(segment_file, size)
+
+        index = self.read_index(base_offsets[-1])
+        valid_index = [(epoch, pos) for (epoch, pos) in index if pos < size]
+        index_file = build_index_path(self.path, base_offsets[-1])
+        if len(valid_index) < len(index):
+            index_file.write_bytes(b''.join(index_entry.pack(*e) for e in valid_index))
+
+        self.active_file = segment_file.open(mode='ab')
+        self.active_index_file = index_file.open(mode='ab')
+        self.active_base_offset = base_offsets[-1]
+        self.active_size = size
+        self.active_started_at = started_at
+        self.active_indexed_at = valid_index[-1][1] if valid_index else None
+
+    def roll(self, base_offset: int):
+        self.close()
+        self.active_file = build_segment_path(self.path, base_offset).open(mode='ab')
+        self.active_index_file = build_index_path(self.path, base_offset).open(mode='ab')
+        self.active_base_offset = base_offset
+        self.active_size = 0
+        self.active_started_at = None
+        self.active_indexed_at = None
+
+    def append(self, payload: bytes, epoch: float = None) -> int:
+        # Offset of the appended record
+        epoch = time.time() if epoch is None else epoch
+        if not self.active_file:
+            self.open_active()
+        if self.active_size and (self.active_size >= self.max_segment_bytes or
+                                 epoch - self.active_started_at >= self.max_segment_secs):
+            self.roll(self.active_base_offset + self.active_size)
+
+        offset = self.active_base_offset + self.active_size
+        self.active_file.write(record_header.pack(len(payload), zlib.crc32(payload), epoch) + payload)
+        self.active_file.flush()
+        if self.active_indexed_at is None or self.active_size - self.active_indexed_at >= index_interval_bytes:
+            self.active_index_file.write(index_entry.pack(epoch, self.active_size))
+            self.active_index_file.flush()
+            self.active_indexed_at = self.active_size
+        self.active_size += record_header.size + len(payload)
+        if self.active_started_at is None:
+            self.active_started_at = epoch
+        return offset
+
+    def read(self, offset: int = 0, end_offset: Optional[int] = None) -> Iterator[Tuple[int, float, bytes]]:
+        # (offset, epoch, payload) of each record from offset on
+        base_offsets = self.get_base_offsets()
+        for (i, base_offset) in enumerate(base_offsets):
+            next_base_offset = base_offsets[i + 1] if i + 1 < len(base_offsets) else None
+            if next_base_offset is not None and next_base_offset <= offset:
+                continue
+            data = build_segment_path(self.path, base_offset).read_bytes()
+            for (pos, epoch, payload) in scan_segment(data, max(offset - base_offset, 0)):
+                if end_offset is not None and base_offset + pos >= end_offset:
+                    return
+                yield base_offset + pos, epoch, payload
+
+    def find_offset(self, epoch: float) -> int:
+        # Offset of the first record appended at or after epoch (or the end offset if there is none)
+        start_offset = 0
+        for base_offset in self.get_base_offsets():
+            index = self.read_index(base_offset)
+            if index and index[0][0] > epoch:
+                break
+            start_offset = base_offset + max((pos for (e, pos) in index if e <= epoch), default=0)
+        for (offset, record_epoch, _) in self.read(start_offset):
+            if record_epoch >= epoch:
+                return offset
+        return self.get_end_offset()
+
+    def delete_before(self, offset: int, modified_before: float) -> int:
+        # Deletes the segments that end at or before offset and were last appended to before modified_before
+        # (epoch seconds), e.g. once they have been consumed and aged out. Returns the bytes reclaimed.
+        base_offsets = self.get_base_offsets()
+        reclaimed = 0
+        for (base_offset, next_base_offset) in zip(base_offsets, base_offsets[1:]):
+            segment_file = build_segment_path(self.path, base_offset)
+            if next_base_offset > offset or segment_file.stat().st_mtime >= modified_before:
+                break
+            reclaimed += segment_file.stat().st_size
+            segment_file.unlink()
+            build_index_path(self.path, base_offset).unlink(missing_ok=True)
+        return reclaimed
+
+    def close(self):
+        if self.active_file:
+            self.active_file.close()
+            self.active_file = None
+        if self.active_index_file:
+            self.active_index_file.close()
+            self.active_index_file = None
@@ -0,0 +1,44 @@
+import random
+from unittest import TestCase
+
+from anomaly import AnomalyDetector, count_anomalous_channels
+from models import ConnectionDetails
+
+
+def build_details(power_dbmv: float, snr: float, corrected: int, uncorrected: int) -> ConnectionDetails:
+    downstream = [{'channel_id': c, 'lock_status': 'Locked', 'freq_mhz': 369.0 + c * 6, 'power_dbmv': power_dbmv,
+                   'modulation': 'QAM256', 'snr': snr, 'corrected': corrected, 'uncorrected': uncorrected}
+                  for c in range(1, 5)]
+    upstream = [{'channel_id': 1, 'lock_status': 'Locked', 'freq_mhz': 35.5, 'power_dbmv': 47.5,
+                 'channel_type': 'SC-QAM', 'symb_rate': 5120.0}]
+    return ConnectionDetails(downstream_channels=downstream, upstream_channels=upstream)
+
+
+class TestAnomalyDetector(TestCase):
+    def test_update(self):
+        rnd = random.Random(7)
+        detector = AnomalyDetector(threshold=4.0, warmup=10)
+        corrected = 1000
+        for _ in range(50):
+            corrected += rnd.randint(0, 50)
+            self.assertEqual([], detector.update(build_details(-7.0 + rnd.uniform(-0.2, 0.2),
+                                                               39.0 + rnd.uniform(-0.3, 0.3), corrected, 10)))
+
+        # An SNR drop across every downstream channel, along with a burst of uncorrectable codewords
+        anomalies = detector.update(build_details(-7.0, 30.0, corrected, 500))
+        self.assertEqual({('snr', 'fell'), ('uncorrected_delta', 'rose')},
+                         {(a.metric, a.to_desc().split()[-1]) for a in anomalies})
+        self.assertEqual(4, count_anomalous_channels(anomalies))
+        self.assertEqual('Anomaly: downstream channel 1 snr fell', anomalies[0].to_desc())
+
+        # Counters reset by a reboot make no delta (rather than a huge negative one)
+        self.assertEqual([], [a for a in detector.update(build_details(-7.0, 39.0, 0, 0)) if a.metric != 'snr'])
+
+    def test_state_is_per_channel(self):
+        detector = AnomalyDetector(warmup=2)
+        for _ in range(3):
+            detector.update(build_details(-7.0, 39.0, 0, 0))
+        # 4 downstream and 1 upstream channel, each with a fixed number of values
+        self.assertEqual(5, len(detector.channels))
+        self.assertEqual([3, -7.0, 0.0], detector.channels['downstream/1']['power_dbmv'])
+        self.assertEqual(0, detector.channels['downstream/1']['corrected'])
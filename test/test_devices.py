@@ -0,0 +1,143 @@
+from copy import deepcopy
+from datetime import datetime
+from unittest import TestCase
+
+from devices import create_device
+from devices.profile import ProfileDevice, compiled_profiles
+from hnap import GetMultipleCommands
+
+responses = {'GetMotoStatusConnectionInfoResponse': {'MotoConnNetworkAccess': 'Allowed',
+                                                     'MotoConnSystemUpTime': '0 days 01h:02m:03s'},
+             'GetMotoStatusStartupSequenceResponse': {'MotoConnDSFreq': '495000000 Hz', 'MotoConnDSComment': 'Locked',
+                                                      'MotoConnBootStatus': 'OK'},
+             'GetMotoStatusDownstreamChannelInfoResponse': {
+                 'MotoConnDownstreamChannel': '1^Locked^QAM256^32^495.0^-7.8^39.9^10^2^|+|'
+                                              '2^Locked^QAM256^33^501.0^-7.5^40.1^0^0^'},
+             'GetMotoStatusUpstreamChannelInfoResponse': {
+                 'MotoConnUpstreamChannel': '1^Locked^SC-QAM^1^5120^35.5^50.0^'},
+             'GetHomeAddressResponse': {'MotoHomeIpAddress': '10.0.0.2', 'MotoHomeMacAddress': '00:40:36:8c:cc:2d'},
+             'GetHomeConnectionResponse': {'MotoHomeDownNum': '2', 'MotoHomeUpNum': '1'},
+             'GetMotoStatusSoftwareResponse': {'StatusSoftwareSfVer': '7621-5.7.1.5'},
+             'GetMotoStatusLogResponse': {
+                 'MotoStatusLogList': '12:14:11^Tue Aug 16 2022\n^Critical (3)^Started Ranging}-{'
+                                      '12:18:05^Time Not Established^Notice (6)^Ranging OK'}}
+
+
+class FakeDevice(ProfileDevice):
+    def __init__(self, device_id, profile):
+        super().__init__(device_id, profile)
+        self.now = 0
+        self.clock = lambda: self.now
+        self.fetched = []
+        self.responses = deepcopy(responses)
+
+    def do_command(self, command, **kwargs) -> dict:
+        if isinstance(command, GetMultipleCommands):
+            self.fetched.extend(c.operation for c in command.commands)
+            return {'{}Response'.format(c.operation): dict(self.responses['{}Response'.format(c.operation)])
+                    for c in command.commands}
+        self.fetched.append(command.operation)
+        return dict(self.responses['{}Response'.format(command.operation)])
+
+
+class TestDevices(TestCase):
+    def test_create_device(self):
+        self.assertEqual(compiled_profiles['arris'], create_device('arris').profile)
+        self.assertEqual(compiled_profiles['motorola'], create_device('modem1', 'motorola').profile)
+        self.assertRaises(ValueError, create_device, 'modem1', 'unknown')
+
+    def test_get_connection_details(self):
+        details = FakeDevice('test', compiled_profiles['motorola']).get_connection_details()
+        self.assertEqual('Allowed', details.network_access)
+        self.assertEqual('Locked', details.startup_steps['downstream'].comment)
+        self.assertEqual('OK', details.startup_steps['boot'].status)
+        self.assertIsNone(details.startup_steps['security'].status)
+
+        self.assertEqual(2, len(details.downstream_channels))
+        self.assertEqual({'channel_id': 33, 'lock_status': 'Locked', 'freq_mhz': 501.0, 'power_dbmv': -7.5,
+                          'modulation': 'QAM256', 'snr': 40.1, 'corrected': 0, 'uncorrected': 0},
+                         vars(details.downstream_channels[1]))
+        self.assertEqual({'channel_id': 1, 'lock_status': 'Locked', 'freq_mhz': 35.5, 'power_dbmv': 50.0,
+                          'channel_type': 'SC-QAM', 'symb_rate': 5120.0}, vars(details.upstream_channels[0]))
+
+    def test_get_events(self):
+        events = FakeDevice('test', compiled_profiles['motorola']).get_events()
+        self.assertEqual(2, len(events))
+        self.assertEqual(datetime(2022, 8, 16, 12, 14, 11).isoformat(), events[0].timestamp)
+        self.assertEqual('Critical (3)', events[0].priority)
+        # Unparseable timestamps follow the previous event
+        self.assertEqual(datetime(2022, 8, 16, 12, 14, 12).isoformat(), events[1].timestamp)
+        self.assertEqual('Ranging OK', events[1].desc)
+
+    def test_poll_intervals(self):
+        device = FakeDevice('test', compiled_profiles['motorola'])
+        device.get_connection_details()
+        device.fetched.clear()
+
+        # The startup sequence is only re-read every 15 minutes, but the model is still complete
+        device.now = 300
+        details = device.get_connection_details()
+        self.assertNotIn('GetMotoStatusStartupSequence', device.fetched)
+        self.assertIn('GetMotoStatusDownstreamChannelInfo', device.fetched)
+        self.assertEqual('OK', details.startup_steps['boot'].status)
+
+        device.now = 900
+        device.get_connection_details()
+        self.assertIn('GetMotoStatusStartupSequence', device.fetched)
+
+    def test_poll_intervals_restart(self):
+        device = FakeDevice('test', compiled_profiles['motorola'])
+        device.get_connection_details()
+
+        # A restart we didn't ask for (the uptime went down) drops the cached sections right away
+        device.now = 300
+        device.responses['GetMotoStatusConnectionInfoResponse']['MotoConnSystemUpTime'] = '0 days 00h:01m:00s'
+        device.responses['GetMotoStatusStartupSequenceResponse']['MotoConnBootStatus'] = 'In Progress'
+        device.fetched.clear()
+        details = device.get_connection_details()
+        self.assertIn('GetMotoStatusStartupSequence', device.fetched)
+        self.assertEqual('In Progress', details.startup_steps['boot'].status)
+
+        # ...and they are cached again from then on
+        device.now = 600
+        device.responses['GetMotoStatusConnectionInfoResponse']['MotoConnSystemUpTime'] = '0 days 00h:06m:00s'
+        device.fetched.clear()
+        device.get_connection_details()
+        self.assertNotIn('GetMotoStatusStartupSequence', device.fetched)
+
+    def test_poll_intervals_restart_summary(self):
+        device = FakeDevice('test', compiled_profiles['motorola'])
+        device.get_connection_summary()
+        device.fetched.clear()
+
+        # Polls reusing cached sections check the uptime too, even if they don't need it themselves
+        device.now = 300
+        device.get_connection_summary()
+        self.assertEqual(['GetHomeConnection', 'GetMotoStatusConnectionInfo'], device.fetched)
+
+        device.now = 600
+        device.responses['GetMotoStatusConnectionInfoResponse']['MotoConnSystemUpTime'] = '0 days 00h:01m:00s'
+        device.responses['GetMotoStatusSoftwareResponse']['StatusSoftwareSfVer'] = '7621-5.7.1.6'
+        device.fetched.clear()
+        summary = device.get_connection_summary()
+        self.assertIn('GetMotoStatusSoftware', device.fetched)
+        self.assertIn('GetHomeAddress', device.fetched)
+        self.assertEqual('7621-5.7.1.6', summary.sw_version)
+
+    def test_events_poll_interval(self):
+        device = FakeDevice('test', compiled_profiles['motorola'])
+        polled = []
+        for now in range(0, 600, 30):
+            device.now = now
+            device.fetched.clear()
+            self.assertEqual(2, len(device.get_events()))
+            if device.fetched:
+                polled.append(now)
+        # An unchanged log is polled after 60, 120, 240... seconds
+        self.assertEqual([0, 60, 180, 420], polled)
+
+        new_event = '}-{12:20:00^Tue Aug 16 2022^Notice (6)^New'
+        device.responses['GetMotoStatusLogResponse']['MotoStatusLogList'] += new_event
+        device.now = 900
+        self.assertEqual(3, len(device.get_events()))
+        self.assertEqual(60, device.events_poll_interval)
@@ -0,0 +1,125 @@
+from unittest import TestCase
+
+import requests
+
+from hnap import CircuitBreaker, CircuitOpenError, HNAPDevice
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCommand:
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.calls = 0
+
+    def execute(self, session, **kwargs):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return {'Result': 'OK'}
+
+
+class FakeDevice(HNAPDevice):
+    def is_session_valid(self) -> bool:
+        return True
+
+
+class TestHNAP(TestCase):
+    def test_circuit_breaker(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, base_backoff_secs=10, max_backoff_secs=25, jitter=0,
+                                 clock=clock)
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.closed, breaker.state)
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.open, breaker.state)
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+
+        # After the backoff, one trial call is let through; its failure doubles the backoff
+        clock.now += 10
+        breaker.before_call()
+        self.assertEqual(CircuitBreaker.half_open, breaker.state)
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+        breaker.record_failure()
+        self.assertEqual(20, breaker.get_metrics()['retry_in_secs'])
+
+        clock.now += 20
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(25, breaker.get_metrics()['retry_in_secs'])
+
+        clock.now += 25
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual({'state': 'closed', 'consecutive_failures': 0, 'retry_in_secs': 0.0, 'failures_total': 4,
+                          'opened_total': 3, 'rejected_total': 2}, breaker.get_metrics())
+
+    def test_do_command_fails_fast(self):
+        device = FakeDevice('test')
+        device.breaker = CircuitBreaker(failure_threshold=3, clock=FakeClock())
+        unreachable = FakeCommand(requests.ConnectionError('unreachable'))
+        for _ in range(3):
+            self.assertRaises(requests.ConnectionError, device.do_command, unreachable)
+        self.assertRaises(CircuitOpenError, device.do_command, unreachable)
+        self.assertEqual(3, unreachable.calls)
+
+        # A device that answers, even with an error, is reachable
+        device.breaker = CircuitBreaker(failure_threshold=1, clock=FakeClock())
+        self.assertRaises(ValueError, device.do_command, FakeCommand(ValueError('rejected')))
+        self.assertEqual({'Result': 'OK'}, device.do_command(FakeCommand()))
+        self.assertEqual('closed', device.get_metrics()['circuit_breaker']['state'])
+
+    def test_do_command_inconclusive(self):
+        # An error that isn't the device's answer neither closes a half open circuit nor resets its backoff
+        clock = FakeClock()
+        device = FakeDevice('test')
+        device.breaker = CircuitBreaker(failure_threshold=1, base_backoff_secs=10, jitter=0, clock=clock)
+        self.assertRaises(requests.ConnectionError, device.do_command, FakeCommand(requests.ConnectionError('down')))
+        clock.now += 10
+        self.assertRaises(KeyError, device.do_command, FakeCommand(KeyError('MotoConnSystemUpTime')))
+        self.assertEqual(CircuitBreaker.half_open, device.breaker.state)
+        self.assertEqual(1, device.breaker.consecutive_opens)
+
+        # The next command is the trial
+        self.assertRaises(requests.ConnectionError, device.do_command, FakeCommand(requests.ConnectionError('down')))
+        self.assertEqual(CircuitBreaker.open, device.breaker.state)
+        self.assertEqual(20, device.get_metrics()['circuit_breaker']['retry_in_secs'])
+
+    def test_ping_tiers(self):
+        class PingDevice(FakeDevice):
+            def __init__(self):
+                super().__init__('test')
+                self.calls = []
+                self.http_up = True
+
+            def ping_tcp(self):
+                self.calls.append('tcp')
+
+            def ping_http(self):
+                self.calls.append('http')
+                if not self.http_up:
+                    raise requests.ConnectionError('no answer')
+
+            def do_command(self, command, **kwargs):
+                self.calls.append('hnap')
+
+        device = PingDevice()
+        device.hnap_ping_every = 3
+        # The first ping is in doubt so it's a full HNAP call; then cheap pings until the periodic HNAP call
+        self.assertEqual(['hnap', 'http', 'http', 'hnap', 'http'], [device.ping() for _ in range(5)])
+        self.assertEqual(['hnap', 'tcp', 'http', 'tcp', 'http', 'hnap', 'tcp', 'http'], device.calls)
+        self.assertEqual({'tcp', 'http', 'hnap'}, set(device.get_metrics()['ping_rtts'].keys()))
+
+        # A failed HTTP probe escalates to HNAP
+        device.calls.clear()
+        device.http_up = False
+        self.assertEqual('hnap', device.ping())
+        self.assertEqual(['tcp', 'http', 'hnap'], device.calls)
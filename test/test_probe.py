@@ -0,0 +1,62 @@
+from unittest import TestCase
+
+from requests import ConnectTimeout
+
+from hnap import CircuitOpenError, HNAPCommand, HNAPDevice, GetMultipleCommands
+from probe import probe_commands, time_commands
+
+rejected_operations = ['GetB', 'GetE']
+
+
+class FakeDevice(HNAPDevice):
+    def __init__(self, error: Exception = None):
+        super().__init__('test')
+        self.requests = 0
+        self.error = error
+
+    def do_command(self, command, **kwargs) -> dict:
+        self.requests += 1
+        if self.error:
+            raise self.error
+        commands = command.commands if isinstance(command, GetMultipleCommands) else [command]
+        for c in commands:
+            if c.operation in rejected_operations:
+                raise ValueError('Invalid {}Result=ERROR'.format(c.operation))
+        return dict()
+
+
+class TestProbe(TestCase):
+    def test_probe_commands(self):
+        device = FakeDevice()
+        commands = [HNAPCommand(o) for o in ['GetA', 'GetB', 'GetC', 'GetD', 'GetE', 'GetF', 'GetG', 'GetH']]
+        batches = list()
+        results = probe_commands(device, commands, batches)
+
+        self.assertEqual(8, len(results))
+        self.assertEqual(rejected_operations, sorted(o for (o, r) in results.items() if not r['supported']))
+        self.assertEqual(2, results['GetC']['batch_size'])
+        self.assertEqual(1, results['GetF']['batch_size'])
+        self.assertEqual(2, results['GetG']['batch_size'])
+        # Each accepted batch is timed once
+        self.assertEqual([['GetA'], ['GetC', 'GetD'], ['GetF'], ['GetG', 'GetH']],
+                         [b['operations'] for b in batches])
+        self.assertTrue(all(b['batch_latency_ms'] >= 0 for b in batches))
+        # Commands probed on their own already have their latency; the others are timed one by one
+        self.assertEqual(['GetA', 'GetF'], sorted(o for (o, r) in results.items() if 'latency_ms' in r))
+        # The batch, both halves and two of the quarters fail; that's 1 + 2 + 4 + 4 requests
+        self.assertEqual(11, device.requests)
+
+        time_commands(device, commands, results)
+        self.assertEqual(['GetA', 'GetC', 'GetD', 'GetF', 'GetG', 'GetH'],
+                         sorted(o for (o, r) in results.items() if 'latency_ms' in r))
+        self.assertTrue(all(r['latency_ms'] >= 0 for r in results.values() if r['supported']))
+        self.assertEqual(11 + 4, device.requests)
+
+    def test_probe_commands_unanswered(self):
+        # A device that doesn't answer hasn't rejected anything
+        commands = [HNAPCommand(o) for o in ['GetA', 'GetB']]
+        for error in [ConnectTimeout('timed out'), CircuitOpenError('open')]:
+            device = FakeDevice(error)
+            with self.assertRaises(type(error)):
+                probe_commands(device, commands)
+            self.assertEqual(1, device.requests)
@@ -0,0 +1,46 @@
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import TestCase, mock
+
+from reboot_planner import fleet_slot, plan_reboots, predict_recovery_secs, record_recovery
+
+
+class TestRebootPlanner(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.devices_path = Path(self.tmp_dir.name)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_plan_reboots(self):
+        device_ids = ['d1', 'd2', 'd3', 'd4', 'd5']
+        recovery_secs = {'d1': 120, 'd2': 150, 'd3': 120, 'd4': 120, 'd5': 90}
+        planned = plan_reboots(device_ids, '03:00', 60, 2, recovery_secs)
+        self.assertEqual(['03:00:00', '03:00:00', '03:20:00', '03:20:00', '03:40:00'],
+                         [planned[d]['reboot_at'] for d in device_ids])
+        self.assertEqual('03:02:30', planned['d2']['predicted_up_at'])
+
+        # A short window can't be honoured without overlapping waves, so it overruns
+        planned = plan_reboots(device_ids, '03:00', 4, 2, recovery_secs)
+        self.assertEqual(['03:00:00', '03:00:00', '03:02:30', '03:02:30', '03:04:30'],
+                         [planned[d]['reboot_at'] for d in device_ids])
+
+    @mock.patch('reboot_planner.build_recoveries_path')
+    def test_recoveries(self, build_recoveries_path):
+        build_recoveries_path.side_effect = lambda device_id: self.devices_path / device_id / 'reboots.json'
+        self.assertEqual(180, predict_recovery_secs('test_planner'))
+        rebooted_at = datetime(2022, 9, 9, 4)
+        for secs in [100, 300, 200]:
+            record_recovery('test_planner', rebooted_at, rebooted_at + timedelta(seconds=secs))
+        self.assertEqual(200, predict_recovery_secs('test_planner'))
+
+    def test_fleet_slot(self):
+        with mock.patch('reboot_planner.locks_path', self.devices_path / '.locks'):
+            with fleet_slot('test', 2, max_jitter_secs=0) as first:
+                with fleet_slot('test', 2, max_jitter_secs=0) as second:
+                    self.assertEqual((0, 1), (first, second))
+            with fleet_slot('test', 2, max_jitter_secs=0) as slot:
+                self.assertEqual(0, slot)
+        self.assertTrue((self.devices_path / '.locks' / 'test.1.lock').exists())
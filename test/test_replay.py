@@ -0,0 +1,79 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from capture import ResponseCapture
+from devices.profile import compiled_profiles
+from hnap import GetMultipleCommands, HNAPCommand, HNAPSession
+from replay import ReplayDevice, replay
+
+sections = {'GetMotoStatusConnectionInfoResponse': {'MotoConnNetworkAccess': 'Allowed', 'MotoConnSystemUpTime': '1',
+                                                    'GetMotoStatusConnectionInfoResult': 'OK'},
+            'GetMotoStatusStartupSequenceResponse': {'MotoConnBootStatus': 'OK',
+                                                     'GetMotoStatusStartupSequenceResult': 'OK'},
+            'GetMotoStatusDownstreamChannelInfoResponse': {
+                'MotoConnDownstreamChannel': '1^Locked^QAM256^32^495.0^-7.8^39.9^10^2^',
+                'GetMotoStatusDownstreamChannelInfoResult': 'OK'},
+            'GetMotoStatusUpstreamChannelInfoResponse': {
+                'MotoConnUpstreamChannel': '1^Locked^SC-QAM^1^5120^35.5^50.0^',
+                'GetMotoStatusUpstreamChannelInfoResult': 'OK'}}
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.status_code = 200
+        self.ok = True
+        self.text = text
+
+
+class FakeSession(HNAPSession):
+    def __init__(self, responses: list):
+        super().__init__('host', 'https', 'admin', 'password')
+        self.responses = responses
+
+    def do_request(self, method: str, url: str, **kwargs):
+        return FakeResponse(self.responses.pop(0))
+
+
+def build_multiple_response(operations: list, **overrides) -> str:
+    response = {'GetMultipleHNAPsResult': 'OK'}
+    for operation in operations:
+        response['{}Response'.format(operation)] = dict(sections['{}Response'.format(operation)], **overrides)
+    return json.dumps({'GetMultipleHNAPsResponse': response})
+
+
+class TestReplay(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.capture = ResponseCapture(Path(self.tmp_dir.name))
+
+    def tearDown(self) -> None:
+        self.capture.close()
+        self.tmp_dir.cleanup()
+
+    def test_capture_and_replay(self):
+        details = ['GetMotoStatusStartupSequence', 'GetMotoStatusConnectionInfo',
+                   'GetMotoStatusDownstreamChannelInfo', 'GetMotoStatusUpstreamChannelInfo']
+        polled = [o for o in details if o != 'GetMotoStatusStartupSequence']
+        session = FakeSession([build_multiple_response(details, MotoConnSystemUpTime='1'),
+                               build_multiple_response(polled, MotoConnSystemUpTime='2'),
+                               json.dumps({'LoginResponse': {'LoginResult': 'OK'}})])
+        session.capture = self.capture
+        GetMultipleCommands([HNAPCommand(o) for o in details]).execute(session)
+        GetMultipleCommands([HNAPCommand(o) for o in polled]).execute(session)
+        HNAPCommand('Login', capturable=False).execute(session)
+
+        captured = list(self.capture.read())
+        self.assertEqual(2, len(captured))
+        self.assertEqual('GetMultipleHNAPs.{}'.format('+'.join(polled)), captured[1].key)
+        # The second response is compressed against the first
+        segment_bytes = sum(f.stat().st_size for f in Path(self.tmp_dir.name, 'segments').glob('*.seg'))
+        self.assertLess(segment_bytes, len(captured[0].text))
+
+        device = ReplayDevice('test', compiled_profiles['motorola'])
+        results = list(replay(device, iter(captured), ['details', 'events']))
+        self.assertEqual(['1', '2'], [r.uptime for (_, _, r) in results])
+        # The startup sequence wasn't polled the second time, so the first response fills it in
+        self.assertEqual('OK', results[1][2].startup_steps['boot'].status)
+        self.assertEqual(495.0, results[1][2].downstream_channels[0].freq_mhz)
@@ -0,0 +1,56 @@
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase
+
+from segment_log import SegmentLog, record_header
+
+
+class TestSegmentLog(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_append_and_read(self):
+        log = SegmentLog(self.path, max_segment_bytes=1024, max_segment_secs=50)
+        offsets = [log.append('record {}'.format(i).encode(), epoch=i * 30) for i in range(6)]
+        log.close()
+
+        record_size = record_header.size + len(b'record 0')
+        self.assertEqual([i * record_size for i in range(6)], offsets)
+        # Segments roll once 50 seconds old (or over 1KB)
+        self.assertEqual([0, 2 * record_size, 4 * record_size], log.get_base_offsets())
+        self.assertEqual(6 * record_size, log.get_end_offset())
+
+        self.assertEqual(['record 3', 'record 4', 'record 5'],
+                         [p.decode() for (_, _, p) in log.read(offsets[3])])
+        self.assertEqual([(offsets[1], 30.0, b'record 1')], list(log.read(offsets[1], offsets[2])))
+
+        self.assertEqual(offsets[3], log.find_offset(90))
+        self.assertEqual(offsets[4], log.find_offset(91))
+        self.assertEqual(0, log.find_offset(-1))
+        self.assertEqual(log.get_end_offset(), log.find_offset(1000))
+
+        # Only whole segments before the offset are deleted, and never the active one
+        self.assertEqual(0, log.delete_before(offsets[3], modified_before=0))
+        self.assertEqual(2 * record_size, log.delete_before(offsets[3], modified_before=time.time() + 1))
+        self.assertEqual([2 * record_size, 4 * record_size], log.get_base_offsets())
+        self.assertEqual(['record 2', 'record 3'], [p.decode() for (_, _, p) in log.read(0, offsets[4])])
+
+    def test_torn_tail(self):
+        log = SegmentLog(self.path)
+        log.append(b'complete', epoch=1)
+        log.close()
+        segment_file = next(self.path.glob('*.seg'))
+        with segment_file.open(mode='ab') as file:
+            file.write(record_header.pack(100, 0, 2.0) + b'torn')
+
+        self.assertEqual([b'complete'], [p for (_, _, p) in log.read()])
+        # Appending again drops the torn record first
+        offset = log.append(b'next', epoch=3)
+        log.close()
+        self.assertEqual(record_header.size + len(b'complete'), offset)
+        self.assertEqual([b'complete', b'next'], [p for (_, _, p) in log.read()])
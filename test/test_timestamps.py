@@ -0,0 +1,28 @@
+from datetime import datetime
+from unittest import TestCase
+
+from models import EventLogEntry, to_json
+from timestamps import TimestampParser, to_epoch, to_iso
+
+
+class TestTimestamps(TestCase):
+    def test_timestamp_parser(self):
+        for (date_format, time_format, date_str, time_str) in [('%d/%m/%Y', '%H:%M:%S', '16/8/2022', '12:14:11'),
+                                                               ('%a %b %d %Y', '%H:%M:%S', 'Tue Aug 16 2022\n',
+                                                                '12:14:11')]:
+            parser = TimestampParser(date_format, time_format)
+            expected = datetime.strptime('{} {}'.format(date_str.strip(), time_str),
+                                         '{} {}'.format(date_format, time_format))
+            self.assertEqual(to_epoch(expected), parser.parse(date_str, time_str))
+
+        parser = TimestampParser('%a %b %d %Y', '%H:%M:%S')
+        self.assertRaises(ValueError, parser.parse, 'Time Not Established', '12:14:11')
+        self.assertRaises(ValueError, parser.parse, 'Tue Feb 30 2022', '12:14:11')
+        self.assertRaises(ValueError, parser.parse, 'Tue Aug 16 2022', '25:14:11')
+
+    def test_event_log_entry(self):
+        ts = datetime(2022, 9, 9, 9, 45, 4, 499721)
+        event = EventLogEntry(timestamp=ts, priority='Critical (3)', desc='d1')
+        self.assertEqual(ts.isoformat(), event.timestamp)
+        self.assertEqual(ts.isoformat(), to_iso(event.epoch))
+        self.assertEqual({'timestamp': ts.isoformat(), 'priority': 'Critical (3)', 'desc': 'd1'}, to_json(event))
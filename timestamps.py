@@ -0,0 +1,91 @@
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+# Timestamps are carried around as seconds since 1970-01-01T00:00:00 of the device clock (naive, like the
+# datetimes they replace) and only rendered as ISO text when written out
+epoch_origin = datetime(1970, 1, 1)
+epoch_ordinal = epoch_origin.toordinal()
+
+month_abbrevs = {m: i for (i, m) in enumerate(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct',
+                                               'Nov', 'Dec'], start=1)}
+
+# The strptime directives device timestamps use, as named regex groups
+directive_patterns = {'%Y': r'(?P<year>\d{4})',
+                      '%m': r'(?P<month>\d{1,2})',
+                      '%b': r'(?P<month_abbrev>[A-Za-z]{3})',
+                      '%d': r'(?P<day>\d{1,2})',
+                      '%a': r'[A-Za-z]+',
+                      '%H': r'(?P<hour>\d{1,2})',
+                      '%M': r'(?P<minute>\d{1,2})',
+                      '%S': r'(?P<second>\d{1,2})'}
+directive_pattern = re.compile(r'%[A-Za-z]')
+
+
+def to_epoch(ts: datetime) -> float:
+    return (ts - epoch_origin).total_seconds()
+
+
+def from_epoch(epoch: float) -> datetime:
+    return epoch_origin + timedelta(seconds=epoch)
+
+
+def to_iso(epoch: float) -> str:
+    return from_epoch(epoch).isoformat()
+
+
+@lru_cache(maxsize=4096)
+def parse_iso(timestamp: str) -> float:
+    return to_epoch(datetime.fromisoformat(timestamp))
+
+
+def compile_format(time_format: str) -> re.Pattern:
+    # e.g. '%a %b %d %Y' -> r'[A-Za-z]+\s+(?P<month_abbrev>[A-Za-z]{3})\s+(?P<day>\d{1,2})\s+(?P<year>\d{4})'
+    pattern = ''
+    pos = 0
+    for match in directive_pattern.finditer(time_format):
+        if match.group() not in directive_patterns:
+            raise ValueError('Unsupported directive {} in {}'.format(match.group(), time_format))
+        pattern += re.escape(time_format[pos:match.start()]) + directive_patterns[match.group()]
+        pos = match.end()
+    pattern += re.escape(time_format[pos:])
+    # Like strptime, any run of whitespace matches a space in the format
+    return re.compile(pattern.replace(re.escape(' '), r'\s+'))
+
+
+class TimestampParser:
+    # Parses a device's date and time strings (formatted as date_format and time_format) into an epoch. Device
+    # logs repeat the same few dates over and over, so parsed dates are cached.
+    def __init__(self, date_format: str, time_format: str):
+        self.date_format = date_format
+        self.time_format = time_format
+        self.date_pattern = compile_format(date_format)
+        self.time_pattern = compile_format(time_format)
+        self.parse_date = lru_cache(maxsize=1024)(self.parse_date)
+
+    def __repr__(self):
+        return '{}({} {})'.format(self.__class__.__name__, self.date_format, self.time_format)
+
+    def parse_date(self, date_str: str) -> int:
+        # Epoch of midnight on the date
+        match = self.date_pattern.fullmatch(date_str.strip())
+        if not match:
+            raise ValueError('{} does not match {}'.format(date_str, self.date_format))
+        parts = match.groupdict()
+        month = int(parts['month']) if parts.get('month') else month_abbrevs.get(parts.get('month_abbrev'), 0)
+        return (date(int(parts['year']), month, int(parts['day'])).toordinal() - epoch_ordinal) * 86400
+
+    def parse_time(self, time_str: str) -> int:
+        # Seconds since midnight
+        match = self.time_pattern.fullmatch(time_str.strip())
+        if not match:
+            raise ValueError('{} does not match {}'.format(time_str, self.time_format))
+        parts = match.groupdict()
+        hour, minute, second = (int(parts.get(g) or 0) for g in ['hour', 'minute', 'second'])
+        if hour > 23 or minute > 59 or second > 61:
+            raise ValueError('{} is not a valid time'.format(time_str))
+        return hour * 3600 + minute * 60 + second
+
+    def parse(self, date_str: str, time_str: str) -> int:
+        return self.parse_date(date_str) + self.parse_time(time_str)
+